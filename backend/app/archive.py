@@ -0,0 +1,267 @@
+"""
+Cold-data archival of closed orders.
+
+Usage:
+    python -m app.archive                      # archive closed orders older than 365 days
+    python -m app.archive --retention-days 180
+
+PAID and CANCELLED orders older than the retention window are written, together
+with their items, payment and SALE stock movements, to gzip-compressed NDJSON
+files under ``ARCHIVE_DIR`` (one per batch, branch and month, in a directory
+per branch and month). The rows are then deleted from the hot tables. Daily
+aggregates are kept in ``order_rollups`` so analytics over long periods still
+include archived orders, and ``archived_orders`` indexes which file holds each
+order. With ``BRANCH_SHARDS`` every database is archived in turn.
+
+A batch file is written under a ``.tmp`` name and only renamed once the
+transaction deleting its orders has committed. A run that stops in between
+leaves the ``.tmp`` file behind; the next run renames it if its orders were
+archived and deletes it if they were not (they are still in the hot tables
+and are written again), so no order is lost or archived twice.
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from . import models, schemas
+from .database import SessionLocal, engine_for_branch, get_shard_engine, shard_ids
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+CLOSED_STATUSES = ["PAID", "CANCELLED"]
+PENDING_SUFFIX = ".tmp"
+
+
+def _archive_path(branch_id: int, created_at: datetime, orders: List[models.Orders]) -> str:
+    order_ids = [order.order_id for order in orders]
+    return os.path.join(
+        "orders", f"branch_{branch_id}", created_at.strftime("%Y-%m"),
+        f"{min(order_ids)}-{max(order_ids)}.ndjson.gz")
+
+
+def _write_pending(path: str, orders: List[models.Orders]):
+    """Write orders to ``path`` + PENDING_SUFFIX and flush it to disk."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + PENDING_SUFFIX, "wb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8") as f:
+            for order in orders:
+                payload = schemas.Order.model_validate(order).model_dump(mode="json")
+                f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _finish_pending(archive_dir: str) -> int:
+    """
+    Settle the batch files a previous run left pending: keep (rename) those
+    whose orders were archived, delete the others. Returns the number kept.
+    """
+    kept = 0
+    for directory, _, names in os.walk(os.path.join(archive_dir, "orders")):
+        for name in names:
+            if not name.endswith(PENDING_SUFFIX):
+                continue
+            pending = os.path.join(directory, name)
+            path = pending[:-len(PENDING_SUFFIX)]
+            relative_path = os.path.relpath(path, archive_dir)
+            branch_id = int(relative_path.split(os.sep)[1][len("branch_"):])
+            db = SessionLocal(bind=engine_for_branch(branch_id))
+            try:
+                committed = db.query(models.ArchivedOrders.order_id).filter(
+                    models.ArchivedOrders.file_path == relative_path).first()
+            finally:
+                db.close()
+            if committed:
+                os.replace(pending, path)
+                kept += 1
+            else:
+                os.remove(pending)
+    return kept
+
+
+def _add_to_rollups(rollups: dict, order: models.Orders):
+    key = (
+        order.branch_id,
+        order.created_at.date(),
+        order.status,
+        order.order_type,
+        order.payment.payment_method if order.payment else None,
+        order.membership_id is not None,
+    )
+    row = rollups.setdefault(key, {
+        "order_count": 0, "item_count": 0,
+        "total_price": Decimal("0"), "paid_price": Decimal("0"),
+    })
+    row["order_count"] += 1
+    row["item_count"] += sum(item.quantity for item in order.order_items
+                             if item.status != "CANCELLED")
+    row["total_price"] += order.total_price or Decimal("0")
+    if order.payment:
+        row["paid_price"] += order.payment.paid_price or Decimal("0")
+
+
+def _merge_rollups(db: Session, rollups: dict):
+    for (branch_id, day, status, order_type, payment_method, is_member), values in rollups.items():
+        existing = db.query(models.OrderRollups).filter(
+            models.OrderRollups.branch_id == branch_id,
+            models.OrderRollups.day == day,
+            models.OrderRollups.status == status,
+            models.OrderRollups.order_type == order_type,
+            models.OrderRollups.payment_method.is_(None) if payment_method is None
+            else models.OrderRollups.payment_method == payment_method,
+            models.OrderRollups.is_member == is_member
+        ).first()
+        if existing:
+            existing.order_count += values["order_count"]
+            existing.item_count += values["item_count"]
+            existing.total_price += values["total_price"]
+            existing.paid_price += values["paid_price"]
+        else:
+            db.add(models.OrderRollups(
+                branch_id=branch_id, day=day, status=status, order_type=order_type,
+                payment_method=payment_method, is_member=is_member, **values
+            ))
+
+
+def archive_orders(retention_days: int = 365, batch_size: int = 500,
+                   archive_dir: Optional[str] = None) -> int:
+    """Archive closed orders older than ``retention_days`` on every database. Returns the count."""
+    archive_dir = archive_dir or ARCHIVE_DIR
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    kept = _finish_pending(archive_dir)
+    if kept:
+        print(f"  ✓ Kept {kept} batch files of an interrupted run")
+    return sum(_archive_shard(shard, cutoff, batch_size, archive_dir) for shard in shard_ids())
+
+
+def _archive_shard(shard: int, cutoff: datetime, batch_size: int, archive_dir: str) -> int:
+    archived = 0
+    db = SessionLocal(bind=get_shard_engine(shard))
+    try:
+        while True:
+            orders = db.query(models.Orders).options(
+                joinedload(models.Orders.employee),
+                joinedload(models.Orders.membership),
+                joinedload(models.Orders.branch),
+                selectinload(models.Orders.order_items).joinedload(
+                    models.OrderItems.menu_item),
+                joinedload(models.Orders.payment),
+                selectinload(models.Orders.stock_movements)
+            ).filter(
+                models.Orders.status.in_(CLOSED_STATUSES),
+                models.Orders.created_at < cutoff
+            ).order_by(models.Orders.order_id).limit(batch_size).all()
+            if not orders:
+                break
+
+            # 1. Write this batch's files under their pending names
+            by_month = {}
+            for order in orders:
+                by_month.setdefault(
+                    (order.branch_id, order.created_at.strftime("%Y-%m")), []).append(order)
+            by_file = {
+                _archive_path(file_orders[0].branch_id, file_orders[0].created_at, file_orders):
+                    file_orders
+                for file_orders in by_month.values()
+            }
+            for relative_path, file_orders in by_file.items():
+                _write_pending(os.path.join(archive_dir, relative_path), file_orders)
+
+            # 2. Rollups + index, then remove from hot tables, in one transaction
+            rollups = {}
+            for order in orders:
+                _add_to_rollups(rollups, order)
+            _merge_rollups(db, rollups)
+            for relative_path, file_orders in by_file.items():
+                for order in file_orders:
+                    db.add(models.ArchivedOrders(
+                        order_id=order.order_id,
+                        branch_id=order.branch_id,
+                        created_at=order.created_at,
+                        file_path=relative_path
+                    ))
+
+            order_ids = [order.order_id for order in orders]
+            db.query(models.StockMovements).filter(
+                models.StockMovements.order_id.in_(order_ids)
+            ).delete(synchronize_session=False)
+            db.query(models.Payments).filter(
+                models.Payments.order_id.in_(order_ids)
+            ).delete(synchronize_session=False)
+            db.query(models.OrderItems).filter(
+                models.OrderItems.order_id.in_(order_ids)
+            ).delete(synchronize_session=False)
+            db.query(models.Orders).filter(
+                models.Orders.order_id.in_(order_ids)
+            ).delete(synchronize_session=False)
+            db.commit()
+            db.expunge_all()
+
+            # 3. Committed: the files are now part of the archive
+            for relative_path in by_file:
+                path = os.path.join(archive_dir, relative_path)
+                os.replace(path + PENDING_SUFFIX, path)
+
+            archived += len(orders)
+            print(f"  ✓ Archived {archived} orders on shard {shard}")
+        return archived
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def load_archived_order(db: Session, order_id: int, archive_dir: Optional[str] = None) -> Optional[dict]:
+    """Return an archived order (as serialized by schemas.Order) or None."""
+    entry = db.query(models.ArchivedOrders).filter(
+        models.ArchivedOrders.order_id == order_id).first()
+    if not entry:
+        return None
+
+    path = os.path.join(archive_dir or ARCHIVE_DIR, entry.file_path)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            payload = json.loads(line)
+            if payload["order_id"] == order_id:
+                return payload
+    return None
+
+
+def rollups_query(db: Session, *columns, start: Optional[datetime] = None, branch_ids=None):
+    """
+    Query over archived-order rollups, for merging into live analytics.
+
+    Args:
+        columns: Columns/aggregates to select (e.g. func.sum(OrderRollups.order_count))
+        start: Only include days on/after this datetime's date
+        branch_ids: Optional branch filter
+    """
+    query = db.query(*columns)
+    if start is not None:
+        query = query.filter(models.OrderRollups.day >= start.date())
+    if branch_ids:
+        query = query.filter(models.OrderRollups.branch_id.in_(branch_ids))
+    return query
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Archive closed orders to compressed NDJSON files")
+    parser.add_argument("--retention-days", type=int, default=365,
+                        help="Keep closed orders newer than this in the hot tables")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--archive-dir", default=None,
+                        help=f"Output directory (default: ARCHIVE_DIR or '{ARCHIVE_DIR}')")
+    args = parser.parse_args()
+
+    print(f"Archiving closed orders older than {args.retention_days} days...")
+    count = archive_orders(args.retention_days, args.batch_size, args.archive_dir)
+    print(f"Archive complete! {count} orders archived.")
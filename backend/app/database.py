@@ -1,7 +1,11 @@
+from fastapi import HTTPException, Request
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
+import threading
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,11 +15,123 @@ DATABASE_URL = os.getenv(
     f"postgresql://{os.getenv('POSTGRES_USER', 'posuser')}:{os.getenv('POSTGRES_PASSWORD', 'pospass')}@{os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB', 'posdb')}"
 )
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Optional branch sharding: "1,2=<url>;3,4=<url>" sends the order-path
+# writes of branches 1 and 2 to the first database, 3 and 4 to the second.
+# Unlisted branches stay on DATABASE_URL (shard 0).
+BRANCH_SHARDS = os.getenv("BRANCH_SHARDS", "")
+BRANCH_HEADER = "X-Branch-Id"
 
 Base = declarative_base()
 
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def parse_branch_shards(spec: str) -> List[Tuple[List[int], str]]:
+    """Parse a BRANCH_SHARDS value into [(branch ids, url)], shard 1 first."""
+    shards = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        branches, sep, url = entry.partition("=")
+        try:
+            branch_ids = [int(b) for b in branches.split(",") if b.strip()]
+        except ValueError:
+            branch_ids = []
+        if not sep or not url.strip() or not branch_ids:
+            raise ValueError(f"Invalid BRANCH_SHARDS entry: {entry!r}")
+        shards.append((branch_ids, url.strip()))
+    return shards
+
+
+_shards = parse_branch_shards(BRANCH_SHARDS)
+_shard_by_branch = {branch_id: shard for shard, (branch_ids, _) in enumerate(_shards, 1)
+                    for branch_id in branch_ids}
+_shard_engines: Dict[int, Engine] = {}
+
+
+def pool_options(url: str = None) -> dict:
+    """
+    Connection pool sizing for this process.
+
+    ``DB_POOL_SIZE`` and ``DB_MAX_OVERFLOW`` are budgets for the whole server
+    and are split evenly across the ``WEB_CONCURRENCY`` worker processes, so
+    adding workers does not multiply the connections opened on PostgreSQL.
+    """
+    if (url or DATABASE_URL).startswith("sqlite"):
+        return {}
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return {
+        "pool_size": max(1, int(os.getenv("DB_POOL_SIZE", "20")) // workers),
+        "max_overflow": max(0, int(os.getenv("DB_MAX_OVERFLOW", "10")) // workers),
+    }
+
+
+def get_engine() -> Engine:
+    """
+    Return the engine, creating it on first use. Importing the app does not
+    touch the database, and each forked worker builds its own pool.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(DATABASE_URL, **pool_options())
+    return _engine
+
+
+def sharding_enabled() -> bool:
+    return bool(_shards)
+
+
+def shard_ids() -> List[int]:
+    """All databases: 0 (DATABASE_URL) and one per BRANCH_SHARDS entry."""
+    return list(range(len(_shards) + 1))
+
+
+def shard_branches(shard: int) -> List[int]:
+    """Branches routed to ``shard`` (empty for shard 0, which takes the rest)."""
+    return list(_shards[shard - 1][0]) if shard else []
+
+
+def shard_of(branch_id: Optional[int]) -> int:
+    return _shard_by_branch.get(branch_id, 0)
+
+
+def get_shard_engine(shard: int) -> Engine:
+    """Engine of a shard, created on first use (shard 0 is get_engine())."""
+    if shard == 0:
+        return get_engine()
+    engine = _shard_engines.get(shard)
+    if engine is None:
+        with _engine_lock:
+            engine = _shard_engines.get(shard)
+            if engine is None:
+                url = _shards[shard - 1][1]
+                engine = _shard_engines[shard] = create_engine(url, **pool_options(url))
+    return engine
+
+
+def engine_for_branch(branch_id: Optional[int]) -> Engine:
+    return get_shard_engine(shard_of(branch_id))
+
+
+class LazySessionmaker(sessionmaker):
+    """sessionmaker that binds to get_engine() when the first session opens."""
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None and "bind" not in local_kw:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = LazySessionmaker(autocommit=False, autoflush=False)
+
+
+def __getattr__(name):
+    # Keeps ``from .database import engine`` working; created on first access
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def get_db():
     db = SessionLocal()
@@ -23,3 +139,65 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_write_db():
+    """
+    Session for write endpoints. Objects are not expired on commit, so the
+    rows and relationships loaded while handling the request can be
+    serialized afterwards without being read again.
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def request_branch_id(request: Request) -> Optional[int]:
+    """Branch a request acts for: the X-Branch-Id header, else ?branch_id=."""
+    value = request.headers.get(BRANCH_HEADER) or request.query_params.get("branch_id")
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{BRANCH_HEADER} must be an integer")
+
+
+def _request_engine(request: Request) -> Engine:
+    if not sharding_enabled():
+        return get_engine()
+    return engine_for_branch(request_branch_id(request))
+
+
+def get_branch_db(request: Request):
+    """
+    Session for the branch-local tables (orders, order items, payments,
+    stock, stock movements): on the shard of the request's branch when
+    BRANCH_SHARDS is set, else the same as get_db.
+    """
+    db = SessionLocal(bind=_request_engine(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_branch_write_db(request: Request):
+    """get_write_db on the shard of the request's branch (see get_branch_db)."""
+    db = SessionLocal(bind=_request_engine(request), expire_on_commit=False)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def check_branch_shard(db: Session, branch_id: int):
+    """Reject writing ``branch_id`` rows through a session on another shard."""
+    if sharding_enabled() and db.get_bind() is not engine_for_branch(branch_id):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Branch {branch_id} is stored on another database shard; "
+                   f"send it in the {BRANCH_HEADER} header"
+        )
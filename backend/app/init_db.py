@@ -1,16 +1,53 @@
 """
 Initialize database and seed data
+
+Usage:
+    python -m app.init_db                # create tables and seed sample data
+    python -m app.init_db --schema-only  # create missing tables and triggers only (deploy/startup step)
 """
-from .database import engine, Base
-from .seed import seed_database
+import argparse
+
+from sqlalchemy.engine import Engine
+
+from .database import Base, get_engine
+from . import models  # noqa: F401  (registers all tables on Base.metadata)
+
+
+def create_schema(bind: Engine = None) -> None:
+    """
+    Create any missing tables (existing tables are left untouched) and, on
+    PostgreSQL, (re)install the change feed triggers and search indexes.
+    """
+    from .services.change_feed import install_triggers
+    from .services.member_search import install_search_indexes
+    from .services.payments import install_payment_indexes
+    from .services.kitchen import install_kitchen_indexes
+    from .services.forecast import install_forecast_indexes
+
+    bind = bind or get_engine()
+    Base.metadata.create_all(bind=bind)
+    install_triggers(bind)
+    install_search_indexes(bind)
+    install_payment_indexes(bind)
+    install_kitchen_indexes(bind)
+    install_forecast_indexes(bind)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create tables and seed sample data")
+    parser.add_argument("--schema-only", action="store_true",
+                        help="Create missing tables without seeding")
+    args = parser.parse_args()
+
     # Create all tables
     print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    create_schema()
     print("Tables created successfully!")
 
-    # Seed database
-    print("Seeding database...")
-    seed_database()
-    print("Database initialization complete!")
+    if not args.schema_only:
+        from .seed import seed_database
+
+        # Seed database
+        print("Seeding database...")
+        seed_database()
+        print("Database initialization complete!")
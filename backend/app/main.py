@@ -1,16 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, get_db
-from .models import Base
+from .utils.compression import CompressionMiddleware
+from .services.cache_bus import listener as cache_listener
 from .routers import (
     roles, employees, memberships, tiers, stock, menu,
-    recipe, ingredients, orders, order_items, payments, branches, dashboard, analytics
+    recipe, ingredients, orders, order_items, payments, branches, dashboard, analytics,
+    sync, changes, kitchen
 )
 
-# Create tables
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="POS System API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in every worker: keep this process's caches in step with the others
+    cache_listener.start()
+    yield
+    cache_listener.stop()
+
+
+# Tables are created by an explicit step (python -m app.init_db --schema-only),
+# not at import, so importing the app never needs a database connection.
+app = FastAPI(title="POS System API", version="1.0.0",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -20,8 +32,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Total-Count", "X-Total-Count-Kind"],
 )
 
+# Compress large responses (Brotli if installed, else gzip)
+app.add_middleware(CompressionMiddleware, minimum_size=1000)
+
 # Include routers
 app.include_router(roles.router)
 app.include_router(employees.router)
@@ -37,6 +53,9 @@ app.include_router(payments.router)
 app.include_router(branches.router)
 app.include_router(dashboard.router)
 app.include_router(analytics.router)
+app.include_router(sync.router)
+app.include_router(changes.router)
+app.include_router(kitchen.router)
 
 
 @app.get("/")
@@ -2,11 +2,14 @@ from sqlalchemy import (
     Column,
     Integer,
     String,
+    Date,
     DateTime,
     Boolean,
     ForeignKey,
     DECIMAL,
     CheckConstraint,
+    Index,
+    text,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -208,6 +211,12 @@ class Orders(Base):
 # -------------------------------------------------
 class OrderItems(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        # Kitchen queue: only the few lines still waiting for the kitchen
+        Index("ix_order_items_active", "order_id", "order_item_id",
+              postgresql_where=text("status IN ('ORDERED', 'PREPARING')"),
+              sqlite_where=text("status IN ('ORDERED', 'PREPARING')")),
+    )
     order_item_id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.order_id"), nullable=False)
     menu_item_id = Column(Integer, ForeignKey(
@@ -232,7 +241,7 @@ class Payments(Base):
     points_used = Column(Integer, default=0, nullable=False)
     payment_method = Column(String, nullable=False)
     payment_ref = Column(String, nullable=True)
-    paid_timestamp = Column(DateTime, nullable=True)
+    paid_timestamp = Column(DateTime, nullable=True, index=True)
 
     order = relationship("Orders", back_populates="payment")
 
@@ -250,9 +259,160 @@ class StockMovements(Base):
 
     qty_change = Column(DECIMAL(10, 2), nullable=False)
     reason = Column(String, nullable=False)  # RESTOCK, SALE, WASTE, ADJUST
-    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    # Indexed for the nightly usage aggregation (services/forecast.py)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False, index=True)
     note = Column(String, nullable=True)
 
     stock = relationship("Stock", back_populates="stock_movements")
     employee = relationship("Employees", back_populates="stock_movements")
     order = relationship("Orders", back_populates="stock_movements")
+
+
+# -------------------------------------------------
+# Sync Records (client UUID → server id, for idempotent offline sync)
+# -------------------------------------------------
+class SyncRecords(Base):
+    __tablename__ = "sync_records"
+
+    client_uuid = Column(String(36), primary_key=True)
+    entity_type = Column(String(20), nullable=False)  # ORDER, ORDER_ITEM, PAYMENT
+    server_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+# -------------------------------------------------
+# Archive (closed orders moved to compressed files)
+# -------------------------------------------------
+class ArchivedOrders(Base):
+    """Index of archived orders → archive file holding them."""
+    __tablename__ = "archived_orders"
+
+    order_id = Column(Integer, primary_key=True)
+    branch_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    file_path = Column(String(255), nullable=False)
+
+
+class OrderRollups(Base):
+    """Daily aggregates of archived orders, so analytics still cover them."""
+    __tablename__ = "order_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, nullable=False, index=True)
+    day = Column(Date, nullable=False, index=True)
+    status = Column(String, nullable=False)
+    order_type = Column(String, nullable=False)
+    payment_method = Column(String, nullable=True)
+    is_member = Column(Boolean, nullable=False)
+
+    order_count = Column(Integer, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+    total_price = Column(DECIMAL(12, 2), nullable=False, default=0)
+    paid_price = Column(DECIMAL(12, 2), nullable=False, default=0)
+
+
+# -------------------------------------------------
+# Sales counters (maintained on payment)
+# -------------------------------------------------
+class ItemSalesDaily(Base):
+    """Units, revenue and orders of each menu item per branch and day."""
+    __tablename__ = "item_sales_daily"
+    __table_args__ = (
+        # Upsert key; day first for date-window rankings
+        Index("ux_item_sales_daily_key", "day", "branch_id", "menu_item_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    branch_id = Column(Integer, nullable=False)
+    menu_item_id = Column(Integer, nullable=False)
+
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(12, 2), nullable=False, default=0)
+    order_count = Column(Integer, nullable=False, default=0)
+
+
+class EmployeeSalesDaily(Base):
+    """Orders taken, and paid orders, revenue and items prepared of them, per employee and day."""
+    __tablename__ = "employee_sales_daily"
+    __table_args__ = (
+        # Upsert key; day first for date-window rankings
+        Index("ux_employee_sales_daily_key", "day", "branch_id", "employee_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    branch_id = Column(Integer, nullable=False)
+    employee_id = Column(Integer, nullable=False)
+
+    orders_taken = Column(Integer, nullable=False, default=0)
+    paid_orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(12, 2), nullable=False, default=0)
+    items_prepared = Column(Integer, nullable=False, default=0)
+
+
+class ItemPairs(Base):
+    """Paid orders of a branch containing both menu items (each pair stored both ways)."""
+    __tablename__ = "item_pairs"
+    __table_args__ = (
+        # Upsert key
+        Index("ux_item_pairs_key", "branch_id", "menu_item_id", "companion_id", unique=True),
+        # An item's companions at a branch, read in count order
+        Index("ix_item_pairs_top", "branch_id", "menu_item_id", "order_count", "companion_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    branch_id = Column(Integer, nullable=False)
+    menu_item_id = Column(Integer, nullable=False)
+    companion_id = Column(Integer, nullable=False)
+
+    order_count = Column(Integer, nullable=False, default=0)
+
+
+# -------------------------------------------------
+# Inventory forecasts (refreshed nightly)
+# -------------------------------------------------
+class StockUsageDaily(Base):
+    """Quantity used (SALE) and wasted (WASTE) per stock row and day, from the ledger."""
+    __tablename__ = "stock_usage_daily"
+
+    stock_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    used = Column(DECIMAL(12, 2), nullable=False, default=0)
+    wasted = Column(DECIMAL(12, 2), nullable=False, default=0)
+
+
+class StockForecasts(Base):
+    """Expected daily usage and reorder point of a stock row."""
+    __tablename__ = "stock_forecasts"
+
+    stock_id = Column(Integer, primary_key=True)
+    branch_id = Column(Integer, nullable=False, index=True)
+    avg_daily_usage = Column(DECIMAL(12, 3), nullable=False, default=0)
+    daily_usage_stddev = Column(DECIMAL(12, 3), nullable=False, default=0)
+    reorder_point = Column(DECIMAL(10, 2), nullable=False, default=0)
+    computed_for = Column(Date, nullable=False)  # usage counted up to the day before
+
+
+# -------------------------------------------------
+# Recipe costs
+# -------------------------------------------------
+class IngredientCosts(Base):
+    """Weighted average cost per base unit of an ingredient at a branch, from priced restocks."""
+    __tablename__ = "ingredient_costs"
+
+    branch_id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, primary_key=True)
+    unit_cost = Column(DECIMAL(12, 4), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class MenuItemCosts(Base):
+    """Cached recipe cost of one portion at a branch; rows are deleted when an input changes."""
+    __tablename__ = "menu_item_costs"
+
+    branch_id = Column(Integer, primary_key=True)
+    menu_item_id = Column(Integer, primary_key=True)
+    unit_cost = Column(DECIMAL(12, 4), nullable=False)
+    # Recipe lines whose ingredient has no cost at the branch yet
+    uncosted_ingredients = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,232 @@
+"""
+Monthly range partitioning of orders and stock movements (PostgreSQL only).
+
+Usage:
+    python -m app.partitioning                 # create partitions for the next 3 months
+    python -m app.partitioning --months-ahead 6
+    python -m app.partitioning --convert       # one-off: convert existing tables
+    python -m app.partitioning --explain       # show partitions scanned per analytics period
+
+Converting a table rebuilds it as ``PARTITION BY RANGE (created_at)`` with one
+partition per month of existing data plus a default partition. PostgreSQL
+requires the partition key in every unique constraint, so the primary key
+becomes (id, created_at) and foreign keys pointing at ``orders`` are dropped;
+the ORM relationships are unaffected. Run the maintenance command from cron
+(e.g. daily) so next month's partition always exists before it is needed.
+With ``BRANCH_SHARDS`` the command runs on every database.
+"""
+import argparse
+import re
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .database import get_engine, get_shard_engine, shard_ids
+
+# table -> primary key column
+PARTITIONED_TABLES = {
+    "orders": "order_id",
+    "stock_movements": "movement_id",
+}
+
+# Foreign keys that cannot reference a partitioned orders table
+ORDER_REFERENCING_TABLES = ["order_items", "payments", "stock_movements"]
+
+
+def _month_start(d) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, months: int) -> date:
+    month_index = d.month - 1 + months
+    return date(d.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.strftime('%Y%m')}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+    ), {"table": table}).scalar())
+
+
+def create_month_partition(conn, table: str, month: date) -> bool:
+    """Create the partition holding ``month`` if missing. Returns True if created."""
+    name = _partition_name(table, month)
+    exists = conn.execute(
+        text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+    if exists:
+        return False
+
+    start, end = month.isoformat(), _add_months(month, 1).isoformat()
+    bounds = f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    has_default = conn.execute(
+        text("SELECT to_regclass(:name)"), {"name": f"{table}_default"}).scalar()
+    stray_rows = has_default and conn.execute(text(
+        f"SELECT 1 FROM {table}_default "
+        f"WHERE created_at >= '{start}' AND created_at < '{end}' LIMIT 1"
+    )).scalar()
+
+    if stray_rows:
+        # Rows already landed in the default partition: move them, then attach
+        conn.execute(text(
+            f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM {table}_default "
+            f"WHERE created_at >= '{start}' AND created_at < '{end}' RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"))
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds}"))
+    else:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+    return True
+
+
+def ensure_partitions(bind: Engine = None, months_ahead: int = 3) -> list:
+    """Create monthly partitions from the current month up to ``months_ahead``."""
+    bind = bind or get_engine()
+    created = []
+    if bind.dialect.name != "postgresql":
+        return created
+    current = _month_start(datetime.now())
+    with bind.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                continue
+            for offset in range(months_ahead + 1):
+                month = _add_months(current, offset)
+                if create_month_partition(conn, table, month):
+                    created.append(_partition_name(table, month))
+    return created
+
+
+def _constraints(conn, table: str, contype: str) -> list:
+    return conn.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid), confrelid::regclass::text "
+        "FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = :contype"
+    ), {"table": table, "contype": contype}).all()
+
+
+def convert_table(conn, table: str, id_column: str) -> None:
+    """Rebuild ``table`` as a monthly range-partitioned table, keeping its rows."""
+    legacy = f"{table}_legacy"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, :column)"),
+                            {"table": table, "column": id_column}).scalar()
+
+    if table == "orders":
+        for referencing in ORDER_REFERENCING_TABLES:
+            for name, _, referenced in _constraints(conn, referencing, "f"):
+                if referenced == "orders":
+                    conn.execute(
+                        text(f'ALTER TABLE {referencing} DROP CONSTRAINT "{name}"'))
+
+    foreign_keys = [
+        definition for _, definition, referenced in _constraints(conn, table, "f")
+        if referenced != "orders"
+    ]
+
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    # Free the primary key name for the new table
+    for name, _, _ in _constraints(conn, legacy, "p"):
+        conn.execute(text(
+            f'ALTER TABLE {legacy} RENAME CONSTRAINT "{name}" TO "{legacy}_pkey"'))
+
+    conn.execute(text(
+        f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS, "
+        f"PRIMARY KEY ({id_column}, created_at)) PARTITION BY RANGE (created_at)"
+    ))
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+
+    bounds = conn.execute(
+        text(f"SELECT MIN(created_at), MAX(created_at) FROM {legacy}")).first()
+    month = _month_start(bounds[0] or datetime.now())
+    last = _month_start(max(bounds[1] or datetime.now(), datetime.now()))
+    while month <= last:
+        create_month_partition(conn, table, month)
+        month = _add_months(month, 1)
+
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {legacy}"))
+    if sequence:
+        conn.execute(
+            text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{id_column}"))
+    conn.execute(text(f"DROP TABLE {legacy}"))
+
+    for definition in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {table} ADD {definition}"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_{id_column} ON {table} ({id_column})"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_created_at ON {table} (created_at)"))
+
+
+def convert_all(bind: Engine = None) -> list:
+    """Convert every table in PARTITIONED_TABLES that is not partitioned yet."""
+    bind = bind or get_engine()
+    converted = []
+    if bind.dialect.name != "postgresql":
+        return converted
+    with bind.begin() as conn:
+        for table, id_column in PARTITIONED_TABLES.items():
+            if is_partitioned(conn, table):
+                continue
+            convert_table(conn, table, id_column)
+            converted.append(table)
+    return converted
+
+
+def explain_periods(bind: Engine = None) -> dict:
+    """
+    EXPLAIN the ``created_at`` filter used by analytics for every period and
+    return the partitions each plan touches.
+    """
+    from .routers.analytics import get_date_range
+
+    bind = bind or get_engine()
+    plans = {}
+    with bind.connect() as conn:
+        for period in ["today", "7days", "30days", "1year", "all"]:
+            start, now = get_date_range(period)
+            for table in PARTITIONED_TABLES:
+                rows = conn.execute(text(
+                    f"EXPLAIN SELECT count(*) FROM {table} "
+                    f"WHERE created_at >= :start AND created_at <= :now"
+                ), {"start": start, "now": now}).scalars().all()
+                partition = re.compile(rf"^{table}_(p\d{{6}}|default)$")
+                scanned = sorted({
+                    word for line in rows for word in line.split()
+                    if partition.match(word)
+                })
+                plans[(period, table)] = scanned
+    return plans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage monthly partitions of orders and stock_movements")
+    parser.add_argument("--convert", action="store_true",
+                        help="Convert existing tables to partitioned tables")
+    parser.add_argument("--months-ahead", type=int, default=3,
+                        help="Number of future monthly partitions to keep ready")
+    parser.add_argument("--explain", action="store_true",
+                        help="Show partitions scanned for each analytics period")
+    args = parser.parse_args()
+
+    for shard in shard_ids():
+        bind = get_shard_engine(shard)
+        if bind.dialect.name != "postgresql":
+            print(f"Shard {shard}: partitioning is only supported on PostgreSQL - nothing to do.")
+            continue
+        if args.convert:
+            for table in convert_all(bind):
+                print(f"✓ Converted {table} to monthly partitions on shard {shard}")
+        for name in ensure_partitions(bind, months_ahead=args.months_ahead):
+            print(f"✓ Created partition {name} on shard {shard}")
+        if args.explain:
+            for (period, table), partitions in explain_periods(bind).items():
+                print(f"  shard {shard} {period:<7} {table:<16} {len(partitions)} partition(s): "
+                      f"{', '.join(partitions) or '-'}")
+    print("Partition maintenance complete!")
@@ -0,0 +1,89 @@
+"""
+Rebuild the analytics counters that orders and payments maintain.
+
+Usage:
+    python -m app.rollups --rebuild item-sales                     # days after the last archived order
+    python -m app.rollups --rebuild item-sales --since 2026-01-01
+    python -m app.rollups --rebuild companions                     # item pairs of all live orders
+    python -m app.rollups --rebuild companions --since 2026-01-01  # ... of orders since then only
+    python -m app.rollups --rebuild employee-sales                 # days after the last archived order
+    python -m app.rollups --rebuild stock-usage                    # usage window and stock forecasts
+    python -m app.rollups --rebuild menu-costs                     # recompute cached recipe costs
+    python -m app.rollups --refresh-forecasts                      # nightly: yesterday's usage, forecasts
+
+Orders and payments keep these tables current as they commit. A rebuild
+recomputes them from the orders still in the hot tables, e.g. after an
+import or after enabling the counters on an existing database. Item and
+employee sales days already archived are kept unless ``--since`` reaches
+back into them; the item pair matrix has no days and is rebuilt whole,
+without archived orders. Run it while no orders or payments are being
+taken: one committed during the rebuild can be counted twice or missed.
+With ``BRANCH_SHARDS`` every database is rebuilt separately.
+
+Stock usage and forecasts are not maintained by payments: schedule
+``--refresh-forecasts`` once a day, after midnight. It only reads the ledger
+movements of the days since its previous run. Cached menu item costs are
+dropped by the writes that change them and filled again when read.
+"""
+import argparse
+from datetime import date
+
+from .database import SessionLocal, get_shard_engine, shard_ids
+from .services.companions import rebuild_pairs
+from .services.costing import rebuild_menu_costs
+from .services.employee_sales import rebuild_employee_sales
+from .services.forecast import rebuild_stock_usage, refresh
+from .services.item_sales import rebuild_item_sales
+
+REBUILDERS = {
+    "item-sales": rebuild_item_sales,
+    "companions": rebuild_pairs,
+    "employee-sales": rebuild_employee_sales,
+    "stock-usage": rebuild_stock_usage,
+    "menu-costs": rebuild_menu_costs,
+}
+
+
+def _on_every_shard(job) -> dict:
+    written = {}
+    for shard in shard_ids():
+        db = SessionLocal(bind=get_shard_engine(shard))
+        try:
+            written[shard] = job(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return written
+
+
+def rebuild(name: str, since: date = None) -> dict:
+    """Rebuild one counter table on every database. Returns rows written per shard."""
+    return _on_every_shard(lambda db: REBUILDERS[name](db, since))
+
+
+def refresh_forecasts() -> dict:
+    """Nightly stock usage and forecast refresh on every database. Returns forecasts per shard."""
+    return _on_every_shard(refresh)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild analytics counter tables")
+    parser.add_argument("--rebuild", choices=sorted(REBUILDERS), action="append", default=[],
+                        help="Counter table to rebuild (repeatable)")
+    parser.add_argument("--refresh-forecasts", action="store_true",
+                        help="Add yesterday's stock usage and recompute the stock forecasts")
+    parser.add_argument("--since", type=date.fromisoformat, default=None,
+                        help="First day to rebuild, or to count orders from (YYYY-MM-DD)")
+    args = parser.parse_args()
+    if not args.rebuild and not args.refresh_forecasts:
+        parser.error("nothing to do: give --rebuild and/or --refresh-forecasts")
+
+    for name in args.rebuild:
+        for shard, rows in rebuild(name, args.since).items():
+            print(f"✓ Rebuilt {name} on shard {shard}: {rows} rows")
+    if args.refresh_forecasts:
+        for shard, rows in refresh_forecasts().items():
+            print(f"✓ Refreshed stock forecasts on shard {shard}: {rows} rows")
@@ -4,7 +4,12 @@ from sqlalchemy import func, case, desc
 from typing import List, Optional, Any
 from datetime import datetime, timedelta
 from app.database import get_db
-from app.models import Orders, OrderItems, Branches, Menu, Memberships, Tiers, Employees, Roles, StockMovements, Stock, Ingredients, Payments
+from app.models import Orders, OrderItems, Branches, Menu, Memberships, Tiers, Employees, Roles, StockMovements, Stock, Ingredients, Payments, OrderRollups, StockForecasts
+from app.archive import rollups_query
+from app.services.fanout import fan_out, sum_by_key, top_k
+from app.services.costing import margins
+from app.services.employee_sales import employee_totals
+from app.services.forecast import needs_reorder
 import math
 
 router = APIRouter(
@@ -43,6 +48,14 @@ def get_order_stats(db: Session = Depends(get_db)):
     paid = db.query(func.count(Orders.order_id)).filter(Orders.status == 'PAID').scalar()
     pending = db.query(func.count(Orders.order_id)).filter(Orders.status == 'PENDING').scalar()
     cancelled = db.query(func.count(Orders.order_id)).filter(Orders.status == 'CANCELLED').scalar()
+
+    # Archived (closed) orders only survive as rollups
+    archived = dict(rollups_query(
+        db, OrderRollups.status, func.sum(OrderRollups.order_count)
+    ).group_by(OrderRollups.status).all())
+    total += int(sum(archived.values()))
+    paid += int(archived.get('PAID', 0))
+    cancelled += int(archived.get('CANCELLED', 0))
     
     return {
         "total_orders": total,
@@ -104,6 +117,26 @@ def get_order_trend(
         # Let's count ALL to be safe as "Volume".
         pass 
 
+        def archived_results(start):
+            """
+            Archived orders since ``start`` as (created_at, amount, label) rows,
+            from their daily rollups. Rollups keep no items, so the category
+            split only covers orders still in the hot tables.
+            """
+            if split_by == "category":
+                return []
+            columns = [OrderRollups.day]
+            if split_by == "type":
+                columns.append(OrderRollups.order_type)
+            rows = rollups_query(
+                db, *columns, func.sum(OrderRollups.order_count), start=start
+            ).group_by(*columns).all()
+            return [
+                (datetime.combine(row[0], time.min), row[-1],
+                 row[1] if split_by == "type" else "value")
+                for row in rows
+            ]
+
         # Helper to process results
         def aggregate_results(results, labels, label_key_func):
             agg_data = {}
@@ -147,6 +180,7 @@ def get_order_trend(
             days = 7 if period == "7days" else 30
             start_date = (now - timedelta(days=days-1)).date()
             results = query.filter(func.date(Orders.created_at) >= start_date).all()
+            results += archived_results(datetime.combine(start_date, time.min))
             labels = [start_date + timedelta(days=i) for i in range(days)]
             final = aggregate_results(results, labels, lambda t: t.date())
             for i, label in enumerate(labels): final[i]["name"] = label.strftime("%d/%m")
@@ -160,6 +194,7 @@ def get_order_trend(
                 start_date = datetime(2020, 1, 1)
             
             results = query.filter(Orders.created_at >= start_date).all()
+            results += archived_results(start_date)
             
             # Dynamic monthly buckets from start_date to now
             months = []
@@ -193,11 +228,23 @@ def get_channel_mix(period: str = "today", db: Session = Depends(get_db)):
         Orders.order_type,
         func.count(Orders.order_id).label("value")
     ).filter(date_filter).group_by(Orders.order_type).all()
+
+    counts = {r.order_type: r.value for r in results}
+    start, _ = get_date_range(period)
+    archived = rollups_query(
+        db, OrderRollups.order_type, func.sum(OrderRollups.order_count), start=start
+    ).group_by(OrderRollups.order_type).all()
+    for order_type, value in archived:
+        counts[order_type] = counts.get(order_type, 0) + int(value)
     
-    return [{"name": r.order_type or "Unknown", "value": r.value} for r in results]
+    return [{"name": order_type or "Unknown", "value": value} for order_type, value in counts.items()]
 
 @router.get("/ticket-size")
 def get_ticket_size(period: str = "today", db: Session = Depends(get_db)):
+    """
+    Covers only orders still in the hot tables (the archive retention
+    window): archived orders are rolled up per day, without their totals.
+    """
     date_filter = get_date_filter(period)
     
     # Get all order totals
@@ -225,6 +272,10 @@ def get_ticket_size(period: str = "today", db: Session = Depends(get_db)):
 
 @router.get("/basket-size")
 def get_basket_size(period: str = "today", db: Session = Depends(get_db)):
+    """
+    Covers only orders still in the hot tables (the archive retention
+    window): archived orders are rolled up per day, without their items.
+    """
     date_filter = get_date_filter(period)
     
     # Calculate item count per order
@@ -252,16 +303,35 @@ def get_basket_size(period: str = "today", db: Session = Depends(get_db)):
     sorted_keys = sorted(buckets.keys(), key=lambda x: 99 if x == "5+" else int(x))
     return [{"items": k, "count": buckets[k]} for k in sorted_keys]
 
+def _order_counts_by_branch(db: Session, branch_ids: Optional[List[int]], start: datetime) -> dict:
+    """{branch_id: live and archived orders since ``start``} of a branch group."""
+    query = db.query(
+        Orders.branch_id,
+        func.count(Orders.order_id)
+    ).filter(Orders.created_at >= start)
+    if branch_ids:
+        query = query.filter(Orders.branch_id.in_(branch_ids))
+    counts = dict(query.group_by(Orders.branch_id).all())
+
+    archived = rollups_query(
+        db, OrderRollups.branch_id, func.sum(OrderRollups.order_count),
+        start=start, branch_ids=branch_ids
+    ).group_by(OrderRollups.branch_id).all()
+    for branch_id, value in archived:
+        counts[branch_id] = counts.get(branch_id, 0) + int(value)
+    return counts
+
 @router.get("/top-branches-volume")
 def get_top_branches_volume(period: str = "today", db: Session = Depends(get_db)):
-    date_filter = get_date_filter(period)
-    
-    results = db.query(
-        Branches.name,
-        func.count(Orders.order_id).label("value")
-    ).join(Branches).filter(date_filter).group_by(Branches.name).order_by(desc("value")).limit(5).all()
-    
-    return [{"name": r.name, "value": r.value} for r in results]
+    start, _ = get_date_range(period)
+
+    # Counted per branch group in parallel, then added up
+    counts = sum_by_key(fan_out(
+        db, lambda session, group: _order_counts_by_branch(session, group, start)))
+    top = top_k(counts, 5)
+    names = dict(db.query(Branches.branch_id, Branches.name).filter(
+        Branches.branch_id.in_([branch_id for branch_id, _ in top])).all())
+    return [{"name": names.get(branch_id), "value": value} for branch_id, value in top]
 
 @router.get("/membership-stats")
 def get_membership_stats(
@@ -398,99 +468,66 @@ def get_employee_stats(db: Session = Depends(get_db)):
 
 @router.get("/top-sales-employees")
 def get_top_sales_employees(period: str = "30days", db: Session = Depends(get_db)):
-    # Connect Orders -> Employees
-    # Filter by date range
+    # Paid revenue per employee from the daily employee counters
     start_date, _ = get_date_range(period)
-    
-    results = db.query(
-        Employees.first_name,
-        Employees.last_name,
-        func.sum(Orders.total_price).label("revenue")
-    ).join(Orders, Employees.employee_id == Orders.employee_id)\
-     .filter(Orders.created_at >= start_date, Orders.status == 'PAID')\
-     .group_by(Employees.employee_id, Employees.first_name, Employees.last_name)\
-     .order_by(func.sum(Orders.total_price).desc())\
-     .limit(10).all()
-     
-    return [
-        {"name": f"{r.first_name} {r.last_name}", "value": r.revenue}
-        for r in results
-    ]
+    totals = employee_totals(db, start=start_date.date())
+
+    top = top_k({employee_id: values["revenue"] for employee_id, values in totals.items()
+                 if values["paid_orders"] > 0}, 10)
+    names = {r.employee_id: f"{r.first_name} {r.last_name}" for r in db.query(
+        Employees.employee_id, Employees.first_name, Employees.last_name
+    ).filter(Employees.employee_id.in_([employee_id for employee_id, _ in top]))}
+    return [{"name": names.get(employee_id), "value": revenue} for employee_id, revenue in top]
 
 
 
 @router.get("/efficiency-matrix")
 def get_efficiency_matrix(period: str = "30days", db: Session = Depends(get_db)):
     start_date, _ = get_date_range(period)
-    
-    # Get revenue per employee first
-    revenue_subquery = db.query(
-        Orders.employee_id,
-        func.sum(Orders.total_price).label("revenue")
-    ).filter(
-        Orders.created_at >= start_date, 
-        Orders.status == 'PAID'
-    ).group_by(Orders.employee_id).subquery()
-    
-    # Join with Employees to get salary and role
+    totals = employee_totals(db, start=start_date.date())
+
+    # Active employees with salary and role
     results = db.query(
+        Employees.employee_id,
         Employees.first_name,
         Employees.last_name,
         Employees.salary,
-        Roles.role_name,
-        func.coalesce(revenue_subquery.c.revenue, 0).label("revenue")
-    ).outerjoin(revenue_subquery, Employees.employee_id == revenue_subquery.c.employee_id)\
-     .join(Roles, Employees.role_id == Roles.role_id)\
+        Roles.role_name
+    ).join(Roles, Employees.role_id == Roles.role_id)\
      .filter(Employees.is_deleted == False).all()
-     
-    return [
-        {
+
+    data = []
+    for r in results:
+        values = totals.get(r.employee_id, {})
+        data.append({
             "name": f"{r.first_name} {r.last_name}",
             "role": r.role_name,
             "salary": r.salary,
-            "revenue": r.revenue
-        }
-        for r in results
-    ]
+            "revenue": values.get("revenue", 0),
+            "orders": values.get("paid_orders", 0),
+            "items_prepared": values.get("items_prepared", 0)
+        })
+    return data
 
 @router.get("/tenure-distribution")
 def get_tenure_distribution(db: Session = Depends(get_db)):
-    # Calculate days since joined
-    # Only for active employees? Or all? Usually active for current workforce analysis.
-    
-    # SQLite/Postgres difference for date diff might be tricky with portable code
-    # Let's fetch joined_date and compute in python for simplicity and database agnostic safety (within reason)
-    
-    employees = db.query(Employees.joined_date).filter(Employees.is_deleted == False).all()
-    
-    now = datetime.now()
-    data = []
-    
+    # Active employees bucketed by days since joining, counted by the database
     # Buckets: <90 days, 90-180, 180-365, >1 year (365+)
-    buckets = {
-        "< 90 Days": 0,
-        "3-6 Months": 0,
-        "6-12 Months": 0,
-        "> 1 Year": 0
-    }
-    
-    for emp in employees:
-        if not emp.joined_date:
-            continue
-        delta = now - emp.joined_date
-        days = delta.days
-        
-        if days < 90:
-            buckets["< 90 Days"] += 1
-        elif days < 180:
-            buckets["3-6 Months"] += 1
-        elif days < 365:
-            buckets["6-12 Months"] += 1
-        else:
-            buckets["> 1 Year"] += 1
-            
+    now = datetime.now()
+    bucket = case(
+        (Employees.joined_date > now - timedelta(days=90), "< 90 Days"),
+        (Employees.joined_date > now - timedelta(days=180), "3-6 Months"),
+        (Employees.joined_date > now - timedelta(days=365), "6-12 Months"),
+        else_="> 1 Year"
+    )
+    counts = dict(db.query(bucket, func.count(Employees.employee_id)).filter(
+        Employees.is_deleted == False,
+        Employees.joined_date.isnot(None)
+    ).group_by(bucket).all())
+
     return [
-        {"name": k, "value": v} for k, v in buckets.items()
+        {"name": name, "value": counts.get(name, 0)}
+        for name in ("< 90 Days", "3-6 Months", "6-12 Months", "> 1 Year")
     ]
 
 @router.get("/employees-by-branch")
@@ -535,24 +572,40 @@ def get_value_gap(
     db: Session = Depends(get_db)
 ):
     date_filter = get_date_filter(period)
-    
-    # Avg Ticket Size Member
-    member_avg = db.query(func.avg(Orders.total_price)).filter(
-        date_filter,
-        Orders.membership_id.isnot(None),
-        Orders.status == 'PAID'
-    ).scalar() or 0
-    
-    # Avg Ticket Size Non-Member
-    non_member_avg = db.query(func.avg(Orders.total_price)).filter(
-        date_filter,
-        Orders.membership_id.is_(None),
-        Orders.status == 'PAID'
-    ).scalar() or 0
+    start, _ = get_date_range(period)
+
+    # Avg Ticket Size of Members / Non-Members, as {is_member: [revenue, orders]}
+    # (sums rather than AVG, so archived rollups can be added in)
+    totals = {}
+    for is_member, membership_filter in ((True, Orders.membership_id.isnot(None)),
+                                         (False, Orders.membership_id.is_(None))):
+        revenue, count = db.query(
+            func.sum(Orders.total_price), func.count(Orders.order_id)
+        ).filter(
+            date_filter,
+            membership_filter,
+            Orders.status == 'PAID'
+        ).one()
+        totals[is_member] = [revenue or 0, count]
+
+    archived = rollups_query(
+        db,
+        OrderRollups.is_member,
+        func.sum(OrderRollups.total_price),
+        func.sum(OrderRollups.order_count),
+        start=start
+    ).filter(OrderRollups.status == 'PAID').group_by(OrderRollups.is_member).all()
+    for is_member, revenue, count in archived:
+        totals[bool(is_member)][0] += revenue or 0
+        totals[bool(is_member)][1] += int(count)
+
+    def average(is_member):
+        revenue, count = totals[is_member]
+        return float(round(revenue / count, 2)) if count else 0.0
     
     return [
-        {"name": "Member", "value": float(round(member_avg, 2))},
-        {"name": "Guest", "value": float(round(non_member_avg, 2))}
+        {"name": "Member", "value": average(True)},
+        {"name": "Guest", "value": average(False)}
     ]
 
 @router.get("/revenue-by-tier")
@@ -560,6 +613,10 @@ def get_revenue_by_tier(
     period: str = "today",
     db: Session = Depends(get_db)
 ):
+    """
+    Covers only orders still in the hot tables (the archive retention
+    window): archived orders are rolled up without their membership tier.
+    """
     date_filter = get_date_filter(period)
     
     results = db.query(
@@ -579,6 +636,38 @@ def get_revenue_by_tier(
         for r in results
     ]
 
+# -------------------------------------------------------------------
+# Margin Analytics
+# -------------------------------------------------------------------
+
+@router.get("/margins")
+def get_margins(
+    group_by: str = Query("branch", regex="^(branch|category)$"),
+    period: str = "30days",
+    branch_ids: Optional[List[int]] = Query(None),
+    db: Session = Depends(get_db)
+):
+    # Units sold (daily item sales counters) x cached recipe cost per portion
+    start, _ = get_date_range(period)
+    totals = margins(db, group_by, branch_ids, start.date())
+    names = {}
+    if group_by == "branch":
+        names = dict(db.query(Branches.branch_id, Branches.name).filter(
+            Branches.branch_id.in_(list(totals))).all())
+
+    results = []
+    for key, values in totals.items():
+        revenue, cost = float(values["revenue"]), float(values["cost"])
+        results.append({
+            "name": names.get(key, key),
+            "revenue": round(revenue, 2),
+            "cost": round(cost, 2),
+            "margin": round(revenue - cost, 2),
+            "margin_pct": round((revenue - cost) / revenue * 100, 1) if revenue else None,
+            "uncosted_revenue": round(float(values["uncosted_revenue"]), 2),
+        })
+    return sorted(results, key=lambda r: r["margin"], reverse=True)
+
 # -------------------------------------------------------------------
 # Inventory Analytics
 # -------------------------------------------------------------------
@@ -588,9 +677,11 @@ def get_inventory_stats(db: Session = Depends(get_db)):
     # Total Items (unique ingredients in stock)
     total_items = db.query(func.count(Ingredients.ingredient_id)).filter(Ingredients.is_deleted == False).scalar() or 0
     
-    # Low Stock (arbitrary threshold < 10 for now)
-    low_stock_count = db.query(func.count(Stock.stock_id)).filter(
-        Stock.amount_remaining < 10,
+    # Low Stock: at or below the forecast reorder point (services/forecast.py)
+    low_stock_count = db.query(func.count(Stock.stock_id)).join(
+        StockForecasts, StockForecasts.stock_id == Stock.stock_id
+    ).filter(
+        needs_reorder(),
         Stock.is_deleted == False
     ).scalar() or 0
     
@@ -756,9 +847,6 @@ def get_payment_stats(
         Orders.status == 'PAID'
     ).scalar() or 0
     
-    # 3. ATV
-    atv = revenue / paid_count if paid_count > 0 else 0
-    
     # 4. Total Orders (for Cancellation Rate)
     total_count = db.query(func.count(Orders.order_id)).filter(
         Orders.created_at >= start,
@@ -772,15 +860,36 @@ def get_payment_stats(
         Orders.status == 'CANCELLED'
     ).scalar() or 0
     
-    # 6. Cancellation Rate
-    cancel_rate = (cancelled_count / total_count * 100) if total_count > 0 else 0
-    
     # 7. Lost Revenue (Sum of potential total_price of Cancelled orders)
     lost_revenue = db.query(func.sum(Orders.total_price)).filter(
         Orders.created_at >= start,
         Orders.created_at <= now,
         Orders.status == 'CANCELLED'
     ).scalar() or 0
+
+    # Archived orders (kept as daily rollups)
+    archived = rollups_query(
+        db,
+        OrderRollups.status,
+        func.sum(OrderRollups.order_count),
+        func.sum(OrderRollups.total_price),
+        func.sum(OrderRollups.paid_price),
+        start=start
+    ).group_by(OrderRollups.status).all()
+    for status, count, total_price, paid_price in archived:
+        total_count += int(count)
+        if status == 'PAID':
+            paid_count += int(count)
+            revenue += paid_price or 0
+        elif status == 'CANCELLED':
+            cancelled_count += int(count)
+            lost_revenue += total_price or 0
+
+    # 3. ATV
+    atv = revenue / paid_count if paid_count > 0 else 0
+
+    # 6. Cancellation Rate
+    cancel_rate = (cancelled_count / total_count * 100) if total_count > 0 else 0
     
     return {
         "realized_revenue": float(revenue),
@@ -809,8 +918,15 @@ def get_payment_method_share(
         Orders.created_at >= start,
         Orders.created_at <= now
     ).group_by(Payments.payment_method).all()
-    
-    return [{"name": r.payment_method, "value": float(r.value or 0)} for r in results]
+
+    totals = {r.payment_method: float(r.value or 0) for r in results}
+    archived = rollups_query(
+        db, OrderRollups.payment_method, func.sum(OrderRollups.paid_price), start=start
+    ).filter(OrderRollups.payment_method.isnot(None)).group_by(OrderRollups.payment_method).all()
+    for method, value in archived:
+        totals[method] = totals.get(method, 0.0) + float(value or 0)
+    
+    return [{"name": method, "value": value} for method, value in totals.items()]
 
 @router.get("/atv-by-method")
 def get_atv_by_method(
@@ -819,25 +935,45 @@ def get_atv_by_method(
 ):
     start, now = get_date_range(period)
     
-    # Group by payment method, avg paid_price (or sum/count)
-    # Using AVG(paid_price) per transaction
+    # Group by payment method, avg paid_price per transaction
+    # (as sum/count, so archived rollups can be added in)
     results = db.query(
         Payments.payment_method,
-        func.avg(Payments.paid_price).label("value")
+        func.sum(Payments.paid_price),
+        func.count(Payments.order_id)
     ).join(
         Orders, Payments.order_id == Orders.order_id
     ).filter(
         Orders.created_at >= start,
         Orders.created_at <= now
     ).group_by(Payments.payment_method).all()
-    
-    return [{"name": r.payment_method, "value": float(r.value or 0)} for r in results]
+    totals = {method: [value or 0, count] for method, value, count in results}
+
+    archived = rollups_query(
+        db,
+        OrderRollups.payment_method,
+        func.sum(OrderRollups.paid_price),
+        func.sum(OrderRollups.order_count),
+        start=start
+    ).filter(OrderRollups.payment_method.isnot(None)).group_by(OrderRollups.payment_method).all()
+    for method, value, count in archived:
+        total = totals.setdefault(method, [0, 0])
+        total[0] += value or 0
+        total[1] += int(count)
+    
+    return [{"name": method, "value": float(value / count) if count else 0.0}
+            for method, (value, count) in totals.items()]
 
 @router.get("/wallet-share-by-tier")
 def get_wallet_share_by_tier(
     period: str = Query("30days", regex="^(today|7days|30days|1year)$"),
     db: Session = Depends(get_db)
 ):
+    """
+    Archived orders are rolled up without their membership tier, so only
+    the Non-Member row includes them; the tiers cover the orders still in
+    the hot tables (the archive retention window).
+    """
     start, now = get_date_range(period)
     
     # We want: Tier Name (or "Non-Member") -> Payment Method breakdown
@@ -876,6 +1012,17 @@ def get_wallet_share_by_tier(
             data_map[t_name] = {"name": t_name}
         
         data_map[t_name][method] = float(value or 0)
+
+    archived = rollups_query(
+        db, OrderRollups.payment_method, func.sum(OrderRollups.paid_price), start=start
+    ).filter(
+        OrderRollups.status == 'PAID',
+        OrderRollups.is_member == False,
+        OrderRollups.payment_method.isnot(None)
+    ).group_by(OrderRollups.payment_method).all()
+    for method, value in archived:
+        row = data_map.setdefault("Non-Member", {"name": "Non-Member"})
+        row[method] = row.get(method, 0.0) + float(value or 0)
         
     # Ensure Non-Member is present? 
     if "Non-Member" not in data_map:
@@ -895,6 +1042,10 @@ def get_cash_inflow_heatmap(
     period: str = Query("30days", regex="^(today|7days|30days|1year)$"),
     db: Session = Depends(get_db)
 ):
+    """
+    Covers only orders still in the hot tables (the archive retention
+    window): archived orders are rolled up per day, without the hour.
+    """
     start, now = get_date_range(period)
     
     # Heatmap: Day of Week (0-6) x Hour (0-23)
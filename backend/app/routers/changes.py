@@ -0,0 +1,68 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import orjson
+from ..services import change_feed
+
+router = APIRouter(prefix="/api/changes", tags=["changes"])
+
+KEEPALIVE_SECONDS = 15
+QUEUE_SIZE = 1000
+
+
+def _offer(queue: asyncio.Queue, change: change_feed.Change):
+    """Runs on the event loop; a stalled client loses its oldest events."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(change)
+
+
+@router.get("/stream")
+async def stream_changes(
+    request: Request,
+    tables: Optional[str] = Query(
+        None, description="Comma-separated tables, e.g. orders,stock (default: all)"),
+    branch_id: Optional[int] = Query(
+        None, description="Only changes carrying this branch_id (orders, stock, employees)")
+):
+    """
+    Server-sent events for committed changes to the change feed tables
+    (menu, recipe, ingredients, tiers, stock, orders, order_items, payments,
+    employees, roles, memberships, branches). Each event is named after its table
+    and its data is ``{"op", "id", ...extra columns}``; clients re-read what
+    they display.
+    """
+    table_set = {t.strip() for t in tables.split(",") if t.strip()} if tables else None
+    unknown = (table_set or set()) - set(change_feed.FEED_TABLES)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid tables. Must be among: {', '.join(change_feed.FEED_TABLES)}"
+        )
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def on_change(change: change_feed.Change):
+        if branch_id is not None and change.fields.get("branch_id") != branch_id:
+            return
+        loop.call_soon_threadsafe(_offer, queue, change)
+
+    token = change_feed.subscribe(on_change, table_set)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    change = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                data = orjson.dumps({"op": change.op, "id": change.id, **change.fields})
+                yield b"event: " + change.table.encode() + b"\ndata: " + data + b"\n\n"
+        finally:
+            change_feed.unsubscribe(token)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
@@ -2,13 +2,133 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from decimal import Decimal
+from datetime import date
 from typing import Optional, List
 from ..database import get_db
 from .. import models, schemas
+from ..archive import rollups_query
+from ..services.fanout import fan_out, sum_by_key, sum_nested, top_k
+from ..services.item_sales import top_items
 
 router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
 
 
+def _branch_stats(db: Session, branch_ids: Optional[List[int]]) -> dict:
+    """Order, revenue and stock counts of one database (shard)."""
+    # 1. Orders statistics
+    orders_query = db.query(models.Orders)
+    if branch_ids:
+        orders_query = orders_query.filter(
+            models.Orders.branch_id.in_(branch_ids))
+
+    total_orders = orders_query.count()
+    paid_orders = orders_query.filter(
+        models.Orders.status == "PAID").count()
+    pending_orders = orders_query.filter(
+        models.Orders.status == "PENDING").count()
+
+    # 2. Revenue calculation (sum of all paid_price from payments)
+    payments_query = db.query(func.sum(models.Payments.paid_price))
+    if branch_ids:
+        # Join with orders to filter by branch
+        payments_query = payments_query.join(
+            models.Orders, models.Payments.order_id == models.Orders.order_id
+        ).filter(models.Orders.branch_id.in_(branch_ids))
+
+    total_revenue_result = payments_query.scalar()
+    total_revenue = float(
+        total_revenue_result) if total_revenue_result else 0.0
+
+    # Archived (closed) orders are only kept as rollups
+    archived = rollups_query(
+        db,
+        models.OrderRollups.status,
+        func.sum(models.OrderRollups.order_count),
+        func.sum(models.OrderRollups.paid_price),
+        branch_ids=branch_ids
+    ).group_by(models.OrderRollups.status).all()
+    for status, count, paid_price in archived:
+        total_orders += int(count)
+        if status == "PAID":
+            paid_orders += int(count)
+            total_revenue += float(paid_price or 0)
+
+    # 6. Out of stock count
+    stock_query = db.query(func.count(models.Stock.stock_id)).filter(
+        models.Stock.amount_remaining == 0
+    )
+    if branch_ids:
+        stock_query = stock_query.filter(
+            models.Stock.branch_id.in_(branch_ids))
+
+    return {
+        "total_orders": total_orders,
+        "paid_orders": paid_orders,
+        "pending_orders": pending_orders,
+        "total_revenue": total_revenue,
+        "out_of_stock_count": stock_query.scalar() or 0,
+    }
+
+
+def _paid_sales_by_branch(db: Session, branch_ids: Optional[List[int]], start,
+                          archived: bool = False) -> dict:
+    """{branch_id: PAID sales since ``start``}, with archived rollups if ``archived``."""
+    query = db.query(
+        models.Orders.branch_id,
+        func.sum(models.Orders.total_price)
+    ).filter(
+        models.Orders.status == 'PAID',
+        models.Orders.created_at >= start
+    )
+    if branch_ids:
+        query = query.filter(models.Orders.branch_id.in_(branch_ids))
+    totals = {branch_id: float(total or 0)
+              for branch_id, total in query.group_by(models.Orders.branch_id)}
+
+    if archived:
+        rollups = rollups_query(
+            db,
+            models.OrderRollups.branch_id,
+            func.sum(models.OrderRollups.total_price),
+            start=start,
+            branch_ids=branch_ids
+        ).filter(
+            models.OrderRollups.status == 'PAID'
+        ).group_by(models.OrderRollups.branch_id)
+        for branch_id, total in rollups:
+            totals[branch_id] = totals.get(branch_id, 0.0) + float(total or 0)
+    return totals
+
+
+def _category_sales_by_branch(db: Session, branch_ids: Optional[List[int]], start) -> dict:
+    """{branch_id: {category: PAID item sales since ``start``}}."""
+    query = db.query(
+        models.Orders.branch_id,
+        models.Menu.category,
+        func.sum(models.OrderItems.line_total)
+    ).join(
+        models.OrderItems, models.Orders.order_id == models.OrderItems.order_id
+    ).join(
+        models.Menu, models.OrderItems.menu_item_id == models.Menu.menu_item_id
+    ).filter(
+        models.Orders.status == 'PAID',
+        models.Orders.created_at >= start
+    )
+    if branch_ids:
+        query = query.filter(models.Orders.branch_id.in_(branch_ids))
+
+    sales = {}
+    for branch_id, category, amount in query.group_by(
+            models.Orders.branch_id, models.Menu.category):
+        sales.setdefault(branch_id, {})[category] = float(amount or 0)
+    return sales
+
+
+def _branch_names(db: Session, branch_ids: List[int]) -> dict:
+    return dict(db.query(models.Branches.branch_id, models.Branches.name).filter(
+        models.Branches.branch_id.in_(branch_ids)).all())
+
+
 @router.get("/stats")
 def get_dashboard_stats(
     branch_ids: Optional[List[int]] = Query(None),
@@ -16,29 +136,8 @@ def get_dashboard_stats(
 ):
     """Get aggregated dashboard statistics."""
     try:
-        # 1. Orders statistics
-        orders_query = db.query(models.Orders)
-        if branch_ids:
-            orders_query = orders_query.filter(
-                models.Orders.branch_id.in_(branch_ids))
-
-        total_orders = orders_query.count()
-        paid_orders = orders_query.filter(
-            models.Orders.status == "PAID").count()
-        pending_orders = orders_query.filter(
-            models.Orders.status == "PENDING").count()
-
-        # 2. Revenue calculation (sum of all paid_price from payments)
-        payments_query = db.query(func.sum(models.Payments.paid_price))
-        if branch_ids:
-            # Join with orders to filter by branch
-            payments_query = payments_query.join(
-                models.Orders, models.Payments.order_id == models.Orders.order_id
-            ).filter(models.Orders.branch_id.in_(branch_ids))
-
-        total_revenue_result = payments_query.scalar()
-        total_revenue = float(
-            total_revenue_result) if total_revenue_result else 0.0
+        # 1, 2 and 6 are per branch: summed over the branch groups
+        stats = sum_by_key(fan_out(db, _branch_stats, branch_ids))
 
         # 3. Menu statistics
         menus_query = db.query(models.Menu)
@@ -57,25 +156,16 @@ def get_dashboard_stats(
         # 5. Membership statistics
         total_memberships = db.query(models.Memberships).count()
 
-        # 6. Out of stock count
-        stock_query = db.query(func.count(models.Stock.stock_id)).filter(
-            models.Stock.amount_remaining == 0
-        )
-        if branch_ids:
-            stock_query = stock_query.filter(
-                models.Stock.branch_id.in_(branch_ids))
-        out_of_stock_count = stock_query.scalar() or 0
-
         return {
-            "total_orders": total_orders,
-            "paid_orders": paid_orders,
-            "pending_orders": pending_orders,
-            "total_revenue": total_revenue,
+            "total_orders": stats["total_orders"],
+            "paid_orders": stats["paid_orders"],
+            "pending_orders": stats["pending_orders"],
+            "total_revenue": stats["total_revenue"],
             "total_menus": total_menus,
             "available_menus": available_menus,
             "total_employees": total_employees,
             "total_memberships": total_memberships,
-            "out_of_stock_count": out_of_stock_count,
+            "out_of_stock_count": stats["out_of_stock_count"],
         }
     except Exception as e:
         raise HTTPException(
@@ -100,121 +190,127 @@ def get_sales_chart_data(
     
     If split_by_type is True, returns breakdown by order_type.
     If split_by_category is True, returns breakdown by Menu.category.
+
+    Archived orders are included from their daily rollups, except in the
+    hourly (today) and category charts: rollups keep neither the hour nor
+    the items, so those cover only orders still in the hot tables.
     """
     try:
-        from datetime import datetime, timedelta, date, time
-        from sqlalchemy import extract, func, cast, Date
+        from datetime import datetime, timedelta, time
 
         now = datetime.now()
-        data = []
-
-        # Base query depends on split method
-        # If splitting by category, we must join OrderItems and Menu
-        if split_by_category:
-            query = db.query(
-                models.Orders.created_at,
-                models.OrderItems.line_total.label("amount"),
-                models.Menu.category.label("category")
-            ).join(
-                models.OrderItems, models.Orders.order_id == models.OrderItems.order_id
-            ).join(
-                models.Menu, models.OrderItems.menu_item_id == models.Menu.menu_item_id
-            ).filter(models.Orders.status == 'PAID')
-        else:
-            # Default or split_by_type uses Orders table directly
-            query = db.query(
-                models.Orders.created_at,
-                models.Orders.total_price.label("amount"),
-                models.Orders.order_type
-            ).filter(models.Orders.status == 'PAID')
-
-        if branch_ids:
-            query = query.filter(models.Orders.branch_id.in_(branch_ids))
+        end = None
 
-        # Helper to process results into {label: {type: value}} or {label: value}
-        def aggregate_results(results, labels, label_key_func):
-            agg_data = {}
-            # Initialize with 0 or dict
-            is_split = split_by_type or split_by_category
-            
-            for label in labels:
-                agg_data[label] = {} if is_split else 0.0
-
-            if split_by_category:
-                for t, amount, category in results:
-                    key = label_key_func(t)
-                    if key in agg_data:
-                        amt = float(amount)
-                        current_cat_val = agg_data[key].get(category, 0.0)
-                        agg_data[key][category] = current_cat_val + amt
-            elif split_by_type:
-                for t, amount, o_type in results:
-                    key = label_key_func(t)
-                    if key in agg_data:
-                        amt = float(amount)
-                        current_type_val = agg_data[key].get(o_type, 0.0)
-                        agg_data[key][o_type] = current_type_val + amt
-            else:
-                for t, amount, _ in results:
-                    key = label_key_func(t)
-                    if key in agg_data:
-                        agg_data[key] += float(amount)
-            
-            # Flatten for response
-            final_data = []
-            for label in labels:
-                item = {"name": str(label)}
-                val = agg_data[label]
-                if is_split:
-                    item.update(val)
-                else:
-                    item["value"] = val
-                final_data.append(item)
-            return final_data
-
-        # Determine Date Range
+        # Buckets: label keys, the key of an order's created_at and its display name
         if period == "today":
-            start_of_day = datetime.combine(now.date(), time.min)
-            end_of_day = datetime.combine(now.date(), time.max)
-            results = query.filter(models.Orders.created_at >= start_of_day, models.Orders.created_at <= end_of_day).all()
+            start = datetime.combine(now.date(), time.min)
+            end = datetime.combine(now.date(), time.max)
             labels = list(range(24))
-            final = aggregate_results(results, labels, lambda t: t.hour)
-            for item in final: item["name"] = f"{int(item['name']):02d}:00"
-            return final
+            bucket_of = lambda t: t.hour
+            label_name = lambda label: f"{label:02d}:00"
 
         elif period == "7days" or period == "30days":
             days = 7 if period == "7days" else 30
             start_date = (now - timedelta(days=days-1)).date()
-            results = query.filter(func.date(models.Orders.created_at) >= start_date).all()
+            start = datetime.combine(start_date, time.min)
             labels = [start_date + timedelta(days=i) for i in range(days)]
-            final = aggregate_results(results, labels, lambda t: t.date())
-            for i, label in enumerate(labels): final[i]["name"] = label.strftime("%d/%m")
-            return final
+            bucket_of = lambda t: t.date()
+            label_name = lambda label: label.strftime("%d/%m")
 
-        elif period == "1year" or period == "all":
+        else:  # 1year / all: monthly buckets
             if period == "1year":
-                start_date = (now - timedelta(days=365))
+                start = (now - timedelta(days=365))
             else:
-                start_date = datetime(2020, 1, 1) # All time start
+                start = datetime(2020, 1, 1) # All time start
 
-            results = query.filter(models.Orders.created_at >= start_date).all()
-            
-            # Dynamic monthly buckets
-            months = []
-            curr = start_date.replace(day=1)
+            labels = []
+            curr = start.replace(day=1)
             end_date = now.date()
             while curr.date() <= end_date:
-                months.append(curr.date())
+                labels.append(curr.date())
                 # Increment month
                 if curr.month == 12:
                     curr = curr.replace(year=curr.year+1, month=1)
                 else:
                     curr = curr.replace(month=curr.month+1)
-            
-            final = aggregate_results(results, months, lambda t: t.date().replace(day=1))
-            for i, d in enumerate(months): final[i]["name"] = d.strftime("%b %Y")
-            return final
+            bucket_of = lambda t: t.date().replace(day=1)
+            label_name = lambda label: label.strftime("%b %Y")
+
+        is_split = split_by_type or split_by_category
+        label_set = set(labels)
+
+        def bucket_sales(session: Session, group: Optional[List[int]]) -> dict:
+            """{label: amount} (or {label: {series: amount}}) of one branch group."""
+            # If splitting by category, we must join OrderItems and Menu
+            if split_by_category:
+                query = session.query(
+                    models.Orders.created_at,
+                    models.OrderItems.line_total.label("amount"),
+                    models.Menu.category.label("series")
+                ).join(
+                    models.OrderItems, models.Orders.order_id == models.OrderItems.order_id
+                ).join(
+                    models.Menu, models.OrderItems.menu_item_id == models.Menu.menu_item_id
+                )
+            else:
+                # Default or split_by_type uses Orders table directly
+                query = session.query(
+                    models.Orders.created_at,
+                    models.Orders.total_price.label("amount"),
+                    models.Orders.order_type.label("series")
+                )
+            query = query.filter(
+                models.Orders.status == 'PAID',
+                models.Orders.created_at >= start
+            )
+            if end is not None:
+                query = query.filter(models.Orders.created_at <= end)
+            if group is not None:
+                query = query.filter(models.Orders.branch_id.in_(group))
+
+            buckets = {}
+
+            def add(t, amount, series):
+                key = bucket_of(t)
+                if key not in label_set:
+                    return
+                if is_split:
+                    values = buckets.setdefault(key, {})
+                    values[series] = values.get(series, 0.0) + float(amount)
+                else:
+                    buckets[key] = buckets.get(key, 0.0) + float(amount)
+
+            for t, amount, series in query.yield_per(1000):
+                add(t, amount, series)
+
+            # Archived orders are only kept as daily rollups (no hour, no items)
+            if period != "today" and not split_by_category:
+                archived = rollups_query(
+                    session,
+                    models.OrderRollups.day,
+                    models.OrderRollups.order_type,
+                    func.sum(models.OrderRollups.total_price),
+                    start=start,
+                    branch_ids=group
+                ).filter(
+                    models.OrderRollups.status == 'PAID'
+                ).group_by(models.OrderRollups.day, models.OrderRollups.order_type)
+                for day, series, amount in archived:
+                    add(datetime.combine(day, time.min), amount or 0, series)
+            return buckets
+
+        # Buckets are computed per branch group in parallel, then added up
+        partials = fan_out(db, bucket_sales, branch_ids)
+        merged = sum_nested(partials) if is_split else sum_by_key(partials)
 
+        data = []
+        for label in labels:
+            item = {"name": label_name(label)}
+            if is_split:
+                item.update(merged.get(label, {}))
+            else:
+                item["value"] = float(merged.get(label, 0.0))
+            data.append(item)
         return data
 
     except Exception as e:
@@ -234,7 +330,6 @@ def get_top_branches(
     """
     try:
         from datetime import datetime, timedelta, date, time
-        from sqlalchemy import func, desc, case
 
         now = datetime.now()
         
@@ -251,86 +346,46 @@ def get_top_branches(
         
         if split_by_category:
             # 1. Find Top 5 Branch IDs first (filtering by branch_ids if provided)
-            top_branches_query = db.query(models.Branches.branch_id).join(
-                models.Orders, models.Branches.branch_id == models.Orders.branch_id
-            ).filter(
-                models.Orders.status == 'PAID',
-                models.Orders.created_at >= start_date
-            )
-
-            if branch_ids:
-                top_branches_query = top_branches_query.filter(models.Branches.branch_id.in_(branch_ids))
-
-            top_branches_query = top_branches_query.group_by(models.Branches.branch_id).order_by(
-                desc(func.sum(models.Orders.total_price))
-            ).limit(5)
-            
-            top_branch_ids = [r[0] for r in top_branches_query.all()]
+            totals = sum_by_key(fan_out(
+                db, lambda session, group: _paid_sales_by_branch(session, group, start_date),
+                branch_ids))
+            top_branch_ids = [branch_id for branch_id, _ in top_k(totals, 5)]
             
             if not top_branch_ids:
                 return []
 
             # 2. Query breakdown for these branches
-            results_query = db.query(
-                models.Branches.name,
-                models.Menu.category,
-                func.sum(models.OrderItems.line_total)
-            ).join(
-                models.Orders, models.Branches.branch_id == models.Orders.branch_id
-            ).join(
-                models.OrderItems, models.Orders.order_id == models.OrderItems.order_id
-            ).join(
-                models.Menu, models.OrderItems.menu_item_id == models.Menu.menu_item_id
-            ).filter(
-                models.Orders.status == 'PAID',
-                models.Orders.created_at >= start_date,
-                models.Branches.branch_id.in_(top_branch_ids)
-            )
-
-            if branch_ids:
-                results_query = results_query.filter(models.Branches.branch_id.in_(branch_ids))
-                
-            results = results_query.group_by(
-                models.Branches.name, models.Menu.category
-            ).all()
+            sales = sum_nested(fan_out(
+                db, lambda session, group: _category_sales_by_branch(session, group, start_date),
+                top_branch_ids))
             
             # 3. Transform
-            data_map = {}
-            for name, category, amount in results:
-                if name not in data_map:
-                    data_map[name] = {"name": name, "total": 0.0}
-                data_map[name][category] = float(amount)
-                data_map[name]["total"] += float(amount)
+            names = _branch_names(db, top_branch_ids)
+            data = []
+            for branch_id, categories in sales.items():
+                row = {"name": names.get(branch_id), "total": 0.0}
+                for category, amount in categories.items():
+                    row[category] = float(amount)
+                    row["total"] += float(amount)
+                data.append(row)
             
-            data = sorted(data_map.values(), key=lambda x: x["total"], reverse=True)
+            data = sorted(data, key=lambda x: x["total"], reverse=True)
             return data
 
         else:
-            # Original logic
-            query = db.query(
-                models.Branches.name,
-                func.sum(models.Orders.total_price).label("total_sales")
-            ).join(
-                models.Orders, models.Branches.branch_id == models.Orders.branch_id
-            ).filter(
-                models.Orders.status == 'PAID',
-                models.Orders.created_at >= start_date
-            )
-
-            if branch_ids:
-                query = query.filter(models.Branches.branch_id.in_(branch_ids))
-
-            results = query.group_by(
-                models.Branches.branch_id, models.Branches.name
-            ).order_by(
-                desc("total_sales")
-            ).limit(5).all()
+            # Live and archived sales per branch, summed over the branch groups
+            totals = sum_by_key(fan_out(
+                db, lambda session, group: _paid_sales_by_branch(
+                    session, group, start_date, archived=True),
+                branch_ids))
+            top = top_k(totals, 5)
+            names = _branch_names(db, [branch_id for branch_id, _ in top])
 
             data = []
-            for name, total in results:
+            for branch_id, total in top:
                 data.append({
-                    "name": name,
-                    "value": float(total) if total else 0.0
+                    "name": names.get(branch_id),
+                    "value": float(total)
                 })
             return data
 
@@ -377,6 +432,22 @@ def get_membership_ratio(
         
         # Count Guest orders (membership_id IS NULL)
         guest_count = base_query.filter(models.Orders.membership_id.is_(None)).scalar() or 0
+
+        # Archived (closed) orders are only kept as rollups
+        archived = rollups_query(
+            db,
+            models.OrderRollups.is_member,
+            func.sum(models.OrderRollups.order_count),
+            start=start_date,
+            branch_ids=branch_ids
+        ).filter(
+            models.OrderRollups.status == 'PAID'
+        ).group_by(models.OrderRollups.is_member).all()
+        for is_member, count in archived:
+            if is_member:
+                member_count += int(count)
+            else:
+                guest_count += int(count)
         
         return [
             {"name": "Member", "value": member_count},
@@ -389,54 +460,46 @@ def get_membership_ratio(
 def get_top_items(
     period: str = Query("today", regex="^(today|7days|30days|1year|all)$"),
     branch_ids: Optional[List[int]] = Query(None),
+    start_date: Optional[date] = Query(None, description="First day of a custom window (overrides period)"),
+    end_date: Optional[date] = Query(None, description="Last day of a custom window (inclusive)"),
+    metric: str = Query("revenue", regex="^(revenue|quantity)$"),
+    limit: int = Query(5, ge=1, le=50),
     db: Session = Depends(get_db)
 ):
     """
-    Get top 5 menu items by sales revenue.
+    Get top menu items by sales revenue (or units sold).
+
+    Read from the daily item sales counters, so any window costs the same
+    whatever the size of ``order_items``.
     """
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
     try:
-        from datetime import datetime, timedelta, time
-        from sqlalchemy import func, desc
+        from datetime import datetime, timedelta
 
         now = datetime.now()
-        
-        if period == "today":
-            start_date = datetime.combine(now.date(), time.min)
-        elif period == "7days":
-            start_date = datetime.combine(now.date() - timedelta(days=6), time.min)
-        elif period == "30days":
-            start_date = datetime.combine(now.date() - timedelta(days=29), time.min)
-        elif period == "1year":
-            start_date = datetime.combine((now.replace(day=1) - timedelta(days=365)).replace(day=1), time.min)
-        elif period == "all":
-            start_date = datetime(2020, 1, 1)
-            
-        query = db.query(
-            models.Menu.name,
-            func.sum(models.OrderItems.line_total).label("total_sales")
-        ).join(
-            models.OrderItems, models.Menu.menu_item_id == models.OrderItems.menu_item_id
-        ).join(
-            models.Orders, models.OrderItems.order_id == models.Orders.order_id
-        ).filter(
-            models.Orders.status == 'PAID',
-            models.Orders.created_at >= start_date
-        )
-
-        if branch_ids:
-            query = query.filter(models.Orders.branch_id.in_(branch_ids))
 
-        results = query.group_by(
-            models.Menu.menu_item_id, models.Menu.name
-        ).order_by(
-            desc("total_sales")
-        ).limit(5).all()
+        if start_date is None and end_date is None:
+            if period == "today":
+                start_date = now.date()
+            elif period == "7days":
+                start_date = now.date() - timedelta(days=6)
+            elif period == "30days":
+                start_date = now.date() - timedelta(days=29)
+            elif period == "1year":
+                start_date = (now.replace(day=1) - timedelta(days=365)).replace(day=1).date()
+            elif period == "all":
+                start_date = date(2020, 1, 1)
+
+        top = top_items(db, limit, branch_ids, start_date, end_date, metric)
+        names = dict(db.query(models.Menu.menu_item_id, models.Menu.name).filter(
+            models.Menu.menu_item_id.in_([menu_item_id for menu_item_id, _ in top])).all())
 
         data = []
-        for name, total in results:
+        for menu_item_id, total in top:
             data.append({
-                "name": name,
-                "value": float(total) if total else 0.0
+                "name": names.get(menu_item_id),
+                "value": float(total) if metric == "revenue" else int(total)
             })
         return data
 
@@ -0,0 +1,72 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+from typing import List
+from ..database import SessionLocal, engine_for_branch
+from .. import models, schemas
+from ..services import change_feed
+from ..services.kitchen import kitchen_queue
+from ..utils.serialization import content_etag, etag_matches
+
+router = APIRouter(prefix="/api/kitchen", tags=["kitchen"])
+
+MAX_WAIT_SECONDS = 60
+
+
+def _read_queue(branch_id: int) -> bytes:
+    # A short session per read, so a waiting request holds no connection
+    db = SessionLocal(bind=engine_for_branch(branch_id))
+    try:
+        if db.get(models.Branches, branch_id) is None:
+            raise HTTPException(status_code=404, detail="Branch not found")
+        rows = kitchen_queue(db, branch_id)
+    finally:
+        db.close()
+    return schemas.KitchenQueueAdapter.dump_json(
+        schemas.KitchenQueueAdapter.validate_python(rows, from_attributes=True))
+
+
+@router.get("/queue", response_model=List[schemas.KitchenQueueItem])
+async def get_kitchen_queue(
+    request: Request,
+    branch_id: int = Query(..., description="Branch whose kitchen is displayed"),
+    wait: int = Query(
+        0, ge=0, le=MAX_WAIT_SECONDS,
+        description="Long-poll: with If-None-Match, hold the request up to this many seconds until the queue changes")
+):
+    """
+    ORDERED and PREPARING items of a branch, oldest order first.
+
+    The response carries an ETag. A kitchen screen sends it back in
+    If-None-Match with ``wait``: the request returns as soon as a committed
+    order item change alters the queue, or 304 if the queue is unchanged
+    when ``wait`` runs out.
+    """
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    token = None
+    if wait:
+        # Item changes carry no branch: re-read on any, the ETag filters them
+        token = change_feed.subscribe(
+            lambda change: loop.call_soon_threadsafe(changed.set), ["order_items"])
+    try:
+        deadline = loop.time() + wait
+        while True:
+            changed.clear()
+            content = await run_in_threadpool(_read_queue, branch_id)
+            etag = content_etag(content)
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if not etag_matches(request.headers.get("If-None-Match"), etag):
+                return Response(content=content, media_type="application/json",
+                                headers=headers)
+            remaining = deadline - loop.time()
+            if remaining <= 0 or await request.is_disconnected():
+                return Response(status_code=304, headers=headers)
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                # Read once more: off PostgreSQL bulk inserts are not in the feed
+                pass
+    finally:
+        if token is not None:
+            change_feed.unsubscribe(token)
@@ -4,6 +4,7 @@ from typing import List, Optional
 from ..database import get_db
 from .. import models, schemas
 from ..utils.validators import validate_thai_phone, validate_email
+from ..services.member_search import search_members
 
 
 router = APIRouter(prefix="/api/memberships", tags=["memberships"])
@@ -42,6 +43,22 @@ def get_memberships(
     return query.offset(skip).limit(limit).all()
 
 
+@router.get("/search", response_model=List[schemas.Membership])
+def search_memberships(
+    q: str = Query(..., description="Name, phone or email fragment as typed at the counter"),
+    limit: int = Query(10, description="Maximum results (up to 50)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Ranked member lookup for the cashier. Digits search phone numbers
+    (prefix matches first); anything else searches name and email, best
+    match first.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    return search_members(db, q, min(max(limit, 1), 50))
+
+
 @router.get("/{membership_id}", response_model=schemas.Membership)
 def get_membership(membership_id: int, db: Session = Depends(get_db)):
     membership = db.query(models.Memberships).filter(
@@ -1,28 +1,64 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from ..database import get_db
+from ..database import get_branch_db, get_db
 from .. import models, schemas
+from ..services.companions import top_companions
+from ..services.costing import menu_costs
+from ..services.menu_availability import availability
 
 router = APIRouter(prefix="/api/menu", tags=["menu"])
 
 
-@router.get("/", response_model=List[schemas.Menu])
+@router.get("/", response_model=List[schemas.MenuWithMakeable])
 def get_menu_items(
     available_only: bool = False,
     category: Optional[str] = Query(
         None, description="Filter by menu category (e.g., Main, Side, Drink)"),
+    branch_id: Optional[int] = Query(
+        None, description="Branch used to compute makeable quantities"),
+    with_makeable: bool = Query(
+        False, description="Include makeable_qty computed from the branch's live stock"),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    # The branch's shard holds its stock (and a copy of the menu)
+    db: Session = Depends(get_branch_db)
 ):
+    if with_makeable and branch_id is None:
+        raise HTTPException(
+            status_code=400,
+            detail="branch_id is required when with_makeable=true"
+        )
+
     query = db.query(models.Menu)
     if available_only:
         query = query.filter(models.Menu.is_available == True)
     if category:
         query = query.filter(models.Menu.category == category)
     menu_items = query.offset(skip).limit(limit).all()
-    return menu_items
+
+    if not with_makeable:
+        return menu_items
+
+    makeable = availability.get_makeable(db, branch_id)
+    return [
+        schemas.MenuWithMakeable(
+            **schemas.Menu.model_validate(menu_item).model_dump(),
+            makeable_qty=makeable.get(menu_item.menu_item_id)
+        )
+        for menu_item in menu_items
+    ]
+
+
+@router.get("/costs", response_model=List[schemas.MenuItemCost])
+def get_menu_costs(
+    branch_id: int = Query(..., description="Branch whose ingredient costs are used"),
+    category: Optional[str] = Query(None, description="Filter by menu category"),
+    # The branch's shard holds its ingredient costs
+    db: Session = Depends(get_branch_db)
+):
+    """Recipe cost and margin of one portion of every menu item at a branch."""
+    return menu_costs(db, branch_id, category)
 
 
 @router.get("/{menu_item_id}", response_model=schemas.Menu)
@@ -34,6 +70,21 @@ def get_menu_item(menu_item_id: int, db: Session = Depends(get_db)):
     return menu_item
 
 
+@router.get("/{menu_item_id}/companions", response_model=List[schemas.MenuCompanion])
+def get_menu_companions(
+    menu_item_id: int,
+    branch_id: Optional[int] = Query(
+        None, description="Branch whose orders are counted (default: all branches)"),
+    k: int = Query(5, ge=1, le=20, description="Number of companions"),
+    # The branch's shard holds its item pairs
+    db: Session = Depends(get_branch_db)
+):
+    """Available menu items most often paid for in the same order (upsell prompts at the till)."""
+    if db.get(models.Menu, menu_item_id) is None:
+        raise HTTPException(status_code=404, detail="Menu item not found")
+    return top_companions(db, menu_item_id, k, branch_id)
+
+
 @router.post("/", response_model=schemas.Menu)
 def create_menu_item(menu_item: schemas.MenuCreate, db: Session = Depends(get_db)):
     db_menu_item = models.Menu(**menu_item.dict())
@@ -1,22 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
+from sqlalchemy.orm import Session
 from typing import List
-from decimal import Decimal
-from ..database import get_db
+from ..database import get_branch_db, get_branch_write_db
 from .. import models, schemas
+from ..services.orders import prepare_order_item, recalculate_order_total
+from ..services.responses import load_for_response
 
 router = APIRouter(prefix="/api/order-items", tags=["order-items"])
 
 
 @router.get("/", response_model=List[schemas.OrderItem])
-def get_order_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_order_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_branch_db)):
     order_items = db.query(models.OrderItems).offset(skip).limit(limit).all()
     return order_items
 
 
 @router.get("/{order_item_id}", response_model=schemas.OrderItem)
-def get_order_item(order_item_id: int, db: Session = Depends(get_db)):
+def get_order_item(order_item_id: int, db: Session = Depends(get_branch_db)):
     order_item = db.query(models.OrderItems).filter(
         models.OrderItems.order_item_id == order_item_id).first()
     if not order_item:
@@ -25,14 +25,14 @@ def get_order_item(order_item_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/order/{order_id}", response_model=List[schemas.OrderItem])
-def get_order_items_by_order(order_id: int, db: Session = Depends(get_db)):
+def get_order_items_by_order(order_id: int, db: Session = Depends(get_branch_db)):
     order_items = db.query(models.OrderItems).filter(
         models.OrderItems.order_id == order_id).all()
     return order_items
 
 
 @router.post("/", response_model=schemas.OrderItem)
-def create_order_item(order_item: schemas.OrderItemCreate, db: Session = Depends(get_db)):
+def create_order_item(order_item: schemas.OrderItemCreate, db: Session = Depends(get_branch_write_db)):
     """
     Add menu item to order. 
     - If same menu_id exists with status ORDERED, increment quantity
@@ -104,20 +104,14 @@ def create_order_item(order_item: schemas.OrderItemCreate, db: Session = Depends
         db.flush()
 
     # Recalculate order total (exclude cancelled items)
-    order_total = db.query(func.sum(models.OrderItems.line_total)).filter(
-        models.OrderItems.order_id == order_item.order_id,
-        models.OrderItems.status != "CANCELLED"
-    ).scalar() or Decimal("0")
-    order.total_price = order_total
+    recalculate_order_total(db, order)
 
     db.commit()
-    db.refresh(db_order_item)
-    db.refresh(order)
-    return db_order_item
+    return load_for_response(db, db_order_item, schemas.OrderItem)
 
 
 @router.put("/{order_item_id}", response_model=schemas.OrderItem)
-def update_order_item(order_item_id: int, order_item: schemas.OrderItemCreate, db: Session = Depends(get_db)):
+def update_order_item(order_item_id: int, order_item: schemas.OrderItemCreate, db: Session = Depends(get_branch_write_db)):
     """
     Update order item (quantity, menu_item).
     - Quantity can only be adjusted when status = ORDERED
@@ -182,36 +176,26 @@ def update_order_item(order_item_id: int, order_item: schemas.OrderItemCreate, d
     # Recalculate line_total
     line_total = order_item.quantity * unit_price
 
-    order_id = db_order_item.order_id
+    if menu_item is not None:
+        db_order_item.menu_item = menu_item
     db_order_item.menu_item_id = order_item.menu_item_id
     db_order_item.quantity = order_item.quantity
     db_order_item.unit_price = unit_price
     # Keep status as ORDERED (don't allow status change through this endpoint)
     db_order_item.line_total = line_total
-    db.flush()
 
     # Recalculate order total (exclude cancelled items)
-    order = db.query(models.Orders).filter(
-        models.Orders.order_id == order_id).first()
-    if order:
-        order_total = db.query(func.sum(models.OrderItems.line_total)).filter(
-            models.OrderItems.order_id == order_id,
-            models.OrderItems.status != "CANCELLED"
-        ).scalar() or Decimal("0")
-        order.total_price = order_total
+    recalculate_order_total(db, order)
 
     db.commit()
-    db.refresh(db_order_item)
-    if order:
-        db.refresh(order)
-    return db_order_item
+    return load_for_response(db, db_order_item, schemas.OrderItem)
 
 
 @router.put("/{order_item_id}/status", response_model=schemas.OrderItem)
 def update_order_item_status(
     order_item_id: int,
     status_update: schemas.OrderItemStatusUpdate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_branch_write_db)
 ):
     """
     Update order item status with new flow:
@@ -285,105 +269,13 @@ def update_order_item_status(
 
     # === ORDERED → PREPARING: Check stock & deduct ingredients ===
     if old_status == "ORDERED" and new_status == "PREPARING":
-        # Get all recipes for this menu item
-        recipes = db.query(models.Recipe).filter(
-            models.Recipe.menu_item_id == db_order_item.menu_item_id
-        ).all()
-
-        insufficient_ingredients = []
-
-        if recipes:
-            # First pass: Check all ingredients have sufficient stock
-            for recipe in recipes:
-                # Check if ingredient is deleted
-                ingredient = db.query(models.Ingredients).filter(
-                    models.Ingredients.ingredient_id == recipe.ingredient_id
-                ).first()
-                if ingredient and ingredient.is_deleted:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Cannot prepare order item. Ingredient '{ingredient.name}' has been deleted."
-                    )
-
-                # Find stock for this ingredient in the order's branch
-                stock = db.query(models.Stock).filter(
-                    models.Stock.branch_id == order.branch_id,
-                    models.Stock.ingredient_id == recipe.ingredient_id,
-                    models.Stock.is_deleted == False
-                ).first()
-
-                if not stock:
-                    insufficient_ingredients.append({
-                        "ingredient_id": recipe.ingredient_id,
-                        "ingredient_name": ingredient.name if ingredient else "Unknown",
-                        "available": 0,
-                        "needed": float(recipe.qty_per_unit * db_order_item.quantity)
-                    })
-                    continue
-
-                qty_needed = recipe.qty_per_unit * db_order_item.quantity
-
-                if stock.amount_remaining < qty_needed:
-                    insufficient_ingredients.append({
-                        "ingredient_id": recipe.ingredient_id,
-                        "ingredient_name": stock.ingredient.name,
-                        "available": float(stock.amount_remaining),
-                        "needed": float(qty_needed)
-                    })
-
-            # If any ingredients are insufficient, return error with details
-            if insufficient_ingredients:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "message": "Insufficient stock to prepare this order item",
-                        "insufficient_ingredients": insufficient_ingredients,
-                        "suggestion": "Decrease quantity, cancel the item, or restock ingredients"
-                    }
-                )
-
-            # Second pass: Deduct stock and create movements
-            for recipe in recipes:
-                stock = db.query(models.Stock).filter(
-                    models.Stock.branch_id == order.branch_id,
-                    models.Stock.ingredient_id == recipe.ingredient_id,
-                    models.Stock.is_deleted == False
-                ).first()
-
-                qty_needed = recipe.qty_per_unit * db_order_item.quantity
-                stock.amount_remaining -= qty_needed
-
-                # Create stock movement record
-                stock_movement = models.StockMovements(
-                    stock_id=stock.stock_id,
-                    employee_id=order.employee_id,
-                    order_id=order.order_id,
-                    qty_change=-qty_needed,
-                    reason="SALE",
-                    note=f"Order item {db_order_item.order_item_id} - {db_order_item.quantity}x {db_order_item.menu_item.name if db_order_item.menu_item else 'menu item'}"
-                )
-                db.add(stock_movement)
+        prepare_order_item(db, order, db_order_item)
 
     # Update status
     db_order_item.status = new_status
 
-    # Flush to ensure status change is visible in subsequent queries
-    db.flush()
-
-    # Expire the order object to force fresh query
-    db.expire(order)
-
     # Recalculate order total (exclude cancelled items)
-    order_total = db.query(func.sum(models.OrderItems.line_total)).filter(
-        models.OrderItems.order_id == db_order_item.order_id,
-        models.OrderItems.status != "CANCELLED"
-    ).scalar() or Decimal("0")
-    order.total_price = order_total
+    recalculate_order_total(db, order)
 
     db.commit()
-    # Reload order item with relationships for response
-    db_order_item = db.query(models.OrderItems).options(
-        joinedload(models.OrderItems.menu_item)
-    ).filter(models.OrderItems.order_item_id == db_order_item.order_item_id).first()
-    db.refresh(order)
-    return db_order_item
+    return load_for_response(db, db_order_item, schemas.OrderItem)
@@ -1,17 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from sqlalchemy.orm import Session, joinedload, selectinload
-from sqlalchemy import func
-from typing import List, Optional
+from sqlalchemy import func, insert, update
+from typing import List, Optional, Union
 from decimal import Decimal
 from datetime import datetime
-from ..database import get_db
+from ..database import check_branch_shard, get_branch_db, get_branch_write_db
 from .. import models, schemas
+from ..archive import load_archived_order
+from ..services.responses import load_for_response
+from ..services import change_feed
+from ..services.normalize import normalize_orders
+from ..services.counts import TotalCounter, set_total_headers
+from ..services.employee_sales import record_orders_taken
+from ..utils.serialization import list_etag, not_modified, orm_json_response
+from ..services.orders import (
+    validate_branch_and_employee, load_menu_items, diff_order_items, recalculate_order_total
+)
 
 router = APIRouter(prefix="/api/orders", tags=["orders"])
 
+# Any order insert, status change or delete can move a filtered total
+order_totals = TotalCounter(ttl=30, tables=["orders"])
 
-@router.get("/", response_model=List[schemas.Order])
+
+@router.get("/", response_model=Union[List[schemas.Order], schemas.OrderPageNormalized])
 def get_orders(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     status: Optional[str] = Query(
@@ -30,17 +44,16 @@ def get_orders(
         None, description="Filter by employee"),
     membership_id: Optional[int] = Query(
         None, description="Filter by membership"),
-    db: Session = Depends(get_db)
+    shape: str = Query(
+        "nested", regex="^(nested|normalized)$",
+        description="'normalized' returns foreign-key ids plus a side-loaded 'included' map"),
+    with_total: bool = Query(
+        True, description="Send the number of matching orders in X-Total-Count (cached for 30 s)"),
+    estimate: bool = Query(
+        False, description="Planner estimate instead of a (capped) exact count; see X-Total-Count-Kind"),
+    db: Session = Depends(get_branch_db)
 ):
-    query = db.query(models.Orders).options(
-        joinedload(models.Orders.employee),
-        joinedload(models.Orders.membership),
-        joinedload(models.Orders.branch),
-        selectinload(models.Orders.order_items).joinedload(
-            models.OrderItems.menu_item),
-        joinedload(models.Orders.payment),
-        selectinload(models.Orders.stock_movements)
-    )
+    query = db.query(models.Orders)
 
     if status:
         query = query.filter(models.Orders.status == status)
@@ -66,14 +79,34 @@ def get_orders(
     if membership_id:
         query = query.filter(models.Orders.membership_id == membership_id)
 
+    total = order_totals.total(query, estimate) if with_total else None
+
     # Sort by created_at descending (most recent first) by default
-    orders = query.order_by(models.Orders.created_at.desc()).offset(
-        skip).limit(limit).all()
-    return orders
+    page = query.order_by(models.Orders.created_at.desc()).offset(skip).limit(limit)
+    etag = list_etag(page, change_feed.version())
+    response = not_modified(request, etag)
+    if response is None:
+        orders = page.options(
+            joinedload(models.Orders.employee),
+            joinedload(models.Orders.membership),
+            joinedload(models.Orders.branch),
+            selectinload(models.Orders.order_items).joinedload(
+                models.OrderItems.menu_item),
+            joinedload(models.Orders.payment),
+            selectinload(models.Orders.stock_movements)
+        ).all()
+        if shape == "normalized":
+            response = orm_json_response(schemas.OrderPageNormalizedAdapter,
+                                         normalize_orders(orders), etag=etag)
+        else:
+            response = orm_json_response(schemas.OrderListAdapter, orders, etag=etag)
+    if total is not None:
+        set_total_headers(response, total)
+    return response
 
 
 @router.get("/{order_id}", response_model=schemas.Order)
-def get_order(order_id: int, db: Session = Depends(get_db)):
+def get_order(order_id: int, db: Session = Depends(get_branch_db)):
     order = db.query(models.Orders).options(
         joinedload(models.Orders.employee),
         joinedload(models.Orders.membership),
@@ -85,13 +118,18 @@ def get_order(order_id: int, db: Session = Depends(get_db)):
     ).filter(
         models.Orders.order_id == order_id).first()
     if not order:
+        # Closed orders past the retention window live in the archive
+        archived = load_archived_order(db, order_id)
+        if archived:
+            return archived
         raise HTTPException(status_code=404, detail="Order not found")
-    return order
+    return orm_json_response(schemas.OrderAdapter, order)
 
 
 @router.post("/empty", response_model=schemas.Order)
-def create_empty_order(order: schemas.OrderCreateEmpty, db: Session = Depends(get_db)):
+def create_empty_order(order: schemas.OrderCreateEmpty, db: Session = Depends(get_branch_write_db)):
     """Create an empty order (no items) for order-taking flow."""
+    check_branch_shard(db, order.branch_id)
     try:
         # Validate branch exists and is active
         branch = db.query(models.Branches).filter(
@@ -129,19 +167,10 @@ def create_empty_order(order: schemas.OrderCreateEmpty, db: Session = Depends(ge
             total_price=Decimal("0")
         )
         db.add(db_order)
+        db.flush()
+        record_orders_taken(db, db_order.created_at.date(), db_order.branch_id, db_order.employee_id)
         db.commit()
-        db.refresh(db_order)
-        # Load relationships before returning
-        db_order = db.query(models.Orders).options(
-            joinedload(models.Orders.employee),
-            joinedload(models.Orders.membership),
-            joinedload(models.Orders.branch),
-            selectinload(models.Orders.order_items).joinedload(
-                models.OrderItems.menu_item),
-            joinedload(models.Orders.payment),
-            selectinload(models.Orders.stock_movements)
-        ).filter(models.Orders.order_id == db_order.order_id).first()
-        return db_order
+        return load_for_response(db, db_order, schemas.Order)
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
@@ -155,118 +184,122 @@ def create_empty_order(order: schemas.OrderCreateEmpty, db: Session = Depends(ge
         raise HTTPException(status_code=500, detail=error_detail)
 
 
-@router.post("/", response_model=schemas.Order)
-def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
-    # Validate branch exists
-    branch = db.query(models.Branches).filter(
-        models.Branches.branch_id == order.branch_id
-    ).first()
-    if not branch:
-        raise HTTPException(status_code=404, detail="Branch not found")
-
-    # Validate employee exists and is active
-    employee = db.query(models.Employees).filter(
-        models.Employees.employee_id == order.employee_id
-    ).first()
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    if employee.is_deleted:
-        raise HTTPException(status_code=400, detail="Employee is not active")
+@router.post("/", response_model=Union[schemas.Order, schemas.OrderCreated])
+def create_order(
+    order: schemas.OrderCreate,
+    return_: str = Query(
+        "representation", alias="return",
+        description="'minimal' returns only the new ids and total"),
+    db: Session = Depends(get_branch_write_db)
+):
+    """
+    Create an order with its items.
 
-    # Validate employee belongs to the branch
-    if employee.branch_id != order.branch_id:
+    The order and all items are written with two INSERT ... RETURNING
+    statements and the response is built from the rows already loaded for
+    validation, so nothing is re-read after the commit. Core inserts skip the
+    ORM flush hooks, so the rows are reported to the change feed explicitly.
+    """
+    if return_ not in ("representation", "minimal"):
         raise HTTPException(
-            status_code=400,
-            detail="Employee does not belong to the selected branch"
-        )
+            status_code=400, detail="return must be 'representation' or 'minimal'")
 
-    # Validate and fetch menu items, copy prices
-    menu_item_ids = [item.menu_item_id for item in order.order_items]
-    menu_items = db.query(models.Menu).filter(
-        models.Menu.menu_item_id.in_(menu_item_ids)
-    ).all()
+    branch, employee = validate_branch_and_employee(
+        db, order.branch_id, order.employee_id)
 
-    menu_items_dict = {mi.menu_item_id: mi for mi in menu_items}
+    membership = None
+    if order.membership_id:
+        membership = db.query(models.Memberships).options(
+            joinedload(models.Memberships.tier)
+        ).filter(
+            models.Memberships.membership_id == order.membership_id
+        ).first()
+        if not membership:
+            raise HTTPException(status_code=404, detail="Membership not found")
 
-    # Validate all menu items exist and are available
-    for item in order.order_items:
-        if item.menu_item_id not in menu_items_dict:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Menu item {item.menu_item_id} not found"
-            )
-        menu_item = menu_items_dict[item.menu_item_id]
-        if not menu_item.is_available:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Menu item '{menu_item.name}' (ID: {item.menu_item_id}) is not available"
-            )
-        if item.quantity <= 0:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Quantity must be greater than 0 for menu item {item.menu_item_id}"
-            )
+    # Validate and fetch menu items, copy prices
+    menu_items_dict = load_menu_items(db, order.order_items)
 
-    # Calculate total_price from order items (always using menu item prices)
+    # Always copy price from menu item (snapshot at time of ordering)
     # Exclude cancelled items from total
+    item_rows = []
     total_price = Decimal("0")
     for item in order.order_items:
-        # Skip cancelled items in total calculation
-        if item.status == "CANCELLED":
-            continue
-        menu_item = menu_items_dict[item.menu_item_id]
-        # Always use menu item price (snapshot at time of ordering)
-        unit_price = menu_item.price
-        line_total = item.quantity * unit_price
-        total_price += line_total
-
-    # Create order
-    db_order = models.Orders(
-        branch_id=order.branch_id,
-        membership_id=order.membership_id,
-        employee_id=order.employee_id,
-        order_type=order.order_type,
-        status=order.status,
-        total_price=total_price
-    )
-    db.add(db_order)
-    db.flush()
-    db.refresh(db_order)
-
-    # Create order items with prices copied from menu items
-    for item in order.order_items:
-        menu_item = menu_items_dict[item.menu_item_id]
-        # Always copy price from menu item (snapshot at time of ordering)
-        unit_price = menu_item.price
+        unit_price = menu_items_dict[item.menu_item_id].price
         line_total = item.quantity * unit_price
-
-        db_order_item = models.OrderItems(
-            order_id=db_order.order_id,
-            menu_item_id=item.menu_item_id,
-            status="ORDERED",  # Always start as ORDERED
-            quantity=item.quantity,
-            unit_price=unit_price,
-            line_total=line_total
+        if item.status != "CANCELLED":
+            total_price += line_total
+        item_rows.append({
+            "menu_item_id": item.menu_item_id,
+            "status": "ORDERED",  # Always start as ORDERED
+            "quantity": item.quantity,
+            "unit_price": unit_price,
+            "line_total": line_total
+        })
+
+    order_id, created_at = db.execute(
+        insert(models.Orders).values(
+            branch_id=order.branch_id,
+            membership_id=order.membership_id,
+            employee_id=order.employee_id,
+            order_type=order.order_type,
+            status=order.status,
+            total_price=total_price
+        ).returning(models.Orders.order_id, models.Orders.created_at)
+    ).one()
+
+    record_orders_taken(db, created_at.date(), order.branch_id, order.employee_id)
+    for row in item_rows:
+        row["order_id"] = order_id
+    order_item_ids = db.execute(
+        insert(models.OrderItems).returning(
+            models.OrderItems.order_item_id, sort_by_parameter_order=True),
+        item_rows
+    ).scalars().all() if item_rows else []
+    change_feed.record_changes(db, "orders", "INSERT", [
+        {"order_id": order_id, "branch_id": order.branch_id, "status": order.status}])
+    change_feed.record_changes(db, "order_items", "INSERT", [
+        {"order_item_id": order_item_id, "order_id": order_id, "status": row["status"]}
+        for order_item_id, row in zip(order_item_ids, item_rows)])
+
+    if return_ == "minimal":
+        response = schemas.OrderCreated(
+            order_id=order_id,
+            status=order.status,
+            total_price=total_price,
+            created_at=created_at,
+            order_item_ids=order_item_ids
+        )
+    else:
+        # Built before commit: committing expires the loaded ORM rows
+        response = schemas.Order(
+            order_id=order_id,
+            branch_id=order.branch_id,
+            membership_id=order.membership_id,
+            employee_id=order.employee_id,
+            order_type=order.order_type,
+            status=order.status,
+            created_at=created_at,
+            total_price=total_price,
+            membership=membership,
+            employee=employee,
+            branch=branch,
+            order_items=[
+                schemas.OrderItem(
+                    order_item_id=order_item_id,
+                    order_id=order_id,
+                    menu_item=menu_items_dict[row["menu_item_id"]],
+                    **{k: v for k, v in row.items() if k != "order_id"}
+                )
+                for order_item_id, row in zip(order_item_ids, item_rows)
+            ]
         )
-        db.add(db_order_item)
-
     db.commit()
-    db.refresh(db_order)
-    # Load relationships before returning
-    db_order = db.query(models.Orders).options(
-        joinedload(models.Orders.employee),
-        joinedload(models.Orders.membership),
-        joinedload(models.Orders.branch),
-        selectinload(models.Orders.order_items).joinedload(
-            models.OrderItems.menu_item),
-        joinedload(models.Orders.payment),
-        selectinload(models.Orders.stock_movements)
-    ).filter(models.Orders.order_id == db_order.order_id).first()
-    return db_order
+    return response
 
 
 @router.put("/{order_id}", response_model=schemas.Order)
-def update_order(order_id: int, order: schemas.OrderCreate, db: Session = Depends(get_db)):
+def update_order(order_id: int, order: schemas.OrderCreate, db: Session = Depends(get_branch_write_db)):
     db_order = db.query(models.Orders).filter(
         models.Orders.order_id == order_id).first()
     if not db_order:
@@ -284,7 +317,8 @@ def update_order(order_id: int, order: schemas.OrderCreate, db: Session = Depend
             detail="Cannot update a cancelled order. CANCELLED orders are final and cannot be modified or reverted."
         )
 
-    # Validate branch exists and is active
+    # Validate branch exists and is active (an order cannot change shards)
+    check_branch_shard(db, order.branch_id)
     branch = db.query(models.Branches).filter(
         models.Branches.branch_id == order.branch_id
     ).first()
@@ -318,50 +352,8 @@ def update_order(order_id: int, order: schemas.OrderCreate, db: Session = Depend
             raise HTTPException(status_code=404, detail="Membership not found")
 
     # Validate and fetch menu items, copy prices
-    menu_item_ids = [item.menu_item_id for item in order.order_items]
-    menu_items = db.query(models.Menu).filter(
-        models.Menu.menu_item_id.in_(menu_item_ids)
-    ).all()
-
-    menu_items_dict = {mi.menu_item_id: mi for mi in menu_items}
-
-    # Validate all menu items exist and are available
-    for item in order.order_items:
-        if item.menu_item_id not in menu_items_dict:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Menu item {item.menu_item_id} not found"
-            )
-        menu_item = menu_items_dict[item.menu_item_id]
-        if not menu_item.is_available:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Menu item '{menu_item.name}' (ID: {item.menu_item_id}) is not available"
-            )
-        if item.quantity <= 0:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Quantity must be greater than 0 for menu item {item.menu_item_id}"
-            )
+    menu_items_dict = load_menu_items(db, order.order_items)
 
-    # Recalculate total_price using menu item prices
-    # Exclude cancelled items from total
-    total_price = Decimal("0")
-    for item in order.order_items:
-        # Skip cancelled items in total calculation
-        if item.status == "CANCELLED":
-            continue
-        menu_item = menu_items_dict[item.menu_item_id]
-        # Always use menu item price (snapshot at time of ordering)
-        unit_price = menu_item.price
-        line_total = item.quantity * unit_price
-        total_price += line_total
-
-    # Update order fields
-    db_order.branch_id = order.branch_id
-    db_order.membership_id = order.membership_id
-    db_order.employee_id = order.employee_id
-    db_order.order_type = order.order_type
     # Don't allow changing status to PAID or CANCELLED through update_order
     # Status changes should go through specific endpoints (cancel_order, payment processing)
     if order.status not in ["UNPAID", "PENDING"]:
@@ -369,45 +361,55 @@ def update_order(order_id: int, order: schemas.OrderCreate, db: Session = Depend
             status_code=400,
             detail="Cannot set order status to PAID or CANCELLED through update. Use cancel endpoint or payment processing."
         )
-    db_order.status = order.status
-    db_order.total_price = total_price
 
-    # Delete existing order items and create new ones
-    db.query(models.OrderItems).filter(
-        models.OrderItems.order_id == order_id).delete()
+    inserts, updates, delete_ids = diff_order_items(
+        db, db_order.order_id, order.order_items, menu_items_dict)
 
-    for item in order.order_items:
-        menu_item = menu_items_dict[item.menu_item_id]
-        unit_price = menu_item.price
-        line_total = item.quantity * unit_price
+    # The order counts for the employee (and branch) it is given to
+    if (db_order.branch_id, db_order.employee_id) != (order.branch_id, order.employee_id):
+        day = db_order.created_at.date()
+        record_orders_taken(db, day, db_order.branch_id, db_order.employee_id, -1)
+        record_orders_taken(db, day, order.branch_id, order.employee_id)
 
-        db_order_item = models.OrderItems(
-            order_id=db_order.order_id,
-            menu_item_id=item.menu_item_id,
-            status="ORDERED",  # Always start as ORDERED
-            quantity=item.quantity,
-            unit_price=unit_price,
-            line_total=line_total
-        )
-        db.add(db_order_item)
+    # Update order fields
+    db_order.branch_id = order.branch_id
+    db_order.membership_id = order.membership_id
+    db_order.employee_id = order.employee_id
+    db_order.order_type = order.order_type
+    db_order.status = order.status
+
+    # Apply only the changed lines, one statement per kind of change. Only
+    # ORDERED lines are changed or deleted; the Core statements skip the
+    # flush hooks, so they are reported to the change feed explicitly.
+    if delete_ids:
+        db.query(models.OrderItems).filter(
+            models.OrderItems.order_item_id.in_(delete_ids)
+        ).delete(synchronize_session=False)
+        change_feed.record_changes(db, "order_items", "DELETE", [
+            {"order_item_id": order_item_id, "order_id": order_id, "status": "ORDERED"}
+            for order_item_id in delete_ids])
+    if updates:
+        db.execute(update(models.OrderItems), updates)
+        change_feed.record_changes(db, "order_items", "UPDATE", [
+            {"order_item_id": row["order_item_id"], "order_id": order_id, "status": "ORDERED"}
+            for row in updates])
+    if inserts:
+        order_item_ids = db.execute(
+            insert(models.OrderItems).returning(
+                models.OrderItems.order_item_id, sort_by_parameter_order=True),
+            inserts
+        ).scalars().all()
+        change_feed.record_changes(db, "order_items", "INSERT", [
+            {"order_item_id": order_item_id, "order_id": order_id, "status": "ORDERED"}
+            for order_item_id in order_item_ids])
+    recalculate_order_total(db, db_order)
 
     db.commit()
-    db.refresh(db_order)
-    # Load relationships before returning
-    db_order = db.query(models.Orders).options(
-        joinedload(models.Orders.employee),
-        joinedload(models.Orders.membership),
-        joinedload(models.Orders.branch),
-        selectinload(models.Orders.order_items).joinedload(
-            models.OrderItems.menu_item),
-        joinedload(models.Orders.payment),
-        selectinload(models.Orders.stock_movements)
-    ).filter(models.Orders.order_id == db_order.order_id).first()
-    return db_order
+    return load_for_response(db, db_order, schemas.Order)
 
 
 @router.put("/{order_id}/cancel", response_model=schemas.Order)
-def cancel_order(order_id: int, db: Session = Depends(get_db)):
+def cancel_order(order_id: int, db: Session = Depends(get_branch_write_db)):
     """
     Cancel an order. Only UNPAID orders can be cancelled.
     Cannot cancel if any item is PREPARING or DONE (chef already started/finished).
@@ -459,22 +461,11 @@ def cancel_order(order_id: int, db: Session = Depends(get_db)):
     db_order.total_price = Decimal("0")  # All items cancelled = 0 total
 
     db.commit()
-    db.refresh(db_order)
-    # Load relationships before returning
-    db_order = db.query(models.Orders).options(
-        joinedload(models.Orders.employee),
-        joinedload(models.Orders.membership),
-        joinedload(models.Orders.branch),
-        selectinload(models.Orders.order_items).joinedload(
-            models.OrderItems.menu_item),
-        joinedload(models.Orders.payment),
-        selectinload(models.Orders.stock_movements)
-    ).filter(models.Orders.order_id == db_order.order_id).first()
-    return db_order
+    return load_for_response(db, db_order, schemas.Order)
 
 
 @router.put("/{order_id}/membership", response_model=schemas.Order)
-def update_order_membership(order_id: int, payload: schemas.OrderMembershipUpdate, db: Session = Depends(get_db)):
+def update_order_membership(order_id: int, payload: schemas.OrderMembershipUpdate, db: Session = Depends(get_branch_write_db)):
     """
     Assign or clear a membership for an order without modifying items.
     Only allowed for UNPAID or PENDING orders.
@@ -502,16 +493,4 @@ def update_order_membership(order_id: int, payload: schemas.OrderMembershipUpdat
         db_order.membership_id = None
 
     db.commit()
-    db.refresh(db_order)
-
-    # Reload relationships for response
-    db_order = db.query(models.Orders).options(
-        joinedload(models.Orders.employee),
-        joinedload(models.Orders.membership),
-        joinedload(models.Orders.branch),
-        selectinload(models.Orders.order_items).joinedload(
-            models.OrderItems.menu_item),
-        joinedload(models.Orders.payment),
-        selectinload(models.Orders.stock_movements)
-    ).filter(models.Orders.order_id == order_id).first()
-    return db_order
+    return load_for_response(db, db_order, schemas.Order)
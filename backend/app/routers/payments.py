@@ -1,13 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, extract
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from sqlalchemy.orm import Session, contains_eager, selectinload
+from sqlalchemy import func
+from typing import List, Optional, Union
 from datetime import datetime
-from ..database import get_db
+from ..database import get_branch_db, get_branch_write_db
 from .. import models, schemas
+from ..services import change_feed
+from ..services.payments import apply_payment, paid_period_filters, payment_search_filter
+from ..services.counts import TotalCounter, set_total_headers
+from ..services.responses import load_for_response
+from ..services.normalize import normalize_payments
+from ..utils.serialization import list_etag, not_modified, orm_json_response
 
 router = APIRouter(prefix="/api/payments", tags=["payments"])
 
+# Payment totals change when an order is paid, or removed by archival
+payment_totals = TotalCounter(
+    ttl=30, tables=["orders"],
+    invalidate_when=lambda change: change.op == "DELETE" or change.fields.get("status") == "PAID"
+)
+
 
 @router.get("/stats")
 def get_payment_stats(
@@ -17,7 +29,7 @@ def get_payment_stats(
     month: Optional[int] = Query(None, description="Filter by month"),
     quarter: Optional[int] = Query(None, description="Filter by quarter"),
     search: Optional[str] = Query(None, description="Search term"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_branch_db)
 ):
     query = db.query(
         func.count(models.Payments.order_id).label("count"),
@@ -27,34 +39,11 @@ def get_payment_stats(
     if payment_method:
         query = query.filter(models.Payments.payment_method == payment_method)
 
-    if year:
-        query = query.filter(
-            extract('year', models.Payments.paid_timestamp) == year)
-
-    if month:
-        query = query.filter(
-            extract('month', models.Payments.paid_timestamp) == month)
-
-    if quarter:
-        quarter_months = {
-            1: [1, 2, 3],
-            2: [4, 5, 6],
-            3: [7, 8, 9],
-            4: [10, 11, 12]
-        }
-        if quarter in quarter_months:
-            query = query.filter(
-                extract('month', models.Payments.paid_timestamp).in_(
-                    quarter_months[quarter])
-            )
+    # Year/month/quarter as a paid_timestamp range where possible
+    query = query.filter(*paid_period_filters(year, month, quarter))
 
     if search:
-        try:
-            order_id = int(search)
-            query = query.filter(models.Payments.order_id == order_id)
-        except ValueError:
-            query = query.filter(
-                models.Payments.payment_ref.ilike(f"%{search}%"))
+        query = query.filter(payment_search_filter(search))
 
     result = query.first()
     return {
@@ -63,8 +52,9 @@ def get_payment_stats(
     }
 
 
-@router.get("/", response_model=List[schemas.Payment])
+@router.get("/", response_model=Union[List[schemas.Payment], schemas.PaymentPageNormalized])
 def get_payments(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     payment_method: Optional[str] = Query(
@@ -87,7 +77,14 @@ def get_payments(
         None, description="Paid timestamp on/before"),
     membership_only: Optional[bool] = Query(
         None, description="True to include only payments with membership; False for non-membership; None for all"),
-    db: Session = Depends(get_db)
+    shape: str = Query(
+        "nested", regex="^(nested|normalized)$",
+        description="'normalized' returns foreign-key ids plus a side-loaded 'included' map"),
+    with_total: bool = Query(
+        True, description="Send the number of matching payments in X-Total-Count (cached for 30 s)"),
+    estimate: bool = Query(
+        False, description="Planner estimate instead of a (capped) exact count; see X-Total-Count-Kind"),
+    db: Session = Depends(get_branch_db)
 ):
     query = db.query(models.Payments).join(
         models.Orders, models.Payments.order_id == models.Orders.order_id)
@@ -95,49 +92,13 @@ def get_payments(
     if payment_method:
         query = query.filter(models.Payments.payment_method == payment_method)
 
-    # Date filtering - year, month, quarter can be combined independently
-    if year:
-        query = query.filter(
-            extract('year', models.Payments.paid_timestamp) == year
-        )
-
-    if month:
-        query = query.filter(
-            extract('month', models.Payments.paid_timestamp) == month
-        )
-
-    if quarter:
-        # Quarter 1: Jan-Mar (months 1-3)
-        # Quarter 2: Apr-Jun (months 4-6)
-        # Quarter 3: Jul-Sep (months 7-9)
-        # Quarter 4: Oct-Dec (months 10-12)
-        quarter_months = {
-            1: [1, 2, 3],
-            2: [4, 5, 6],
-            3: [7, 8, 9],
-            4: [10, 11, 12]
-        }
-        if quarter in quarter_months:
-            query = query.filter(
-                extract('month', models.Payments.paid_timestamp).in_(
-                    quarter_months[quarter])
-            )
-    
-    count = query.count()
-    print(f"DEBUG: Found {count} payments")
-
+    # Date filtering - year, month, quarter can be combined independently.
+    # With a year they become a half-open paid_timestamp range (indexed).
+    query = query.filter(*paid_period_filters(year, month, quarter))
 
-    # Search functionality
+    # Search by order_id (numeric) or payment_ref substring
     if search:
-        try:
-            # Try to parse as order_id (integer)
-            order_id = int(search)
-            query = query.filter(models.Payments.order_id == order_id)
-        except ValueError:
-            # If not a number, search in payment_ref
-            query = query.filter(
-                models.Payments.payment_ref.ilike(f"%{search}%")
-            )
+        query = query.filter(payment_search_filter(search))
 
     if min_paid is not None:
         query = query.filter(models.Payments.paid_price >= min_paid)
@@ -157,13 +118,38 @@ def get_payments(
         else:
             query = query.filter(models.Orders.membership_id.is_(None))
 
-    payments = query.order_by(models.Payments.paid_timestamp.desc()).offset(
-        skip).limit(limit).all()
-    return payments
+    total = payment_totals.total(query, estimate) if with_total else None
+
+    page = query.order_by(models.Payments.paid_timestamp.desc()).offset(skip).limit(limit)
+    etag = list_etag(page, change_feed.version())
+    response = not_modified(request, etag)
+    if response is None:
+        # Load each payment's order graph in a fixed number of queries
+        order = contains_eager(models.Payments.order)
+        payments = page.options(
+            order.selectinload(models.Orders.employee).selectinload(
+                models.Employees.role),
+            order.selectinload(models.Orders.membership).selectinload(
+                models.Memberships.tier),
+            order.selectinload(models.Orders.branch),
+            order.selectinload(models.Orders.order_items).selectinload(
+                models.OrderItems.menu_item),
+            order.selectinload(models.Orders.payment),
+            order.selectinload(models.Orders.stock_movements).selectinload(
+                models.StockMovements.stock).selectinload(models.Stock.ingredient)
+        ).all()
+        if shape == "normalized":
+            response = orm_json_response(schemas.PaymentPageNormalizedAdapter,
+                                         normalize_payments(payments), etag=etag)
+        else:
+            response = orm_json_response(schemas.PaymentListAdapter, payments, etag=etag)
+    if total is not None:
+        set_total_headers(response, total)
+    return response
 
 
 @router.get("/{order_id}", response_model=schemas.Payment)
-def get_payment(order_id: int, db: Session = Depends(get_db)):
+def get_payment(order_id: int, db: Session = Depends(get_branch_db)):
     payment = db.query(models.Payments).filter(
         models.Payments.order_id == order_id).first()
     if not payment:
@@ -172,192 +158,21 @@ def get_payment(order_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=schemas.Payment)
-def create_payment(payment: schemas.PaymentCreate, db: Session = Depends(get_db)):
-    from decimal import Decimal
-
+def create_payment(payment: schemas.PaymentCreate, db: Session = Depends(get_branch_write_db)):
     # Verify order exists
     order = db.query(models.Orders).filter(
         models.Orders.order_id == payment.order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # Check if payment already exists
-    existing_payment = db.query(models.Payments).filter(
-        models.Payments.order_id == payment.order_id
-    ).first()
-    if existing_payment:
-        raise HTTPException(
-            status_code=400, detail="Payment already exists for this order")
-
-    # Validate that all order items are either DONE or CANCELLED
-    order_items = db.query(models.OrderItems).filter(
-        models.OrderItems.order_id == payment.order_id
-    ).all()
-
-    if not order_items:
-        raise HTTPException(
-            status_code=400,
-            detail="Cannot process payment for an order with no items"
-        )
-
-    # Check if any items are still ORDERED or PREPARING
-    ordered_items = [item for item in order_items if item.status == "ORDERED"]
-    preparing_items = [
-        item for item in order_items if item.status == "PREPARING"]
-
-    if ordered_items:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Cannot process payment. {len(ordered_items)} order item(s) are still ORDERED (waiting for chef). All items must be DONE or CANCELLED before payment."
-        )
-
-    if preparing_items:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Cannot process payment. {len(preparing_items)} order item(s) are still PREPARING. All items must be DONE or CANCELLED before payment."
-        )
-
-    # Check if there are any non-cancelled items (at least one item must be DONE)
-    done_items = [item for item in order_items if item.status == "DONE"]
-    if not done_items:
-        raise HTTPException(
-            status_code=400,
-            detail="Cannot process payment. No DONE items found. At least one item must be DONE."
-        )
-
-    # Validate payment_ref is required for CARD and QR payment methods
-    if payment.payment_method in ["CARD", "QR"]:
-        if not payment.payment_ref or not payment.payment_ref.strip():
-            raise HTTPException(
-                status_code=400,
-                detail=f"Payment reference (payment_ref) is required for {payment.payment_method} payments"
-            )
-
-    # Calculate final price from order.total_price, points_used (100 points = ฿1), then apply tier discount
-    # Backend calculates this to prevent manipulation
-    total_price = Decimal(str(order.total_price))
-    points_used_req = int(payment.points_used or 0)
-
-    # Load membership (if any) to apply discount and validate points usage; include tier for discount
-    membership = None
-    discount_pct = Decimal("0")
-    if order.membership_id:
-        membership = db.query(models.Memberships).options(joinedload(models.Memberships.tier)).filter(
-            models.Memberships.membership_id == order.membership_id
-        ).first()
-        if membership and membership.tier and membership.tier.discount_percentage is not None:
-            discount_pct = Decimal(str(membership.tier.discount_percentage))
-
-    # Validate points usage
-    clamped_points_used = 0
-    if points_used_req > 0:
-        if not membership:
-            raise HTTPException(
-                status_code=400,
-                detail="Cannot use points without a membership"
-            )
-        # Max points usable is min(2000, membership balance, floor(total_price * 100))
-        max_points_by_total = int((total_price * Decimal("100")).to_integral_value(rounding="ROUND_FLOOR"))
-        max_usable = min(2000, membership.points_balance, max_points_by_total)
-        if max_usable < 0:
-            max_usable = 0
-        if points_used_req > max_usable:
-            # Clamp instead of erroring, to be robust against UI mismatch
-            clamped_points_used = max_usable
-        else:
-            clamped_points_used = max(0, points_used_req)
-
-    # Convert points to baht (100 points = 1 baht)
-    baht_from_points = Decimal(clamped_points_used) / Decimal("100")
-    subtotal = total_price - baht_from_points
-    if subtotal < 0:
-        subtotal = Decimal("0")
-    # Apply discount after points
-    multiplier = Decimal("1") - (discount_pct / Decimal("100"))
-    if multiplier < 0:
-        multiplier = Decimal("0")
-    paid_price = (subtotal * multiplier).quantize(Decimal("0.01"))
-
-    # If paid_price was provided, validate it matches our calculation
-    if payment.paid_price:
-        provided_paid_price = Decimal(str(payment.paid_price))
-        # Allow small floating point differences
-        if abs(provided_paid_price - paid_price) > Decimal("0.01"):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid paid_price. Expected: {paid_price}, Provided: {provided_paid_price}"
-            )
-
-    # Create payment with calculated paid_price
-    db_payment = models.Payments(
-        order_id=payment.order_id,
-        paid_price=paid_price,  # Pass Decimal directly, SQLAlchemy handles it
-        points_used=clamped_points_used,
-        payment_method=payment.payment_method,
-        payment_ref=payment.payment_ref,
-        paid_timestamp=payment.paid_timestamp or datetime.now()
-    )
-    db.add(db_payment)
-
-    # Update order status to PAID
-    order.status = "PAID"
-
-    # If points were used, deduct from membership
-    if clamped_points_used > 0 and order.membership_id:
-        membership = db.query(models.Memberships).filter(
-            models.Memberships.membership_id == order.membership_id
-        ).first()
-        if membership:
-            membership.points_balance = max(
-                0, membership.points_balance - clamped_points_used)
-
-    # Award points to membership (if applicable) based on calculated paid_price
-    if order.membership_id:
-        membership = db.query(models.Memberships).filter(
-            models.Memberships.membership_id == order.membership_id
-        ).first()
-        if membership:
-            # Award points: for every 10 baht paid, +1 point
-            points_earned = int(float(paid_price) / 10)
-            if points_earned > 0:
-                membership.points_balance += points_earned
-                # Also increase cumulative points by the same amount
-                membership.cumulative_points += points_earned
-
-                # Auto-upgrade tier based on cumulative_points
-                # Find the highest tier where minimum_point_required <= cumulative_points
-                # and tier number is greater than current
-                current_tier = db.query(models.Tiers).filter(
-                    models.Tiers.tier_id == membership.tier_id
-                ).first()
-                current_tier_number = current_tier.tier if current_tier else 0
-
-                eligible_tiers = (
-                    db.query(models.Tiers)
-                    .filter(models.Tiers.minimum_point_required <= membership.cumulative_points)
-                    .order_by(models.Tiers.tier.desc())
-                    .all()
-                )
-
-                for t in eligible_tiers:
-                    # Upgrade only if strictly higher tier number
-                    if t.tier > current_tier_number:
-                        membership.tier_id = t.tier_id
-                        current_tier_number = t.tier
-                        break
+    db_payment = apply_payment(db, order, payment)
 
     db.commit()
-    db.refresh(db_payment)
-    # Load order relationship before returning (if needed by schema)
-    # Payment schema includes order relationship, so we should load it
-    db_payment = db.query(models.Payments).options(
-        joinedload(models.Payments.order)
-    ).filter(models.Payments.order_id == db_payment.order_id).first()
-    return db_payment
+    return load_for_response(db, db_payment, schemas.Payment)
 
 
 @router.put("/{order_id}", response_model=schemas.Payment)
-def update_payment(order_id: int, payment: schemas.PaymentBase, db: Session = Depends(get_db)):
+def update_payment(order_id: int, payment: schemas.PaymentBase, db: Session = Depends(get_branch_write_db)):
     db_payment = db.query(models.Payments).filter(
         models.Payments.order_id == order_id).first()
     if not db_payment:
@@ -380,5 +195,4 @@ def update_payment(order_id: int, payment: schemas.PaymentBase, db: Session = De
         setattr(db_payment, key, value)
 
     db.commit()
-    db.refresh(db_payment)
-    return db_payment
+    return load_for_response(db, db_payment, schemas.Payment)
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from ..database import get_db
 from .. import models, schemas
+from ..services.costing import invalidate_menu_costs
 
 router = APIRouter(prefix="/api/recipe", tags=["recipe"])
 
@@ -54,6 +55,7 @@ def create_recipe(recipe: schemas.RecipeCreate, db: Session = Depends(get_db)):
     if existing_recipe:
         # Increment quantity instead of creating duplicate
         existing_recipe.qty_per_unit += recipe.qty_per_unit
+        invalidate_menu_costs(db, [recipe.menu_item_id])
         db.commit()
         db.refresh(existing_recipe)
         return existing_recipe
@@ -61,6 +63,7 @@ def create_recipe(recipe: schemas.RecipeCreate, db: Session = Depends(get_db)):
         # Create new recipe
         db_recipe = models.Recipe(**recipe.dict())
         db.add(db_recipe)
+        invalidate_menu_costs(db, [recipe.menu_item_id])
         db.commit()
         db.refresh(db_recipe)
         return db_recipe
@@ -87,6 +90,7 @@ def update_recipe(recipe_id: int, recipe: schemas.RecipeCreate, db: Session = De
                 detail=f"Cannot change recipe to deleted ingredient '{ingredient.name}'. Ingredient must be active."
             )
 
+    invalidate_menu_costs(db, [db_recipe.menu_item_id, recipe.menu_item_id])
     for key, value in recipe.dict().items():
         setattr(db_recipe, key, value)
     db.commit()
@@ -101,6 +105,7 @@ def delete_recipe(recipe_id: int, db: Session = Depends(get_db)):
     if not db_recipe:
         raise HTTPException(
             status_code=404, detail="Recipe not found")
+    invalidate_menu_costs(db, [db_recipe.menu_item_id])
     db.delete(db_recipe)
     db.commit()
     return {"message": "Recipe deleted successfully"}
@@ -1,9 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, status, Query
 from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from sqlalchemy import case, insert, update
+from typing import List, Optional, Union
+from decimal import Decimal, InvalidOperation
+import csv
+import io
 
 from .. import models, schemas
-from ..database import get_db
+from ..database import check_branch_shard, get_branch_db, get_branch_write_db
+from ..services import change_feed
+from ..services.costing import record_restock_costs
+from ..services.forecast import stock_forecasts
+from ..services.menu_availability import mark_stock_changed
+from ..services.responses import load_for_response
+from ..services.normalize import normalize_stock_movements
+from ..services.counts import TotalCounter, set_total_headers
+from ..utils.serialization import list_etag, not_modified, orm_json_response
 
 router = APIRouter(
     prefix="/api/stock",
@@ -11,6 +23,12 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+VALID_MOVEMENT_REASONS = ["RESTOCK", "WASTE", "ADJUST", "SALE"]
+UNIT_COST_ERROR = "unit_cost is only accepted on RESTOCK movements with a positive qty_change"
+
+# Movements are not in the change feed; they are written with a stock update
+movement_totals = TotalCounter(ttl=30, tables=["stock"])
+
 
 @router.get("/", response_model=List[schemas.Stock])
 def read_stock_items(
@@ -23,7 +41,7 @@ def read_stock_items(
         None, description="Filter by deletion status. None/False = active only, True = deleted only"),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_branch_db)
 ):
     query = db.query(models.Stock).options(
         joinedload(models.Stock.branch),
@@ -54,7 +72,7 @@ def read_stock_items(
 @router.get("/out-of-stock", response_model=List[schemas.Stock])
 def get_out_of_stock_items(
     branch_ids: Optional[List[int]] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_branch_db)
 ):
     """Get all stock items that are out of stock (amount_remaining = 0)."""
     query = db.query(models.Stock).options(
@@ -71,7 +89,7 @@ def get_out_of_stock_items(
 @router.get("/out-of-stock/count")
 def get_out_of_stock_count(
     branch_ids: Optional[List[int]] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_branch_db)
 ):
     """Get count of out of stock items."""
     from sqlalchemy import func
@@ -87,8 +105,24 @@ def get_out_of_stock_count(
     return {"count": count, "out_of_stock_count": count}
 
 
+@router.get("/forecast", response_model=List[schemas.StockForecast])
+def get_stock_forecast(
+    branch_ids: Optional[List[int]] = Query(None),
+    low_only: bool = Query(
+        False, description="Only stock at or below its reorder point"),
+    db: Session = Depends(get_branch_db)
+):
+    """
+    Expected daily usage, reorder point and days of cover of active stock.
+    Forecasts are refreshed nightly (``python -m app.rollups --refresh-forecasts``).
+    """
+    return stock_forecasts(db, branch_ids, low_only)
+
+
 @router.post("/", response_model=schemas.Stock, status_code=status.HTTP_201_CREATED)
-def create_stock_item(stock: schemas.StockCreate, db: Session = Depends(get_db)):
+def create_stock_item(stock: schemas.StockCreate, db: Session = Depends(get_branch_write_db)):
+    check_branch_shard(db, stock.branch_id)
+
     # Validate ingredient exists and is not deleted
     ingredient = db.query(models.Ingredients).filter(
         models.Ingredients.ingredient_id == stock.ingredient_id
@@ -104,17 +138,11 @@ def create_stock_item(stock: schemas.StockCreate, db: Session = Depends(get_db))
     db_stock = models.Stock(**stock.dict())
     db.add(db_stock)
     db.commit()
-    db.refresh(db_stock)
-    # Load relationships before returning
-    db_stock = db.query(models.Stock).options(
-        joinedload(models.Stock.branch),
-        joinedload(models.Stock.ingredient)
-    ).filter(models.Stock.stock_id == db_stock.stock_id).first()
-    return db_stock
+    return load_for_response(db, db_stock, schemas.Stock)
 
 
 @router.delete("/{stock_id}", response_model=schemas.Stock)
-def delete_stock_item(stock_id: int, db: Session = Depends(get_db)):
+def delete_stock_item(stock_id: int, db: Session = Depends(get_branch_write_db)):
     try:
         db_stock = db.query(models.Stock).options(
             joinedload(models.Stock.branch),
@@ -133,7 +161,6 @@ def delete_stock_item(stock_id: int, db: Session = Depends(get_db)):
         # Soft delete
         db_stock.is_deleted = True
         db.commit()
-        db.refresh(db_stock)
         return db_stock
     except HTTPException:
         db.rollback()
@@ -150,8 +177,9 @@ def delete_stock_item(stock_id: int, db: Session = Depends(get_db)):
 # Stock Movements Endpoints
 # =========================
 
-@router.get("/movements", response_model=List[schemas.StockMovement])
+@router.get("/movements", response_model=Union[List[schemas.StockMovement], schemas.StockMovementPageNormalized])
 def get_stock_movements(
+    request: Request,
     branch_id: Optional[int] = Query(None, description="Filter by branch"),
     stock_id: Optional[int] = Query(None, description="Filter by stock item"),
     reason: Optional[str] = Query(
@@ -165,17 +193,17 @@ def get_stock_movements(
     qty_max: Optional[float] = Query(None, description="Maximum qty_change"),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    shape: str = Query(
+        "nested", regex="^(nested|normalized)$",
+        description="'normalized' returns foreign-key ids plus a side-loaded 'included' map"),
+    with_total: bool = Query(
+        True, description="Send the number of matching movements in X-Total-Count (cached for 30 s)"),
+    estimate: bool = Query(
+        False, description="Planner estimate instead of a (capped) exact count; see X-Total-Count-Kind"),
+    db: Session = Depends(get_branch_db)
 ):
     """Get stock movements with optional filters."""
-    query = db.query(models.StockMovements).options(
-        joinedload(models.StockMovements.stock).joinedload(
-            models.Stock.ingredient),
-        joinedload(models.StockMovements.stock).joinedload(
-            models.Stock.branch),
-        joinedload(models.StockMovements.employee),
-        joinedload(models.StockMovements.order)
-    )
+    query = db.query(models.StockMovements)
 
     if branch_id:
         query = query.join(models.Stock).filter(
@@ -206,14 +234,33 @@ def get_stock_movements(
     if qty_max is not None:
         query = query.filter(models.StockMovements.qty_change <= qty_max)
 
+    total = movement_totals.total(query, estimate) if with_total else None
+
     # Order by most recent first
-    movements = query.order_by(models.StockMovements.created_at.desc()).offset(
-        skip).limit(limit).all()
-    return movements
+    page = query.order_by(models.StockMovements.created_at.desc()).offset(skip).limit(limit)
+    etag = list_etag(page, change_feed.version())
+    response = not_modified(request, etag)
+    if response is None:
+        movements = page.options(
+            joinedload(models.StockMovements.stock).joinedload(
+                models.Stock.ingredient),
+            joinedload(models.StockMovements.stock).joinedload(
+                models.Stock.branch),
+            joinedload(models.StockMovements.employee),
+            joinedload(models.StockMovements.order)
+        ).all()
+        if shape == "normalized":
+            response = orm_json_response(schemas.StockMovementPageNormalizedAdapter,
+                                         normalize_stock_movements(movements), etag=etag)
+        else:
+            response = orm_json_response(schemas.StockMovementListAdapter, movements, etag=etag)
+    if total is not None:
+        set_total_headers(response, total)
+    return response
 
 
 @router.get("/movements/{movement_id}", response_model=schemas.StockMovement)
-def get_stock_movement(movement_id: int, db: Session = Depends(get_db)):
+def get_stock_movement(movement_id: int, db: Session = Depends(get_branch_db)):
     """Get a single stock movement by ID."""
     movement = db.query(models.StockMovements).options(
         joinedload(models.StockMovements.stock).joinedload(
@@ -230,7 +277,7 @@ def get_stock_movement(movement_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/movements", response_model=schemas.StockMovement, status_code=status.HTTP_201_CREATED)
-def create_stock_movement(movement: schemas.StockMovementCreate, db: Session = Depends(get_db)):
+def create_stock_movement(movement: schemas.StockMovementCreate, db: Session = Depends(get_branch_write_db)):
     """Create a stock movement (RESTOCK, WASTE, ADJUST). SALE movements are created automatically."""
     # Validate stock exists
     stock = db.query(models.Stock).filter(
@@ -239,12 +286,13 @@ def create_stock_movement(movement: schemas.StockMovementCreate, db: Session = D
         raise HTTPException(status_code=404, detail="Stock item not found")
 
     # Validate reason
-    valid_reasons = ["RESTOCK", "WASTE", "ADJUST", "SALE"]
-    if movement.reason not in valid_reasons:
+    if movement.reason not in VALID_MOVEMENT_REASONS:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid reason. Must be one of: {', '.join(valid_reasons)}"
+            detail=f"Invalid reason. Must be one of: {', '.join(VALID_MOVEMENT_REASONS)}"
         )
+    if movement.unit_cost is not None and not _is_restock(movement.dict()):
+        raise HTTPException(status_code=400, detail=UNIT_COST_ERROR)
 
     # For RESTOCK, qty_change should be positive
     # For WASTE/SALE, qty_change should be negative
@@ -258,22 +306,207 @@ def create_stock_movement(movement: schemas.StockMovementCreate, db: Session = D
             detail=f"Insufficient stock. Available: {stock.amount_remaining}, Change: {movement.qty_change}"
         )
 
+    if movement.unit_cost is not None:
+        record_restock_costs(db, [{
+            "branch_id": stock.branch_id,
+            "ingredient_id": stock.ingredient_id,
+            "on_hand": stock.amount_remaining,
+            "qty": movement.qty_change,
+            "unit_cost": movement.unit_cost,
+        }])
     stock.amount_remaining = new_amount
 
     # Create movement record
-    db_movement = models.StockMovements(**movement.dict())
+    db_movement = models.StockMovements(**movement.dict(exclude={"unit_cost"}))
     db.add(db_movement)
     db.commit()
-    db.refresh(db_movement)
+    return load_for_response(db, db_movement, schemas.StockMovement)
+
+
+def _is_restock(movement: dict) -> bool:
+    return movement["reason"] == "RESTOCK" and movement["qty_change"] > 0
+
+
+def _apply_bulk_movements(db: Session, movements: List[dict], rows_unchanged: int = 0):
+    """
+    Validate and apply many movements at once.
+
+    Stock rows are loaded (and locked) in one query, every row is validated
+    before anything is written, quantities are applied with a single
+    set-based UPDATE and the ledger rows are inserted with one executemany.
+    Restocks with a ``unit_cost`` update the branch's ingredient costs. The
+    UPDATE skips the ORM flush hooks, so it is reported to the change feed
+    explicitly.
+    """
+    stock_ids = {m["stock_id"] for m in movements}
+    stocks = {
+        s.stock_id: s for s in db.query(models.Stock).filter(
+            models.Stock.stock_id.in_(stock_ids)
+        ).with_for_update().all()
+    } if stock_ids else {}
+
+    errors = []
+    deltas = {}
+    restocks = []
+    for row, movement in enumerate(movements, start=1):
+        stock = stocks.get(movement["stock_id"])
+        if not stock:
+            errors.append(
+                {"row": row, "detail": f"Stock item {movement['stock_id']} not found"})
+            continue
+        if stock.is_deleted:
+            errors.append(
+                {"row": row, "detail": f"Stock item {movement['stock_id']} is deleted"})
+            continue
+        if movement["reason"] not in VALID_MOVEMENT_REASONS:
+            errors.append({
+                "row": row,
+                "detail": f"Invalid reason. Must be one of: {', '.join(VALID_MOVEMENT_REASONS)}"
+            })
+            continue
+        unit_cost = movement.pop("unit_cost", None)
+        if unit_cost is not None:
+            if not _is_restock(movement):
+                errors.append({"row": row, "detail": UNIT_COST_ERROR})
+                continue
+            restocks.append({
+                "branch_id": stock.branch_id,
+                "ingredient_id": stock.ingredient_id,
+                "on_hand": stock.amount_remaining + deltas.get(stock.stock_id, Decimal("0")),
+                "qty": movement["qty_change"],
+                "unit_cost": unit_cost,
+            })
+        deltas[stock.stock_id] = deltas.get(
+            stock.stock_id, Decimal("0")) + movement["qty_change"]
+
+    for stock_id, delta in deltas.items():
+        stock = stocks[stock_id]
+        if stock.amount_remaining + delta < 0:
+            errors.append({
+                "stock_id": stock_id,
+                "detail": f"Insufficient stock. Available: {stock.amount_remaining}, Change: {delta}"
+            })
+
+    if errors:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Stock movements rejected, nothing was applied",
+                    "errors": errors}
+        )
 
-    # Reload with relationships
-    db_movement = db.query(models.StockMovements).options(
-        joinedload(models.StockMovements.stock).joinedload(
-            models.Stock.ingredient),
-        joinedload(models.StockMovements.stock).joinedload(
-            models.Stock.branch),
-        joinedload(models.StockMovements.employee),
-        joinedload(models.StockMovements.order)
-    ).filter(models.StockMovements.movement_id == db_movement.movement_id).first()
+    if deltas:
+        db.execute(
+            update(models.Stock)
+            .where(models.Stock.stock_id.in_(deltas.keys()))
+            .values(amount_remaining=models.Stock.amount_remaining + case(
+                deltas, value=models.Stock.stock_id, else_=Decimal("0")))
+            .execution_options(synchronize_session=False)
+        )
+        change_feed.record_changes(db, "stock", "UPDATE", [
+            {"stock_id": stock_id, "branch_id": stocks[stock_id].branch_id,
+             "ingredient_id": stocks[stock_id].ingredient_id}
+            for stock_id in deltas])
+        db.execute(insert(models.StockMovements), movements)
+        record_restock_costs(db, restocks)
+        for branch_id in {stocks[stock_id].branch_id for stock_id in deltas}:
+            mark_stock_changed(db, branch_id)
+    db.commit()
+
+    return {
+        "movements_created": len(movements),
+        "stock_items_updated": len(deltas),
+        "rows_unchanged": rows_unchanged,
+    }
+
+
+@router.post("/movements/bulk", response_model=schemas.StockMovementBulkResult, status_code=status.HTTP_201_CREATED)
+def create_stock_movements_bulk(payload: schemas.StockMovementBulkCreate, db: Session = Depends(get_branch_db)):
+    """Create many stock movements (e.g. a delivery) in one all-or-nothing request."""
+    if not payload.movements:
+        raise HTTPException(status_code=400, detail="No movements provided")
+    return _apply_bulk_movements(db, [m.dict() for m in payload.movements])
+
+
+@router.post("/stocktake", response_model=schemas.StockMovementBulkResult, status_code=status.HTTP_201_CREATED)
+def import_stocktake(
+    csv_body: bytes = Body(..., media_type="text/csv",
+                           description="CSV with header: stock_id,counted_amount[,note]"),
+    employee_id: Optional[int] = Query(
+        None, description="Employee who performed the count"),
+    db: Session = Depends(get_branch_db)
+):
+    """
+    Import a stocktake count. Every row whose counted amount differs from the
+    recorded amount produces an ADJUST movement for the difference.
+    """
+    try:
+        reader = csv.DictReader(io.StringIO(csv_body.decode("utf-8-sig")))
+        rows = list(reader)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV: {str(e)}")
+
+    if not reader.fieldnames or not {"stock_id", "counted_amount"} <= set(reader.fieldnames):
+        raise HTTPException(
+            status_code=400,
+            detail="CSV header must include stock_id and counted_amount"
+        )
+    if not rows:
+        raise HTTPException(status_code=400, detail="CSV contains no rows")
+
+    errors = []
+    counts = {}
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            stock_id = int(row["stock_id"])
+            counted = Decimal(row["counted_amount"].strip())
+            # Decimal accepts NaN and Infinity, which are not counts
+            if not counted.is_finite():
+                raise ValueError(row["counted_amount"])
+        except (AttributeError, TypeError, ValueError, InvalidOperation):
+            # AttributeError: a short row leaves counted_amount as None
+            errors.append(
+                {"row": row_number, "detail": "stock_id and counted_amount must be numeric"})
+            continue
+        if counted < 0:
+            errors.append(
+                {"row": row_number, "detail": "counted_amount must be >= 0"})
+            continue
+        if stock_id in counts:
+            errors.append(
+                {"row": row_number, "detail": f"Duplicate stock_id {stock_id}"})
+            continue
+        counts[stock_id] = (counted, (row.get("note") or "").strip() or None)
+
+    if errors:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Stocktake rejected, nothing was applied",
+                    "errors": errors}
+        )
 
-    return db_movement
+    # Lock the counted rows so the differences stay exact until commit
+    current = dict(db.query(models.Stock.stock_id, models.Stock.amount_remaining).filter(
+        models.Stock.stock_id.in_(counts.keys())
+    ).with_for_update().all())
+
+    movements = []
+    rows_unchanged = 0
+    for stock_id, (counted, note) in counts.items():
+        # Unknown ids are passed through so they are reported as not found
+        diff = counted - current.get(stock_id, Decimal("0"))
+        if stock_id in current and diff == 0:
+            rows_unchanged += 1
+            continue
+        movements.append({
+            "stock_id": stock_id,
+            "qty_change": diff,
+            "reason": "ADJUST",
+            "employee_id": employee_id,
+            "order_id": None,
+            "note": note or "Stocktake",
+        })
+
+    if not movements:
+        return {"movements_created": 0, "stock_items_updated": 0, "rows_unchanged": rows_unchanged}
+    return _apply_bulk_movements(db, movements, rows_unchanged=rows_unchanged)
@@ -0,0 +1,225 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Tuple
+from ..database import get_branch_db
+from .. import models, schemas
+from ..services.orders import (
+    validate_branch_and_employee, load_menu_items, prepare_order_item, recalculate_order_total
+)
+from ..services.employee_sales import record_orders_taken
+from ..services.payments import apply_payment
+
+router = APIRouter(prefix="/api/sync", tags=["sync"])
+
+SYNC_ITEM_STATUSES = ["ORDERED", "PREPARING", "DONE", "CANCELLED"]
+
+
+def _client_uuids(order: schemas.OrderSync) -> List[Tuple[str, str]]:
+    """(entity_type, client_uuid) of an order, its items and its payment."""
+    uuids = [("ORDER", str(order.client_uuid))]
+    uuids += [("ORDER_ITEM", str(item.client_uuid)) for item in order.order_items]
+    if order.payment:
+        uuids.append(("PAYMENT", str(order.payment.client_uuid)))
+    return uuids
+
+
+def _known_records(db: Session, uuids: List[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """{(entity_type, client_uuid): server_id} of the uuids already synced."""
+    wanted = set(uuids)
+    if not wanted:
+        return {}
+    return {
+        (entity_type, client_uuid): server_id
+        for client_uuid, entity_type, server_id in db.query(
+            models.SyncRecords.client_uuid,
+            models.SyncRecords.entity_type,
+            models.SyncRecords.server_id
+        ).filter(
+            models.SyncRecords.client_uuid.in_({client_uuid for _, client_uuid in wanted})
+        )
+        if (entity_type, client_uuid) in wanted
+    }
+
+
+def _apply_synced_order(db: Session, order: schemas.OrderSync,
+                        known: Dict[Tuple[str, str], int], new_records: Dict[str, tuple]):
+    """
+    Create (or extend) one client order. Entities whose client_uuid is already
+    known are skipped, so replaying the same order is a no-op.
+    """
+    order_uuid = str(order.client_uuid)
+    replayed = ("ORDER", order_uuid) in known
+
+    if replayed:
+        db_order = db.query(models.Orders).filter(
+            models.Orders.order_id == known[("ORDER", order_uuid)]).first()
+        if not db_order:
+            raise HTTPException(status_code=404, detail="Order not found")
+    else:
+        # Same checks as POST /api/orders
+        validate_branch_and_employee(db, order.branch_id, order.employee_id)
+        if order.membership_id:
+            membership = db.query(models.Memberships).filter(
+                models.Memberships.membership_id == order.membership_id
+            ).first()
+            if not membership:
+                raise HTTPException(
+                    status_code=404, detail="Membership not found")
+
+        db_order = models.Orders(
+            branch_id=order.branch_id,
+            membership_id=order.membership_id,
+            employee_id=order.employee_id,
+            order_type=order.order_type,
+            status="UNPAID",
+            total_price=Decimal("0"),
+            created_at=order.created_at or datetime.now()
+        )
+        db.add(db_order)
+        db.flush()
+        record_orders_taken(db, db_order.created_at.date(), db_order.branch_id, db_order.employee_id)
+        new_records[order_uuid] = ("ORDER", db_order.order_id)
+
+    new_items = [item for item in order.order_items
+                 if ("ORDER_ITEM", str(item.client_uuid)) not in known]
+    if new_items:
+        if db_order.status in ("PAID", "CANCELLED"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot add items to a {db_order.status.lower()} order"
+            )
+        for item in new_items:
+            if item.status not in SYNC_ITEM_STATUSES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid item status. Must be one of: {', '.join(SYNC_ITEM_STATUSES)}"
+                )
+        menu_items_dict = load_menu_items(db, new_items)
+
+        for item in new_items:
+            menu_item = menu_items_dict[item.menu_item_id]
+            db_order_item = models.OrderItems(
+                order_id=db_order.order_id,
+                menu_item_id=item.menu_item_id,
+                status="ORDERED",
+                quantity=item.quantity,
+                unit_price=menu_item.price,
+                line_total=item.quantity * menu_item.price
+            )
+            db_order_item.menu_item = menu_item
+            db.add(db_order_item)
+            db.flush()
+            # Items already cooked offline deduct stock like ORDERED → PREPARING
+            if item.status in ("PREPARING", "DONE"):
+                prepare_order_item(db, db_order, db_order_item)
+            db_order_item.status = item.status
+            new_records[str(item.client_uuid)] = (
+                "ORDER_ITEM", db_order_item.order_item_id)
+
+        recalculate_order_total(db, db_order)
+
+    payment_order_id = None
+    if order.payment:
+        payment_uuid = str(order.payment.client_uuid)
+        if ("PAYMENT", payment_uuid) in known:
+            payment_order_id = known[("PAYMENT", payment_uuid)]
+        else:
+            db.flush()
+            apply_payment(db, db_order, schemas.PaymentCreate(
+                order_id=db_order.order_id,
+                **order.payment.dict(exclude={"client_uuid"})
+            ))
+            db.flush()
+            payment_order_id = db_order.order_id
+            new_records[payment_uuid] = ("PAYMENT", db_order.order_id)
+
+    ids = {**known, **{(entity_type, client_uuid): server_id
+                       for client_uuid, (entity_type, server_id) in new_records.items()}}
+    return schemas.OrderSyncApplied(
+        client_uuid=order.client_uuid,
+        order_id=db_order.order_id,
+        replayed=replayed,
+        order_items=[
+            schemas.SyncIdMap(client_uuid=item.client_uuid,
+                              server_id=ids[("ORDER_ITEM", str(item.client_uuid))])
+            for item in order.order_items
+        ],
+        payment_order_id=payment_order_id
+    )
+
+
+@router.post("/orders", response_model=schemas.OrderSyncResult)
+def sync_orders(batch: schemas.OrderSyncBatch, db: Session = Depends(get_branch_db)):
+    """
+    Apply a batch of orders created offline, in one transaction.
+
+    Each order runs in its own savepoint: an order that fails validation is
+    rolled back and reported under ``conflicts`` without affecting the rest
+    of the batch. Client UUIDs are recorded, so replaying a batch returns the
+    same server ids and writes nothing twice. An order whose UUIDs were
+    recorded meanwhile (the same batch replayed concurrently) is applied
+    again as a replay. A client UUID used twice in the batch is rejected.
+    """
+    uuids = [uuid for order in batch.orders for uuid in _client_uuids(order)]
+    seen, duplicates = set(), []
+    for _, client_uuid in uuids:
+        if client_uuid in seen and client_uuid not in duplicates:
+            duplicates.append(client_uuid)
+        seen.add(client_uuid)
+    if duplicates:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Duplicate client_uuid in batch: {', '.join(duplicates)}"
+        )
+
+    known = _known_records(db, uuids)
+
+    result = schemas.OrderSyncResult()
+    for order in batch.orders:
+        # A second attempt re-reads the order's records after a unique violation
+        for attempt in range(2):
+            new_records: Dict[str, tuple] = {}
+            savepoint = db.begin_nested()
+            try:
+                applied = _apply_synced_order(db, order, known, new_records)
+                for client_uuid, (entity_type, server_id) in new_records.items():
+                    db.add(models.SyncRecords(
+                        client_uuid=client_uuid,
+                        entity_type=entity_type,
+                        server_id=server_id
+                    ))
+                db.flush()
+                savepoint.commit()
+            except HTTPException as e:
+                savepoint.rollback()
+                conflict = schemas.OrderSyncConflict(
+                    client_uuid=order.client_uuid,
+                    status_code=e.status_code,
+                    detail=e.detail
+                )
+            except IntegrityError as e:
+                savepoint.rollback()
+                conflict = schemas.OrderSyncConflict(
+                    client_uuid=order.client_uuid,
+                    status_code=409,
+                    detail=f"Conflicting sync records: {e.orig}"
+                )
+                if attempt == 0:
+                    known.update(_known_records(db, _client_uuids(order)))
+                    continue
+            else:
+                conflict = None
+            break
+
+        if conflict is not None:
+            result.conflicts.append(conflict)
+            continue
+        known.update({(entity_type, client_uuid): server_id
+                      for client_uuid, (entity_type, server_id) in new_records.items()})
+        result.applied.append(applied)
+
+    db.commit()
+    return result
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
+from uuid import UUID
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 
 
 # =========================
@@ -146,6 +147,22 @@ class Stock(StockBase):
         from_attributes = True
 
 
+class StockForecast(BaseModel):
+    """Forecast demand of a stock item; amounts are in the ingredient's base unit."""
+    stock_id: int
+    branch_id: int
+    ingredient_id: int
+    ingredient_name: str
+    base_unit: str
+    amount_remaining: Decimal
+    avg_daily_usage: Decimal
+    daily_usage_stddev: Decimal
+    reorder_point: Decimal
+    days_of_cover: Optional[float] = None   # None: no usage in the forecast window
+    needs_reorder: bool
+    computed_for: date
+
+
 # =========================
 # Ingredient Schemas
 # =========================
@@ -190,6 +207,32 @@ class Menu(MenuBase):
         from_attributes = True
 
 
+class MenuWithMakeable(Menu):
+    # Portions the branch can still prepare from stock (None = no recipe)
+    makeable_qty: Optional[int] = None
+
+
+class MenuCompanion(BaseModel):
+    """A menu item often paid for in the same order as another (upsell prompt)."""
+    menu_item_id: int
+    name: str
+    price: Decimal
+    category: str
+    order_count: int                # paid orders containing both items
+
+
+class MenuItemCost(BaseModel):
+    """Recipe cost and margin of one portion at a branch."""
+    menu_item_id: int
+    name: str
+    category: str
+    price: Decimal
+    unit_cost: Optional[Decimal] = None     # None: no recipe, or an ingredient has no cost yet
+    margin: Optional[Decimal] = None        # price - unit_cost
+    margin_pct: Optional[float] = None
+    uncosted_ingredients: int = 0
+
+
 # =========================
 # Recipe Schemas (renamed from MenuIngredient)
 # =========================
@@ -228,6 +271,8 @@ class OrderItemCreate(BaseModel):
     menu_item_id: int
     quantity: int
     status: str = "PREPARING"
+    # PUT /api/orders/{id}: identifies the existing line to keep/update
+    order_item_id: Optional[int] = None
     # unit_price is NOT included - it will always be copied from menu_item.price
 
 
@@ -235,6 +280,21 @@ class OrderItemStatusUpdate(BaseModel):
     status: str  # PREPARING, DONE, CANCELLED
 
 
+class KitchenQueueItem(BaseModel):
+    """An ORDERED or PREPARING line on the kitchen display, oldest order first."""
+    order_item_id: int
+    order_id: int
+    menu_item_id: int
+    menu_item_name: str
+    quantity: int
+    status: str                     # ORDERED, PREPARING
+    order_type: str
+    ordered_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 class OrderItem(OrderItemBase):
     order_item_id: int
     order_id: int
@@ -259,6 +319,15 @@ class OrderCreate(OrderBase):
     order_items: List[OrderItemCreate]
 
 
+class OrderCreated(BaseModel):
+    """Minimal create response (``?return=minimal``)."""
+    order_id: int
+    status: str
+    total_price: Decimal
+    created_at: datetime
+    order_item_ids: List[int]
+
+
 class OrderCreateEmpty(BaseModel):
     branch_id: int
     employee_id: int
@@ -337,7 +406,8 @@ class StockMovementBase(BaseModel):
 
 
 class StockMovementCreate(StockMovementBase):
-    pass
+    # Purchase price per base unit, RESTOCK only (updates the branch's ingredient cost)
+    unit_cost: Optional[Decimal] = Field(None, ge=0)
 
 
 class StockMovement(StockMovementBase):
@@ -351,6 +421,17 @@ class StockMovement(StockMovementBase):
         from_attributes = True
 
 
+# Bulk restock / stocktake import
+class StockMovementBulkCreate(BaseModel):
+    movements: List[StockMovementCreate]
+
+
+class StockMovementBulkResult(BaseModel):
+    movements_created: int
+    stock_items_updated: int
+    rows_unchanged: int = 0     # stocktake rows whose count matched stock
+
+
 # StockMovement schema for nested use in Order (excludes circular order reference)
 class StockMovementInOrder(StockMovementBase):
     movement_id: int
@@ -362,6 +443,155 @@ class StockMovementInOrder(StockMovementBase):
         from_attributes = True
 
 
+# =========================
+# Offline Sync Schemas (client-generated UUIDs)
+# =========================
+class OrderSyncItem(BaseModel):
+    client_uuid: UUID
+    menu_item_id: int
+    quantity: int
+    status: str = "ORDERED"         # ORDERED, PREPARING, DONE, CANCELLED
+
+
+class OrderSyncPayment(BaseModel):
+    client_uuid: UUID
+    paid_price: Optional[Decimal] = None
+    points_used: int = 0
+    payment_method: str
+    payment_ref: Optional[str] = None
+    paid_timestamp: Optional[datetime] = None
+
+
+class OrderSync(BaseModel):
+    client_uuid: UUID
+    branch_id: int
+    employee_id: int
+    membership_id: Optional[int] = None
+    order_type: str = "DINE_IN"
+    created_at: Optional[datetime] = None   # client clock, defaults to server time
+    order_items: List[OrderSyncItem] = []
+    payment: Optional[OrderSyncPayment] = None
+
+
+class OrderSyncBatch(BaseModel):
+    orders: List[OrderSync]
+
+
+class SyncIdMap(BaseModel):
+    client_uuid: UUID
+    server_id: int
+
+
+class OrderSyncApplied(BaseModel):
+    client_uuid: UUID
+    order_id: int
+    replayed: bool                  # True if the order had been synced before
+    order_items: List[SyncIdMap] = []
+    payment_order_id: Optional[int] = None
+
+
+class OrderSyncConflict(BaseModel):
+    client_uuid: UUID
+    status_code: int
+    detail: Any
+
+
+class OrderSyncResult(BaseModel):
+    applied: List[OrderSyncApplied] = []
+    conflicts: List[OrderSyncConflict] = []
+
+
+# =========================
+# Normalized ("included") Schemas
+# =========================
+# ?shape=normalized: rows carry foreign-key ids only and every related
+# object appears once, keyed by id, in ``included``.
+class EmployeeNormalized(EmployeeBase):
+    employee_id: int
+    joined_date: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class MembershipNormalized(MembershipBase):
+    membership_id: int
+    joined_at: datetime
+    is_deleted: bool = False
+
+    class Config:
+        from_attributes = True
+
+
+class StockNormalized(StockBase):
+    stock_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class OrderItemNormalized(OrderItemBase):
+    order_item_id: int
+    order_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class StockMovementNormalized(StockMovementBase):
+    movement_id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class OrderNormalized(OrderBase):
+    order_id: int
+    created_at: datetime
+    total_price: Decimal
+    order_items: List[OrderItemNormalized] = []
+    payment: Optional[PaymentInOrder] = None
+    stock_movements: List[StockMovementNormalized] = []
+
+    class Config:
+        from_attributes = True
+
+
+class PaymentNormalized(PaymentBase):
+    order_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class Included(BaseModel):
+    branches: Dict[int, Branch] = {}
+    employees: Dict[int, EmployeeNormalized] = {}
+    roles: Dict[int, Role] = {}
+    memberships: Dict[int, MembershipNormalized] = {}
+    tiers: Dict[int, Tier] = {}
+    menu_items: Dict[int, Menu] = {}
+    orders: Dict[int, OrderNormalized] = {}
+    stock: Dict[int, StockNormalized] = {}
+    ingredients: Dict[int, Ingredient] = {}
+
+
+class OrderPageNormalized(BaseModel):
+    data: List[OrderNormalized]
+    included: Included
+
+
+class PaymentPageNormalized(BaseModel):
+    data: List[PaymentNormalized]
+    included: Included
+
+
+class StockMovementPageNormalized(BaseModel):
+    data: List[StockMovementNormalized]
+    included: Included
+
+
 # For Pydantic v2 circular references
 Order.model_rebuild()
 Payment.model_rebuild()
@@ -370,3 +600,17 @@ StockMovement.model_rebuild()
 StockMovementInOrder.model_rebuild()
 Recipe.model_rebuild()
 Stock.model_rebuild()
+
+
+# =========================
+# Pre-built adapters for heavy list/detail responses
+# =========================
+# Built once at import; used with app.utils.serialization.orm_json_response
+OrderAdapter = TypeAdapter(Order)
+OrderListAdapter = TypeAdapter(List[Order])
+PaymentListAdapter = TypeAdapter(List[Payment])
+StockMovementListAdapter = TypeAdapter(List[StockMovement])
+OrderPageNormalizedAdapter = TypeAdapter(OrderPageNormalized)
+PaymentPageNormalizedAdapter = TypeAdapter(PaymentPageNormalized)
+StockMovementPageNormalizedAdapter = TypeAdapter(StockMovementPageNormalized)
+KitchenQueueAdapter = TypeAdapter(List[KitchenQueueItem])
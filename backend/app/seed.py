@@ -5,6 +5,10 @@ from .models import (
     Roles, Employees, Memberships, Menu, Stock, Recipe, Ingredients,
     Orders, OrderItems, Payments, Branches, Tiers, StockMovements
 )
+from .services.companions import rebuild_pairs
+from .services.employee_sales import rebuild_employee_sales
+from .services.forecast import rebuild_stock_usage
+from .services.item_sales import rebuild_item_sales
 from decimal import Decimal
 from datetime import datetime, timedelta
 import random
@@ -697,6 +701,16 @@ def seed_database():
         print(
             f"✓ Seeded {orders_created} Orders with {payments_created} Payments")
 
+        # Daily item sales counters, item pairs and employee counters of the seeded orders
+        counter_rows = rebuild_item_sales(db)
+        pair_rows = rebuild_pairs(db)
+        employee_rows = rebuild_employee_sales(db)
+        usage_rows = rebuild_stock_usage(db)
+        db.commit()
+        print(f"✓ Rebuilt {counter_rows} item sales counters, {pair_rows} item pairs "
+              f"and {employee_rows} employee counters")
+        print(f"✓ Rebuilt {usage_rows} stock usage days and the stock forecasts")
+
         # =====================
         # FIX SEQUENCES (Critical: Reset sequences to match max IDs)
         # This prevents "duplicate key" errors when creating new records
@@ -0,0 +1,185 @@
+"""
+Cross-worker cache invalidation over PostgreSQL LISTEN/NOTIFY.
+
+Every worker process keeps its own in-process caches. A write that changes
+cached data publishes a message with ``pg_notify`` inside its transaction, so
+the message is delivered only if the transaction commits (and not at all for
+a rolled-back savepoint). A listener thread in each worker hands incoming
+messages to the handlers subscribed to their topic. A worker skips its own
+messages, since it already updated its caches in its commit hooks.
+
+Other modules can LISTEN on further channels through the same connection
+with ``listen()`` (see ``change_feed``). With branch shards, a message is
+NOTIFYed on the database the writing session is bound to, and the listener
+LISTENs on every PostgreSQL shard. On other databases (SQLite, single
+process) publishing is a no-op and no listener runs.
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ..database import get_shard_engine, shard_ids
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "pos_cache"
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+Handler = Callable[[dict], None]
+ResetHandler = Callable[[], None]
+
+_handlers: Dict[str, List[Handler]] = {}
+_reset_handlers: List[ResetHandler] = []
+# channel -> callback(raw payload)
+_channels: Dict[str, Callable[[str], None]] = {}
+_HOST = socket.gethostname()
+
+
+def _sender_id() -> str:
+    # Computed per call: workers forked from a preloaded app share module state
+    return f"{_HOST}:{os.getpid()}"
+
+
+def subscribe(topic: str, handler: Handler, reset: Optional[ResetHandler] = None):
+    """
+    Register ``handler(data)`` for messages published on ``topic`` by other
+    workers. ``reset()`` is called when messages may have been missed (the
+    listener reconnected) and should drop everything the cache holds.
+    """
+    _handlers.setdefault(topic, []).append(handler)
+    if reset is not None:
+        _reset_handlers.append(reset)
+
+
+def publish(db: Session, topic: str, data: dict) -> bool:
+    """
+    Queue a message in the session's transaction; it is sent on commit.
+
+    Returns False if nothing was queued: the database is not PostgreSQL or
+    the payload is too large (callers then publish a coarser message).
+    """
+    connection = db.connection()
+    if connection.dialect.name != "postgresql":
+        return False
+    payload = json.dumps({"sender": _sender_id(), "topic": topic, "data": data},
+                         separators=(",", ":"), default=str)
+    if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+        return False
+    connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                       {"channel": CHANNEL, "payload": payload})
+    return True
+
+
+def dispatch(payload: str):
+    """Deliver one raw NOTIFY payload to the subscribed handlers."""
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        logger.warning("Ignoring malformed cache message: %.200s", payload)
+        return
+    if message.get("sender") == _sender_id():
+        return
+    for handler in _handlers.get(message.get("topic"), ()):
+        try:
+            handler(message.get("data") or {})
+        except Exception:
+            logger.exception("Cache handler failed for topic %s",
+                             message.get("topic"))
+
+
+def reset_all():
+    for reset in _reset_handlers:
+        reset()
+
+
+def listen(channel: str, callback: Callable[[str], None]):
+    """
+    Deliver raw payloads NOTIFYed on ``channel`` to ``callback``. Register
+    before the listener starts (i.e. at import time).
+    """
+    _channels[channel] = callback
+
+
+_channels[CHANNEL] = dispatch
+
+
+class CacheListener:
+    """
+    Background threads, one per PostgreSQL database (shard), that LISTEN on
+    every registered channel over a dedicated connection (detached from the
+    pool) and dispatch notifications as they arrive.
+    """
+
+    def __init__(self, poll_timeout: float = 5.0, reconnect_delay: float = 2.0):
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> bool:
+        """Start listening. Returns False when no database is PostgreSQL."""
+        engines = [engine for engine in map(get_shard_engine, shard_ids())
+                   if engine.dialect.name == "postgresql"]
+        if not engines:
+            return False
+        if any(thread.is_alive() for thread in self._threads):
+            return True
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, args=(engine,),
+                             name=f"cache-listener-{i}", daemon=True)
+            for i, engine in enumerate(engines)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=self.poll_timeout + 1)
+        self._threads = []
+
+    def _run(self, engine: Engine):
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                self._listen(engine, reset=connected_before)
+            except Exception:
+                logger.exception("Cache listener disconnected, reconnecting")
+            connected_before = True
+            self._stop.wait(self.reconnect_delay)
+
+    def _listen(self, engine: Engine, reset: bool):
+        raw = engine.raw_connection()
+        conn = raw.driver_connection
+        raw.detach()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                for channel in _channels:
+                    cursor.execute(f"LISTEN {channel}")
+            if reset:
+                # Anything published while we were disconnected is lost
+                reset_all()
+            while not self._stop.is_set():
+                if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    _channels[notify.channel](notify.payload)
+        finally:
+            conn.close()
+
+
+listener = CacheListener()
@@ -0,0 +1,245 @@
+"""
+Change feed for menu, recipe, ingredients, tiers, stock, orders, order
+items, payments, employees, roles, memberships and branches.
+
+On PostgreSQL, row triggers (installed by ``install_triggers``, run from
+``init_db``) NOTIFY ``pos_changes`` with a compact JSON payload for every
+insert, update and delete, whatever wrote the row: ORM flushes, Core bulk
+statements or psql. Notifications are sent on commit only. The cache_bus
+listener thread of every worker receives them and calls the subscribers, so
+each worker sees every committed change, including its own.
+
+On other databases the same subscribers are fed from this process's ORM
+flushes after commit. Core statements are not seen there; code that writes
+feed tables with them reports the rows through ``record_changes``.
+"""
+import json
+import logging
+import secrets
+import threading
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal, get_engine
+from . import cache_bus
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "pos_changes"
+
+# table -> (model, primary key column, extra columns carried in the payload)
+FEED_TABLES = {
+    "menu": (models.Menu, "menu_item_id", ()),
+    "recipe": (models.Recipe, "id", ("menu_item_id", "ingredient_id")),
+    "ingredients": (models.Ingredients, "ingredient_id", ()),
+    "tiers": (models.Tiers, "tier_id", ()),
+    "stock": (models.Stock, "stock_id", ("branch_id", "ingredient_id")),
+    "orders": (models.Orders, "order_id", ("branch_id", "status")),
+    "order_items": (models.OrderItems, "order_item_id", ("order_id", "status")),
+    "payments": (models.Payments, "order_id", ()),
+    "employees": (models.Employees, "employee_id", ("branch_id",)),
+    "roles": (models.Roles, "role_id", ()),
+    "memberships": (models.Memberships, "membership_id", ()),
+    "branches": (models.Branches, "branch_id", ()),
+}
+_TABLE_BY_MODEL = {model: table for table, (model, _, _) in FEED_TABLES.items()}
+
+
+class Change(NamedTuple):
+    table: str
+    op: str                    # INSERT, UPDATE or DELETE
+    id: Any
+    fields: Dict[str, Any]     # the table's extra columns, e.g. {"branch_id": 2}
+
+
+Subscriber = Callable[[Change], None]
+
+_subscribers: Dict[int, tuple] = {}
+_subscribers_lock = threading.Lock()
+_next_token = 0
+
+# Changes published per table by this process, for ``version``
+_published: Dict[str, int] = {}
+_PROCESS_TOKEN = secrets.token_hex(4)
+
+
+def subscribe(handler: Subscriber, tables: Optional[Iterable[str]] = None) -> int:
+    """
+    Call ``handler(change)`` for every committed change to ``tables`` (all
+    feed tables if None). Handlers run on the listener thread and must not
+    block. Returns a token for ``unsubscribe``.
+    """
+    global _next_token
+    unknown = set(tables or ()) - set(FEED_TABLES)
+    if unknown:
+        raise ValueError(f"Not in the change feed: {', '.join(sorted(unknown))}")
+    with _subscribers_lock:
+        _next_token += 1
+        _subscribers[_next_token] = (
+            handler, frozenset(tables) if tables else None)
+        return _next_token
+
+
+def unsubscribe(token: int):
+    with _subscribers_lock:
+        _subscribers.pop(token, None)
+
+
+def version(tables: Optional[Iterable[str]] = None) -> str:
+    """
+    A token that changes whenever a change to one of ``tables`` (all feed
+    tables if None) is published. It is only comparable within one worker
+    process, so it includes a per-process part.
+    """
+    with _subscribers_lock:
+        count = sum(_published.get(table, 0) for table in tables or FEED_TABLES)
+    return f"{_PROCESS_TOKEN}.{count}"
+
+
+def publish(change: Change):
+    """Hand a change to every matching subscriber."""
+    with _subscribers_lock:
+        _published[change.table] = _published.get(change.table, 0) + 1
+        targets = list(_subscribers.values())
+    for handler, tables in targets:
+        if tables is not None and change.table not in tables:
+            continue
+        try:
+            handler(change)
+        except Exception:
+            logger.exception("Change feed subscriber failed on %s", change.table)
+
+
+def _on_notify(payload: str):
+    try:
+        data = json.loads(payload)
+        change = Change(data.pop("table"), data.pop("op"), data.pop("id"), data)
+    except (ValueError, KeyError):
+        logger.warning("Ignoring malformed change payload: %.200s", payload)
+        return
+    publish(change)
+
+
+cache_bus.listen(CHANNEL, _on_notify)
+
+
+# -------------------------------------------------
+# PostgreSQL triggers
+# -------------------------------------------------
+_NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION pos_notify_change() RETURNS trigger AS $$
+DECLARE
+    row_data jsonb;
+    payload jsonb;
+    i integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := to_jsonb(OLD);
+    ELSE
+        row_data := to_jsonb(NEW);
+    END IF;
+    -- TG_ARGV: feed table name (TG_TABLE_NAME is the partition's), key column, extras
+    payload := jsonb_build_object(
+        'table', TG_ARGV[0], 'op', TG_OP, 'id', row_data -> TG_ARGV[1]);
+    FOR i IN 2 .. TG_NARGS - 1 LOOP
+        payload := payload || jsonb_build_object(TG_ARGV[i], row_data -> TG_ARGV[i]);
+    END LOOP;
+    PERFORM pg_notify('{CHANNEL}', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def install_triggers(bind: Engine = None) -> list:
+    """(Re)create the change feed triggers. PostgreSQL only; returns the tables."""
+    bind = bind or get_engine()
+    if bind.dialect.name != "postgresql":
+        return []
+    with bind.begin() as conn:
+        conn.execute(text(_NOTIFY_FUNCTION))
+        for table, (_, key, extras) in FEED_TABLES.items():
+            args = ", ".join(f"'{arg}'" for arg in (table, key, *extras))
+            conn.execute(text(f"DROP TRIGGER IF EXISTS pos_change_feed ON {table}"))
+            conn.execute(text(
+                f"CREATE TRIGGER pos_change_feed "
+                f"AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION pos_notify_change({args})"
+            ))
+    return list(FEED_TABLES)
+
+
+# -------------------------------------------------
+# Fallback for other databases: ORM flushes, published after commit
+# -------------------------------------------------
+_PENDING_KEY = "change_feed"
+_SAVEPOINTS_KEY = "change_feed_savepoints"
+
+
+def _uses_triggers(session: Session) -> bool:
+    return session.get_bind().dialect.name == "postgresql"
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session, flush_context):
+    if _uses_triggers(session):
+        return
+    pending = session.info.setdefault(_PENDING_KEY, [])
+    for objects, op in ((session.new, "INSERT"), (session.dirty, "UPDATE"),
+                        (session.deleted, "DELETE")):
+        for obj in objects:
+            table = _TABLE_BY_MODEL.get(type(obj))
+            if table is None:
+                continue
+            if op == "UPDATE" and not session.is_modified(obj, include_collections=False):
+                continue
+            _, key, extras = FEED_TABLES[table]
+            state = inspect(obj)
+            values = {column: state.dict.get(column) for column in (key, *extras)}
+            pending.append(Change(table, op, values.pop(key), values))
+
+
+def record_changes(session: Session, table: str, op: str, rows: Iterable[Dict[str, Any]]):
+    """
+    Publish ``op`` on ``rows`` of ``table`` when ``session`` commits.
+
+    For rows written with Core statements, which bypass the flush hook. Each
+    row needs the table's key and extra columns. A no-op on PostgreSQL, where
+    the triggers already see the statements.
+    """
+    if _uses_triggers(session):
+        return
+    _, key, extras = FEED_TABLES[table]
+    session.info.setdefault(_PENDING_KEY, []).extend(
+        Change(table, op, row[key], {column: row.get(column) for column in extras})
+        for row in rows)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_changes(session):
+    session.info.pop(_SAVEPOINTS_KEY, None)
+    for change in session.info.pop(_PENDING_KEY, ()):
+        publish(change)
+
+
+@event.listens_for(SessionLocal, "after_transaction_create")
+def _mark_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.setdefault(_SAVEPOINTS_KEY, {})[transaction] = len(
+            session.info.get(_PENDING_KEY, ()))
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    # after_rollback also fires for savepoints, so only this hook tells them apart
+    if previous_transaction.nested:
+        start = session.info.get(_SAVEPOINTS_KEY, {}).pop(previous_transaction, None)
+        if start is not None and _PENDING_KEY in session.info:
+            del session.info[_PENDING_KEY][start:]
+    else:
+        session.info.pop(_PENDING_KEY, None)
+        session.info.pop(_SAVEPOINTS_KEY, None)
@@ -0,0 +1,162 @@
+"""
+"Frequently bought together": a sparse co-occurrence matrix of menu items.
+
+``item_pairs`` has, per branch, one row per ordered pair of menu items that
+appeared together in a paid order, with the number of such orders. Pairs
+never bought together have no row. Each pair is stored in both directions,
+so the companions of an item at a branch are one range of
+``ix_item_pairs_top`` read in count order: the top k cost O(k).
+
+``record_order_pairs`` adds a paid order in the payment's transaction
+(d distinct items make d * (d - 1) upserts). ``rebuild_pairs`` recomputes
+the matrix from the orders in ``order_items``, counting order-id ranges in
+parallel. Cancelled lines are not counted.
+"""
+from datetime import date, datetime, time
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased
+
+from .. import models
+from ..database import SessionLocal
+from .fanout import ANALYTICS_WORKERS, fan_out, run_parallel, sum_by_key, top_k
+from .item_sales import add_to_counters
+
+_KEY = ["branch_id", "menu_item_id", "companion_id"]
+BATCH_SIZE = 1000
+
+
+def record_order_pairs(db: Session, order: models.Orders,
+                       order_items: List[models.OrderItems]) -> None:
+    """Count a paid order for every pair of its distinct items. Does not commit."""
+    items = sorted({item.menu_item_id for item in order_items if item.status != "CANCELLED"})
+    # Sorted, so concurrent payments lock shared rows in the same order
+    add_to_counters(db, models.ItemPairs.__table__, _KEY, ["order_count"], [
+        {"branch_id": order.branch_id, "menu_item_id": item, "companion_id": companion,
+         "order_count": 1}
+        for item in items for companion in items if companion != item
+    ])
+
+
+def _count_range(engine: Engine, low: int, high: int,
+                 since: Optional[date]) -> Dict[Tuple[int, int, int], int]:
+    """{(branch_id, menu_item_id, companion_id): orders} of PAID orders low..high."""
+    db = SessionLocal(bind=engine)
+    try:
+        Orders = models.Orders
+        item, companion = aliased(models.OrderItems), aliased(models.OrderItems)
+        query = db.query(
+            Orders.branch_id,
+            item.menu_item_id,
+            companion.menu_item_id,
+            func.count(func.distinct(Orders.order_id))
+        ).join(
+            item, item.order_id == Orders.order_id
+        ).join(
+            companion, and_(companion.order_id == Orders.order_id,
+                            companion.menu_item_id != item.menu_item_id)
+        ).filter(
+            Orders.order_id.between(low, high),
+            Orders.status == "PAID",
+            item.status != "CANCELLED",
+            companion.status != "CANCELLED"
+        )
+        if since is not None:
+            query = query.filter(Orders.created_at >= datetime.combine(since, time.min))
+        return {
+            (branch_id, menu_item_id, companion_id): order_count
+            for branch_id, menu_item_id, companion_id, order_count in query.group_by(
+                Orders.branch_id, item.menu_item_id, companion.menu_item_id)
+        }
+    finally:
+        db.close()
+
+
+def rebuild_pairs(db: Session, since: Optional[date] = None,
+                  ranges: int = ANALYTICS_WORKERS) -> int:
+    """
+    Replace the matrix with the pairs of the PAID orders in ``order_items``
+    (created on/after ``since`` if given). The order ids are split into
+    ``ranges`` ranges counted in parallel. Archived orders drop out of the
+    matrix. Returns the number of rows written. Does not commit.
+    """
+    Orders = models.Orders
+    bounds = db.query(func.min(Orders.order_id), func.max(Orders.order_id)).filter(
+        Orders.status == "PAID")
+    if since is not None:
+        bounds = bounds.filter(Orders.created_at >= datetime.combine(since, time.min))
+    low, high = bounds.one()
+
+    counts = {}
+    if low is not None:
+        step = (high - low) // max(1, ranges) + 1
+        counts = sum_by_key(run_parallel([
+            partial(_count_range, db.get_bind(), start, min(start + step - 1, high), since)
+            for start in range(low, high + 1, step)
+        ]))
+
+    db.query(models.ItemPairs).delete(synchronize_session=False)
+    rows = [
+        {"branch_id": branch_id, "menu_item_id": menu_item_id, "companion_id": companion_id,
+         "order_count": order_count}
+        for (branch_id, menu_item_id, companion_id), order_count in sorted(counts.items())
+    ]
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.execute(models.ItemPairs.__table__.insert(), rows[i:i + BATCH_SIZE])
+    return len(rows)
+
+
+def _branch_companions(db: Session, menu_item_id: int, k: int,
+                       branch_id: int) -> List[Tuple[int, int]]:
+    # Walks ix_item_pairs_top backwards and stops after k available items
+    pairs = models.ItemPairs
+    return db.query(pairs.companion_id, pairs.order_count).join(
+        models.Menu, models.Menu.menu_item_id == pairs.companion_id
+    ).filter(
+        pairs.branch_id == branch_id,
+        pairs.menu_item_id == menu_item_id,
+        models.Menu.is_available == True
+    ).order_by(
+        pairs.order_count.desc(), pairs.companion_id.desc()
+    ).limit(k).all()
+
+
+def _companion_counts(db: Session, branch_ids: Optional[List[int]],
+                      menu_item_id: int) -> Dict[int, int]:
+    pairs = models.ItemPairs
+    query = db.query(pairs.companion_id, func.sum(pairs.order_count)).filter(
+        pairs.menu_item_id == menu_item_id)
+    if branch_ids:
+        query = query.filter(pairs.branch_id.in_(branch_ids))
+    return {companion_id: int(count) for companion_id, count in query.group_by(pairs.companion_id)}
+
+
+def top_companions(db: Session, menu_item_id: int, k: int = 5,
+                   branch_id: Optional[int] = None) -> List[dict]:
+    """
+    The ``k`` available menu items most often paid for together with
+    ``menu_item_id``, shaped like ``schemas.MenuCompanion``. With
+    ``branch_id`` this reads k index entries; across all branches the
+    item's row of every branch is summed.
+    """
+    if branch_id is not None:
+        top = _branch_companions(db, menu_item_id, k, branch_id)
+    else:
+        counts = sum_by_key(fan_out(
+            db, lambda session, group: _companion_counts(session, group, menu_item_id)))
+        available = {row[0] for row in db.query(models.Menu.menu_item_id).filter(
+            models.Menu.menu_item_id.in_(list(counts)), models.Menu.is_available == True)}
+        top = top_k({companion: count for companion, count in counts.items()
+                     if companion in available}, k)
+
+    menu = {item.menu_item_id: item for item in db.query(models.Menu).filter(
+        models.Menu.menu_item_id.in_([companion for companion, _ in top]))}
+    return [
+        {"menu_item_id": companion, "name": menu[companion].name,
+         "price": menu[companion].price, "category": menu[companion].category,
+         "order_count": order_count}
+        for companion, order_count in top
+    ]
@@ -0,0 +1,215 @@
+"""
+Recipe costs and margins.
+
+A RESTOCK movement may carry the purchase price per base unit. The branch's
+cost of that ingredient (``ingredient_costs``) is then moved to the weighted
+average of the stock on hand and the delivery:
+
+    cost = (on hand * cost + received * price) / (on hand + received)
+
+The cost of one portion of a menu item at a branch is the sum of its recipe
+lines times these costs. It is cached in ``menu_item_costs``: missing rows
+are computed by one INSERT ... SELECT over recipe and ingredient costs, and
+rows are deleted when an input changes (a priced restock of one of the
+item's ingredients at that branch, or a change to the item's recipe). Margin
+analytics multiply the units in ``item_sales_daily`` by the cached costs, so
+no request walks recipes item by item.
+
+Costs are current costs: past sales are valued at today's recipe cost. Items
+without a recipe, or with an ingredient the branch has no price for yet,
+have no cost and are reported separately.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, case, exists, func, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import models
+from .fanout import fan_out, sum_nested
+
+UNIT_COST = Decimal("0.0001")
+
+
+def _insert(db: Session, table):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def record_restock_costs(db: Session, restocks: List[dict]) -> None:
+    """
+    Fold priced restocks into the branches' ingredient costs and drop the
+    cached costs of the menu items using them. ``restocks`` are dicts of
+    branch_id, ingredient_id, on_hand (before the restock), qty and
+    unit_cost, applied in order. Does not commit.
+    """
+    if not restocks:
+        return
+    costs = models.IngredientCosts
+    current = {
+        (branch_id, ingredient_id): unit_cost
+        for branch_id, ingredient_id, unit_cost in db.query(
+            costs.branch_id, costs.ingredient_id, costs.unit_cost
+        ).filter(
+            costs.branch_id.in_({r["branch_id"] for r in restocks}),
+            costs.ingredient_id.in_({r["ingredient_id"] for r in restocks})
+        ).with_for_update()
+    }
+
+    changed = set()
+    for restock in restocks:
+        key = (restock["branch_id"], restock["ingredient_id"])
+        on_hand, qty = max(restock["on_hand"], Decimal("0")), restock["qty"]
+        cost = current.get(key)
+        if cost is None or on_hand == 0:
+            cost = restock["unit_cost"]
+        else:
+            cost = (on_hand * cost + qty * restock["unit_cost"]) / (on_hand + qty)
+        current[key] = cost.quantize(UNIT_COST)
+        changed.add(key)
+
+    statement = _insert(db, costs.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["branch_id", "ingredient_id"],
+        set_={"unit_cost": statement.excluded.unit_cost, "updated_at": func.now()})
+    db.execute(statement, [
+        {"branch_id": branch_id, "ingredient_id": ingredient_id,
+         "unit_cost": current[(branch_id, ingredient_id)]}
+        for branch_id, ingredient_id in sorted(changed)
+    ])
+
+    by_branch = {}
+    for branch_id, ingredient_id in changed:
+        by_branch.setdefault(branch_id, set()).add(ingredient_id)
+    for branch_id, ingredient_ids in by_branch.items():
+        using = select(models.Recipe.menu_item_id).where(
+            models.Recipe.ingredient_id.in_(ingredient_ids))
+        db.query(models.MenuItemCosts).filter(
+            models.MenuItemCosts.branch_id == branch_id,
+            models.MenuItemCosts.menu_item_id.in_(using)
+        ).delete(synchronize_session=False)
+
+
+def invalidate_menu_costs(db: Session, menu_item_ids: Iterable[int]) -> None:
+    """Drop the cached costs of menu items at every branch (their recipe changed). Does not commit."""
+    db.query(models.MenuItemCosts).filter(
+        models.MenuItemCosts.menu_item_id.in_(set(menu_item_ids))
+    ).delete(synchronize_session=False)
+
+
+def fill_menu_costs(db: Session, branch_ids: Optional[List[int]] = None) -> int:
+    """
+    Compute the missing cached costs of every recipe at the branches (of
+    ``branch_ids``) that have ingredient costs. Returns the rows added.
+    Does not commit.
+    """
+    costs, recipe, cached = models.IngredientCosts, models.Recipe, models.MenuItemCosts
+    branches = db.query(costs.branch_id).distinct()
+    if branch_ids:
+        branches = branches.filter(costs.branch_id.in_(branch_ids))
+    branches = branches.subquery()
+
+    query = select(
+        branches.c.branch_id,
+        recipe.menu_item_id,
+        func.coalesce(func.sum(recipe.qty_per_unit * costs.unit_cost), 0),
+        func.count(recipe.id) - func.count(costs.unit_cost)
+    ).select_from(branches).join(
+        recipe, true()
+    ).outerjoin(
+        costs, and_(costs.branch_id == branches.c.branch_id,
+                    costs.ingredient_id == recipe.ingredient_id)
+    ).where(
+        ~exists().where(cached.branch_id == branches.c.branch_id,
+                        cached.menu_item_id == recipe.menu_item_id)
+    ).group_by(branches.c.branch_id, recipe.menu_item_id)
+
+    statement = _insert(db, cached.__table__).from_select(
+        ["branch_id", "menu_item_id", "unit_cost", "uncosted_ingredients"], query
+    ).on_conflict_do_nothing()
+    return db.execute(statement).rowcount
+
+
+def rebuild_menu_costs(db: Session, since: Optional[date] = None) -> int:
+    """Recompute every cached menu item cost (``since`` is ignored). Does not commit."""
+    db.query(models.MenuItemCosts).delete(synchronize_session=False)
+    return fill_menu_costs(db)
+
+
+def menu_costs(db: Session, branch_id: int, category: Optional[str] = None) -> List[dict]:
+    """Cost and margin of every menu item at a branch, shaped like ``schemas.MenuItemCost``."""
+    fill_menu_costs(db, [branch_id])
+    db.commit()
+
+    cached = models.MenuItemCosts
+    query = db.query(models.Menu, cached.unit_cost, cached.uncosted_ingredients).outerjoin(
+        cached, and_(cached.menu_item_id == models.Menu.menu_item_id,
+                     cached.branch_id == branch_id))
+    if category:
+        query = query.filter(models.Menu.category == category)
+
+    results = []
+    for menu_item, unit_cost, uncosted in query.order_by(models.Menu.menu_item_id):
+        row = {
+            "menu_item_id": menu_item.menu_item_id,
+            "name": menu_item.name,
+            "category": menu_item.category,
+            "price": menu_item.price,
+            "unit_cost": None,
+            "margin": None,
+            "margin_pct": None,
+            "uncosted_ingredients": uncosted or 0,
+        }
+        if unit_cost is not None and not uncosted:
+            row["unit_cost"] = unit_cost
+            row["margin"] = (menu_item.price - unit_cost).quantize(Decimal("0.01"))
+            if menu_item.price:
+                row["margin_pct"] = round(float(row["margin"] / menu_item.price * 100), 1)
+        results.append(row)
+    return results
+
+
+def _margin_totals(db: Session, branch_ids: Optional[List[int]], group_by: str,
+                   start: Optional[date], end: Optional[date]) -> Dict[object, Dict[str, Decimal]]:
+    fill_menu_costs(db, branch_ids)
+    db.commit()
+
+    sales, cached = models.ItemSalesDaily, models.MenuItemCosts
+    key = sales.branch_id if group_by == "branch" else models.Menu.category
+    costed = cached.menu_item_id.isnot(None)
+    query = db.query(
+        key,
+        func.sum(case((costed, sales.revenue), else_=0)),
+        func.sum(sales.quantity * cached.unit_cost),
+        func.sum(case((costed, 0), else_=sales.revenue))
+    ).outerjoin(
+        cached, and_(cached.branch_id == sales.branch_id,
+                     cached.menu_item_id == sales.menu_item_id,
+                     cached.uncosted_ingredients == 0)
+    )
+    if group_by == "category":
+        query = query.join(models.Menu, models.Menu.menu_item_id == sales.menu_item_id)
+    if start is not None:
+        query = query.filter(sales.day >= start)
+    if end is not None:
+        query = query.filter(sales.day <= end)
+    if branch_ids:
+        query = query.filter(sales.branch_id.in_(branch_ids))
+    return {
+        group: {"revenue": revenue or 0, "cost": cost or 0, "uncosted_revenue": uncosted or 0}
+        for group, revenue, cost, uncosted in query.group_by(key)
+    }
+
+
+def margins(db: Session, group_by: str = "branch", branch_ids: Optional[List[int]] = None,
+            start: Optional[date] = None, end: Optional[date] = None) -> Dict[object, Dict[str, Decimal]]:
+    """
+    {branch_id or category: {revenue, cost, uncosted_revenue}} of the sales
+    from ``start`` to ``end``. ``revenue`` and ``cost`` cover the items with
+    a known cost; ``uncosted_revenue`` is the rest.
+    """
+    return sum_nested(fan_out(
+        db, lambda session, group: _margin_totals(session, group, group_by, start, end),
+        branch_ids))
@@ -0,0 +1,134 @@
+"""
+Row totals for paginated listings, sent as ``X-Total-Count``.
+
+Counting a large filtered set is a scan, so totals come in three kinds,
+reported in ``X-Total-Count-Kind``:
+
+- ``exact``: the real number of matching rows.
+- ``capped``: more than ``EXACT_COUNT_CAP`` rows match; the count stopped
+  there and the header holds the cap (a lower bound).
+- ``estimate``: requested with ``estimate=true``. On PostgreSQL this is the
+  planner's row estimate (``pg_class.reltuples`` for an unfiltered table,
+  else ``EXPLAIN``), which costs no scan. Other databases count exactly.
+
+Each listing keeps a small cache of totals per distinct filter. Entries
+expire after ``ttl`` seconds and are dropped early when the change feed
+reports a change that can alter the totals.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi import Response
+from sqlalchemy import Table, func, text
+from sqlalchemy.orm import Query
+
+from . import change_feed
+
+TOTAL_COUNT_HEADER = "X-Total-Count"
+TOTAL_COUNT_KIND_HEADER = "X-Total-Count-Kind"
+
+# Exact counts stop here; larger lists report the cap as "capped"
+EXACT_COUNT_CAP = int(os.getenv("EXACT_COUNT_CAP", "10000"))
+
+
+class Total(NamedTuple):
+    value: int
+    kind: str       # exact, capped or estimate
+
+
+def capped_count(query: Query, cap: int = EXACT_COUNT_CAP) -> Total:
+    """Count at most ``cap + 1`` rows of ``query``."""
+    limited = query.limit(cap + 1).subquery()
+    value = query.session.query(func.count()).select_from(limited).scalar()
+    if value > cap:
+        return Total(cap, "capped")
+    return Total(value, "exact")
+
+
+def _table_estimate(query: Query, table: Table) -> Optional[int]:
+    # Sums leaf partitions, so partitioned tables (parent reltuples -1) work too
+    rows = query.session.execute(text(
+        "SELECT sum(CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples END) "
+        "FROM pg_partition_tree(CAST(:table AS regclass)) p "
+        "JOIN pg_class c ON c.oid = p.relid WHERE p.isleaf"
+    ), {"table": table.name}).scalar()
+    return None if rows is None else int(rows)
+
+
+def _plan_estimate(query: Query) -> int:
+    connection = query.session.connection()
+    compiled = query.statement.compile(
+        dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    plan = connection.exec_driver_sql(
+        "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def estimated_count(query: Query) -> Total:
+    """Planner estimate of the rows of ``query`` (exact count off PostgreSQL)."""
+    if query.session.get_bind().dialect.name != "postgresql":
+        return capped_count(query)
+    statement = query.statement
+    froms = statement.get_final_froms()
+    if statement.whereclause is None and len(froms) == 1 and isinstance(froms[0], Table):
+        value = _table_estimate(query, froms[0])
+        if value is not None:
+            return Total(value, "estimate")
+    return Total(_plan_estimate(query), "estimate")
+
+
+class TotalCounter:
+    """TTL cache of listing totals keyed by database, compiled SQL, parameters and kind."""
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 1024,
+                 tables: Optional[Iterable[str]] = None,
+                 invalidate_when: Optional[Callable[[change_feed.Change], bool]] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str, bool], Tuple[float, Total]] = {}
+        if tables:
+            self._invalidate_when = invalidate_when
+            change_feed.subscribe(self._on_change, tables)
+
+    def _on_change(self, change: change_feed.Change):
+        if self._invalidate_when is None or self._invalidate_when(change):
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def total(self, query: Query, estimate: bool = False) -> Total:
+        """Total rows of ``query`` (its ORDER BY/LIMIT/OFFSET and eager loads are ignored)."""
+        query = query.enable_eagerloads(False).order_by(None).limit(None).offset(None)
+        compiled = query.statement.compile()
+        # Branch shards run the same SQL on different databases
+        key = (str(query.session.get_bind().url), str(compiled),
+               repr(sorted(compiled.params.items())), estimate)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        total = estimated_count(query) if estimate else capped_count(query)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {
+                    k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries = {}
+            self._entries[key] = (now + self.ttl, total)
+        return total
+
+
+def set_total_headers(response: Response, total: Total) -> Response:
+    response.headers[TOTAL_COUNT_HEADER] = str(total.value)
+    response.headers[TOTAL_COUNT_KIND_HEADER] = total.kind
+    return response
@@ -0,0 +1,118 @@
+"""
+Daily employee performance counters (``employee_sales_daily``).
+
+One row per (day, branch, employee). ``orders_taken`` is added when an order
+is created (and moved when an open order is given to another employee);
+``paid_orders``, ``revenue`` (the order total) and ``items_prepared`` (units
+of DONE lines) are added when it is paid, in the payment's transaction. The
+staff analytics read these rows, merged per branch group (``fan_out``),
+instead of joining orders to employees.
+
+Days are the order's ``created_at`` date, as in ``item_sales``. Like the
+other counters, they still hold orders after they are archived.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import Date, case, func, type_coerce
+from sqlalchemy.orm import Session
+
+from .. import models
+from .fanout import fan_out, sum_nested
+from .item_sales import add_to_counters
+
+_KEY = ["day", "branch_id", "employee_id"]
+_COUNTERS = ["orders_taken", "paid_orders", "revenue", "items_prepared"]
+
+
+def record_orders_taken(db: Session, day: date, branch_id: int, employee_id: int,
+                        count: int = 1) -> None:
+    """Add ``count`` (negative to move an order away) to an employee's orders taken. Does not commit."""
+    add_to_counters(db, models.EmployeeSalesDaily.__table__, _KEY, ["orders_taken"], [{
+        "day": day, "branch_id": branch_id, "employee_id": employee_id,
+        "orders_taken": count,
+    }])
+
+
+def record_order_paid(db: Session, order: models.Orders,
+                      order_items: List[models.OrderItems]) -> None:
+    """Add a paid order to its employee's counters. Does not commit."""
+    add_to_counters(db, models.EmployeeSalesDaily.__table__, _KEY,
+                    ["paid_orders", "revenue", "items_prepared"], [{
+                        "day": order.created_at.date(),
+                        "branch_id": order.branch_id,
+                        "employee_id": order.employee_id,
+                        "paid_orders": 1,
+                        "revenue": order.total_price or Decimal("0"),
+                        "items_prepared": sum(
+                            item.quantity for item in order_items if item.status == "DONE"),
+                    }])
+
+
+def rebuild_employee_sales(db: Session, since: Optional[date] = None) -> int:
+    """
+    Recompute the counters of days on/after ``since`` from the orders in the
+    hot tables. By default starts the day after the newest archived order,
+    so days that are only left in the counters are kept. Returns the number
+    of rows written. Does not commit.
+    """
+    if since is None:
+        archived_until = db.query(func.max(models.ArchivedOrders.created_at)).scalar()
+        if archived_until is not None:
+            since = archived_until.date() + timedelta(days=1)
+
+    Orders, OrderItems, EmployeeSalesDaily = (
+        models.Orders, models.OrderItems, models.EmployeeSalesDaily)
+    prepared = db.query(
+        OrderItems.order_id, func.sum(OrderItems.quantity).label("quantity")
+    ).filter(OrderItems.status == "DONE").group_by(OrderItems.order_id).subquery()
+    paid = Orders.status == "PAID"
+    day = type_coerce(func.date(Orders.created_at), Date)
+    query = db.query(
+        day,
+        Orders.branch_id,
+        Orders.employee_id,
+        func.count(Orders.order_id),
+        func.sum(case((paid, 1), else_=0)),
+        func.sum(case((paid, Orders.total_price), else_=0)),
+        func.sum(case((paid, func.coalesce(prepared.c.quantity, 0)), else_=0))
+    ).outerjoin(prepared, prepared.c.order_id == Orders.order_id)
+    stale = db.query(EmployeeSalesDaily)
+    if since is not None:
+        query = query.filter(Orders.created_at >= datetime.combine(since, time.min))
+        stale = stale.filter(EmployeeSalesDaily.day >= since)
+    stale.delete(synchronize_session=False)
+
+    rows = [
+        {"day": row_day, "branch_id": branch_id, "employee_id": employee_id,
+         "orders_taken": orders_taken, "paid_orders": int(paid_orders or 0),
+         "revenue": revenue or Decimal("0"), "items_prepared": int(items_prepared or 0)}
+        for row_day, branch_id, employee_id, orders_taken, paid_orders, revenue, items_prepared
+        in query.group_by(day, Orders.branch_id, Orders.employee_id)
+    ]
+    if rows:
+        db.execute(EmployeeSalesDaily.__table__.insert(), rows)
+    return len(rows)
+
+
+def _employee_totals(db: Session, branch_ids: Optional[List[int]],
+                     start: Optional[date]) -> Dict[int, Dict[str, float]]:
+    counters = models.EmployeeSalesDaily
+    query = db.query(
+        counters.employee_id, *(func.sum(getattr(counters, name)) for name in _COUNTERS))
+    if start is not None:
+        query = query.filter(counters.day >= start)
+    if branch_ids:
+        query = query.filter(counters.branch_id.in_(branch_ids))
+    return {
+        employee_id: dict(zip(_COUNTERS, (total or 0 for total in totals)))
+        for employee_id, *totals in query.group_by(counters.employee_id)
+    }
+
+
+def employee_totals(db: Session, branch_ids: Optional[List[int]] = None,
+                    start: Optional[date] = None) -> Dict[int, Dict[str, float]]:
+    """{employee_id: {orders_taken, paid_orders, revenue, items_prepared}} since ``start``."""
+    return sum_nested(fan_out(
+        db, lambda session, group: _employee_totals(session, group, start), branch_ids))
@@ -0,0 +1,128 @@
+"""
+Fan-out/merge execution for multi-branch analytics.
+
+Orders, payments, stock and rollups of one branch never mix with another
+branch's inside an aggregate, so an aggregate over many branches can run as
+independent queries over groups of branches and be merged afterwards.
+``fan_out`` splits the requested branches by shard (``BRANCH_SHARDS``) and
+then into at most ``ANALYTICS_WORKERS`` groups per shard, runs
+``query(session, branch_ids)`` for every group on a shared thread pool and
+returns the partial results. The caller merges them: ``sum_by_key`` for
+counts and sums, ``sum_nested`` for histograms split by series, ``top_k``
+for rankings. Averages must be carried as a sum and a count.
+
+Each group runs on its own session and connection, so the pool adds at most
+``ANALYTICS_WORKERS`` connections per process. A request that comes down to
+a single group runs inline on the request's session.
+"""
+import heapq
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal, get_shard_engine, shard_of
+
+T = TypeVar("T")
+
+ANALYTICS_WORKERS = max(1, int(os.getenv("ANALYTICS_WORKERS", "4")))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Created on first use, so each forked worker starts its own threads
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=ANALYTICS_WORKERS, thread_name_prefix="analytics")
+    return _executor
+
+
+def branch_groups(db: Session, branch_ids: Optional[Iterable[int]] = None,
+                  groups_per_shard: int = ANALYTICS_WORKERS
+                  ) -> List[Tuple[int, Optional[List[int]]]]:
+    """
+    (shard, branch ids) work units covering ``branch_ids`` (every branch if
+    None). A group of None stands for every branch stored on its shard.
+    """
+    requested = sorted(set(branch_ids)) if branch_ids else None
+    ids = requested
+    if ids is None:
+        ids = [row[0] for row in db.query(models.Branches.branch_id).order_by(
+            models.Branches.branch_id)]
+    by_shard = defaultdict(list)
+    for branch_id in ids:
+        by_shard[shard_of(branch_id)].append(branch_id)
+
+    groups = []
+    for shard, shard_branch_ids in sorted(by_shard.items()):
+        count = min(groups_per_shard, len(shard_branch_ids))
+        if count == 1 and requested is None:
+            groups.append((shard, None))
+            continue
+        # Round-robin, so groups of consecutive (similar sized) branches are mixed
+        groups.extend((shard, shard_branch_ids[i::count]) for i in range(count))
+    return groups
+
+
+def _run_group(query: Callable[[Session, Optional[List[int]]], T], shard: int,
+               branch_ids: Optional[List[int]]) -> T:
+    db = SessionLocal(bind=get_shard_engine(shard))
+    try:
+        return query(db, branch_ids)
+    finally:
+        db.close()
+
+
+def fan_out(db: Session, query: Callable[[Session, Optional[List[int]]], T],
+            branch_ids: Optional[Iterable[int]] = None) -> List[T]:
+    """
+    Run ``query(session, group)`` for every branch group of ``branch_ids``
+    (see ``branch_groups``) in parallel and return the partial results.
+    """
+    groups = branch_groups(db, branch_ids)
+    if len(groups) == 1 and get_shard_engine(groups[0][0]) is db.get_bind():
+        return [query(db, groups[0][1])]
+    return run_parallel([partial(_run_group, query, shard, group) for shard, group in groups])
+
+
+def run_parallel(calls: Iterable[Callable[[], T]]) -> List[T]:
+    """Run ``calls`` on the analytics thread pool; results in the order of ``calls``."""
+    executor = _get_executor()
+    futures = [executor.submit(call) for call in calls]
+    return [future.result() for future in futures]
+
+
+def sum_by_key(partials: Iterable[Dict[Hashable, float]]) -> Dict[Hashable, float]:
+    """Merge {key: count or sum} partials by adding the values of equal keys."""
+    merged = defaultdict(int)
+    for partial in partials:
+        for key, value in partial.items():
+            merged[key] += value
+    return dict(merged)
+
+
+def sum_nested(partials: Iterable[Dict[Hashable, Dict[Hashable, float]]]
+               ) -> Dict[Hashable, Dict[Hashable, float]]:
+    """Merge {bucket: {series: value}} partials (split histograms) by adding values."""
+    merged = defaultdict(lambda: defaultdict(int))
+    for partial in partials:
+        for bucket, series in partial.items():
+            for key, value in series.items():
+                merged[bucket][key] += value
+    return {bucket: dict(series) for bucket, series in merged.items()}
+
+
+def top_k(totals: Dict[Hashable, float], k: int) -> List[Tuple[Hashable, float]]:
+    """The ``k`` largest (key, value) pairs of merged totals, largest first."""
+    return heapq.nlargest(k, totals.items(), key=itemgetter(1))
@@ -0,0 +1,198 @@
+"""
+Ingredient demand forecasts and reorder points.
+
+Daily usage (SALE and WASTE movements) of every stock row is summed from the
+ledger by the database, one GROUP BY over the new days, into
+``stock_usage_daily``. The nightly refresh only reads the movements since
+the previous run, and days older than the window are dropped. Over the
+trailing ``FORECAST_WINDOW_DAYS`` (a day without movements counts as zero)
+every stock row gets its mean daily usage and standard deviation, again as
+SQL aggregates (sum and sum of squares), and
+
+    reorder point = mean * lead time + z * stddev * sqrt(lead time)
+
+with the lead time ``FORECAST_LEAD_TIME_DAYS`` and the service level factor
+``FORECAST_SERVICE_Z`` (1.65 is about 95%). The results are kept in
+``stock_forecasts``, so a low-stock check is one indexed join. Days of cover
+(amount remaining / mean usage) is computed from the live stock level.
+"""
+import math
+import os
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import Date, func, type_coerce
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import get_engine
+from .indexes import install_indexes
+
+FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", "28"))
+FORECAST_LEAD_TIME_DAYS = float(os.getenv("FORECAST_LEAD_TIME_DAYS", "2"))
+FORECAST_SERVICE_Z = float(os.getenv("FORECAST_SERVICE_Z", "1.65"))
+
+USAGE_REASONS = ("SALE", "WASTE")
+
+# created_at is also declared index=True on the model (new databases)
+_FORECAST_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_stock_movements_created_at ON stock_movements (created_at)",
+]
+
+
+def install_forecast_indexes(bind: Engine = None) -> None:
+    """Create the ledger index used by the usage aggregation (PostgreSQL only)."""
+    install_indexes(bind or get_engine(), _FORECAST_INDEXES)
+
+
+def _aggregate_usage(db: Session, start: date, end: date) -> int:
+    """Replace the usage rows of days ``start`` up to (not including) ``end``."""
+    movements, usage = models.StockMovements, models.StockUsageDaily
+    day = type_coerce(func.date(movements.created_at), Date)
+    quantity = func.abs(movements.qty_change)
+    query = db.query(
+        movements.stock_id,
+        day,
+        func.sum(quantity).filter(movements.reason == "SALE"),
+        func.sum(quantity).filter(movements.reason == "WASTE")
+    ).filter(
+        movements.reason.in_(USAGE_REASONS),
+        movements.created_at >= datetime.combine(start, time.min),
+        movements.created_at < datetime.combine(end, time.min)
+    ).group_by(movements.stock_id, day)
+
+    db.query(usage).filter(usage.day >= start, usage.day < end).delete(synchronize_session=False)
+    rows = [
+        {"stock_id": stock_id, "day": row_day, "used": used or Decimal("0"),
+         "wasted": wasted or Decimal("0")}
+        for stock_id, row_day, used, wasted in query
+    ]
+    if rows:
+        db.execute(usage.__table__.insert(), rows)
+    return len(rows)
+
+
+def refresh_usage(db: Session, today: Optional[date] = None,
+                  since: Optional[date] = None) -> int:
+    """
+    Sum the usage of the days up to yesterday that are not in
+    ``stock_usage_daily`` yet (or of every day from ``since``), and drop days
+    older than the window. Returns the number of rows written.
+    """
+    today = today or date.today()
+    window_start = today - timedelta(days=FORECAST_WINDOW_DAYS)
+    if since is None:
+        last = db.query(func.max(models.StockUsageDaily.day)).scalar()
+        since = last + timedelta(days=1) if last else window_start
+    since = max(since, window_start)
+
+    written = _aggregate_usage(db, since, today) if since < today else 0
+    db.query(models.StockUsageDaily).filter(
+        models.StockUsageDaily.day < window_start).delete(synchronize_session=False)
+    return written
+
+
+def refresh_forecasts(db: Session, today: Optional[date] = None) -> int:
+    """Recompute every active stock row's forecast from the usage window. Returns the row count."""
+    today = today or date.today()
+    days = FORECAST_WINDOW_DAYS
+    usage = models.StockUsageDaily
+    quantity = usage.used + usage.wasted
+    sums = {
+        stock_id: (float(total or 0), float(squares or 0))
+        for stock_id, total, squares in db.query(
+            usage.stock_id, func.sum(quantity), func.sum(quantity * quantity)
+        ).filter(
+            usage.day >= today - timedelta(days=days), usage.day < today
+        ).group_by(usage.stock_id)
+    }
+
+    rows = []
+    stock = db.query(models.Stock.stock_id, models.Stock.branch_id).filter(
+        models.Stock.is_deleted == False)
+    for stock_id, branch_id in stock:
+        total, squares = sums.get(stock_id, (0.0, 0.0))
+        mean = total / days
+        variance = (squares - days * mean * mean) / (days - 1) if days > 1 else 0.0
+        stddev = math.sqrt(max(variance, 0.0))
+        reorder_point = (mean * FORECAST_LEAD_TIME_DAYS
+                         + FORECAST_SERVICE_Z * stddev * math.sqrt(FORECAST_LEAD_TIME_DAYS))
+        rows.append({
+            "stock_id": stock_id,
+            "branch_id": branch_id,
+            "avg_daily_usage": Decimal(f"{mean:.3f}"),
+            "daily_usage_stddev": Decimal(f"{stddev:.3f}"),
+            "reorder_point": Decimal(f"{reorder_point:.2f}"),
+            "computed_for": today,
+        })
+
+    db.query(models.StockForecasts).delete(synchronize_session=False)
+    if rows:
+        db.execute(models.StockForecasts.__table__.insert(), rows)
+    return len(rows)
+
+
+def refresh(db: Session, today: Optional[date] = None) -> int:
+    """Nightly run: add yesterday's usage, then recompute the forecasts. Does not commit."""
+    refresh_usage(db, today)
+    return refresh_forecasts(db, today)
+
+
+def rebuild_stock_usage(db: Session, since: Optional[date] = None) -> int:
+    """Recompute the usage window (from ``since`` if given) and the forecasts. Does not commit."""
+    today = date.today()
+    written = refresh_usage(db, today, since or today - timedelta(days=FORECAST_WINDOW_DAYS))
+    refresh_forecasts(db, today)
+    return written
+
+
+def needs_reorder():
+    """Filter for stock at or below its reorder point (join ``StockForecasts``)."""
+    return models.Stock.amount_remaining <= models.StockForecasts.reorder_point
+
+
+def stock_forecasts(db: Session, branch_ids: Optional[List[int]] = None,
+                    low_only: bool = False) -> List[dict]:
+    """Forecasts of active stock joined to live levels, shaped like ``schemas.StockForecast``."""
+    Stock, Forecasts, Ingredients = models.Stock, models.StockForecasts, models.Ingredients
+    query = db.query(
+        Stock.stock_id,
+        Stock.branch_id,
+        Stock.ingredient_id,
+        Ingredients.name,
+        Ingredients.base_unit,
+        Stock.amount_remaining,
+        Forecasts.avg_daily_usage,
+        Forecasts.daily_usage_stddev,
+        Forecasts.reorder_point,
+        Forecasts.computed_for
+    ).join(
+        Forecasts, Forecasts.stock_id == Stock.stock_id
+    ).join(
+        Ingredients, Ingredients.ingredient_id == Stock.ingredient_id
+    ).filter(Stock.is_deleted == False)
+    if branch_ids:
+        query = query.filter(Stock.branch_id.in_(branch_ids))
+    if low_only:
+        query = query.filter(needs_reorder())
+
+    results = []
+    for row in query.order_by(Stock.branch_id, Stock.stock_id):
+        amount, mean = row.amount_remaining, row.avg_daily_usage
+        results.append({
+            "stock_id": row.stock_id,
+            "branch_id": row.branch_id,
+            "ingredient_id": row.ingredient_id,
+            "ingredient_name": row.name,
+            "base_unit": row.base_unit,
+            "amount_remaining": amount,
+            "avg_daily_usage": mean,
+            "daily_usage_stddev": row.daily_usage_stddev,
+            "reorder_point": row.reorder_point,
+            "days_of_cover": round(float(amount / mean), 1) if mean else None,
+            "needs_reorder": amount <= row.reorder_point,
+            "computed_for": row.computed_for,
+        })
+    return results
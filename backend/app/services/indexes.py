@@ -0,0 +1,55 @@
+"""
+Indexes that ``create_all`` cannot express or add to existing tables
+(PostgreSQL only), installed by ``init_db`` with ``CREATE INDEX IF NOT
+EXISTS``.
+
+Trigram (``pg_trgm``) indexes are optional: if the extension cannot be
+created, they are skipped and the queries they would serve fall back to
+scanning.
+"""
+import logging
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# database URL -> whether pg_trgm is usable there (branch shards may differ)
+_trgm_available: Dict[str, bool] = {}
+
+
+def install_indexes(bind: Engine, indexes: List[str], trgm_indexes: List[str] = ()) -> bool:
+    """Run the index statements. Returns True when the trigram indexes are in place."""
+    if bind.dialect.name != "postgresql":
+        return False
+    with bind.begin() as conn:
+        for statement in indexes:
+            conn.execute(text(statement))
+    key = str(bind.url)
+    if not trgm_indexes:
+        return _trgm_available.get(key, False)
+    try:
+        with bind.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for statement in trgm_indexes:
+                conn.execute(text(statement))
+    except DBAPIError as e:
+        logger.warning("pg_trgm unavailable on %s, substring searches will scan: %s",
+                       bind.url.database, e.orig)
+        _trgm_available[key] = False
+        return False
+    _trgm_available[key] = True
+    return True
+
+
+def trgm_available(db: Session) -> bool:
+    """Whether pg_trgm operators (similarity, <%) can be used on ``db``'s database."""
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _trgm_available:
+        _trgm_available[key] = bind.dialect.name == "postgresql" and bool(
+            db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+    return _trgm_available[key]
@@ -0,0 +1,137 @@
+"""
+Daily menu item sales counters (``item_sales_daily``).
+
+One row per (day, branch, menu item) holds the units sold, the revenue and
+the number of orders. ``record_order_sales`` adds a paid order to them in
+the payment's transaction, as an upsert so concurrent payments add up.
+Rankings over any date window then read these rows, merged per branch
+group (``fan_out``) and cut to the top N with a bounded heap, instead of
+joining ``order_items``.
+
+Days are the order's ``created_at`` date, as in the other sales analytics.
+Cancelled lines are not counted. Like ``order_rollups``, the counters still
+hold orders after they are archived.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Date, Table, func, type_coerce
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import models
+from .fanout import fan_out, sum_by_key, top_k
+
+METRICS = {
+    "revenue": models.ItemSalesDaily.revenue,
+    "quantity": models.ItemSalesDaily.quantity,
+}
+_KEY = ["day", "branch_id", "menu_item_id"]
+_COUNTERS = ["quantity", "revenue", "order_count"]
+
+
+def add_to_counters(db: Session, table: Table, key: List[str], counters: List[str],
+                    rows: List[dict]) -> None:
+    """Insert ``rows``, or add their ``counters`` to the rows with the same ``key``."""
+    if not rows:
+        return
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(table)
+    statement = statement.on_conflict_do_update(index_elements=key, set_={
+        name: table.c[name] + statement.excluded[name] for name in counters
+    })
+    db.execute(statement, rows)
+
+
+def record_order_sales(db: Session, order: models.Orders,
+                       order_items: List[models.OrderItems]) -> None:
+    """Add a paid order's lines to the daily counters. Does not commit."""
+    sales = {}
+    for item in order_items:
+        if item.status == "CANCELLED":
+            continue
+        row = sales.setdefault(item.menu_item_id, {
+            "day": order.created_at.date(),
+            "branch_id": order.branch_id,
+            "menu_item_id": item.menu_item_id,
+            "quantity": 0,
+            "revenue": Decimal("0"),
+            "order_count": 1,
+        })
+        row["quantity"] += item.quantity
+        row["revenue"] += item.line_total or Decimal("0")
+    # Same row order in every transaction, so concurrent payments cannot deadlock
+    add_to_counters(db, models.ItemSalesDaily.__table__, _KEY, _COUNTERS,
+                    [sales[key] for key in sorted(sales)])
+
+
+def rebuild_item_sales(db: Session, since: Optional[date] = None) -> int:
+    """
+    Recompute the counters of days on/after ``since`` from the PAID orders in
+    ``order_items``. By default starts the day after the newest archived
+    order, so days that are only left in the counters are kept. Returns the
+    number of rows written. Does not commit.
+    """
+    if since is None:
+        archived_until = db.query(func.max(models.ArchivedOrders.created_at)).scalar()
+        if archived_until is not None:
+            since = archived_until.date() + timedelta(days=1)
+
+    Orders, OrderItems, ItemSalesDaily = models.Orders, models.OrderItems, models.ItemSalesDaily
+    day = type_coerce(func.date(Orders.created_at), Date)
+    query = db.query(
+        day,
+        Orders.branch_id,
+        OrderItems.menu_item_id,
+        func.sum(OrderItems.quantity),
+        func.sum(OrderItems.line_total),
+        func.count(func.distinct(OrderItems.order_id))
+    ).join(
+        Orders, OrderItems.order_id == Orders.order_id
+    ).filter(
+        Orders.status == "PAID",
+        OrderItems.status != "CANCELLED"
+    )
+    stale = db.query(ItemSalesDaily)
+    if since is not None:
+        query = query.filter(Orders.created_at >= datetime.combine(since, time.min))
+        stale = stale.filter(ItemSalesDaily.day >= since)
+    stale.delete(synchronize_session=False)
+
+    rows = [
+        {"day": row_day, "branch_id": branch_id, "menu_item_id": menu_item_id,
+         "quantity": int(quantity or 0), "revenue": revenue or Decimal("0"),
+         "order_count": order_count}
+        for row_day, branch_id, menu_item_id, quantity, revenue, order_count
+        in query.group_by(day, Orders.branch_id, OrderItems.menu_item_id)
+    ]
+    if rows:
+        db.execute(ItemSalesDaily.__table__.insert(), rows)
+    return len(rows)
+
+
+def item_sales_totals(db: Session, branch_ids: Optional[List[int]] = None,
+                      start: Optional[date] = None, end: Optional[date] = None,
+                      metric: str = "revenue") -> Dict[int, float]:
+    """{menu_item_id: revenue or units} from ``start`` to ``end`` (inclusive)."""
+    query = db.query(
+        models.ItemSalesDaily.menu_item_id, func.sum(METRICS[metric]))
+    if start is not None:
+        query = query.filter(models.ItemSalesDaily.day >= start)
+    if end is not None:
+        query = query.filter(models.ItemSalesDaily.day <= end)
+    if branch_ids:
+        query = query.filter(models.ItemSalesDaily.branch_id.in_(branch_ids))
+    return {menu_item_id: total or 0
+            for menu_item_id, total in query.group_by(models.ItemSalesDaily.menu_item_id)}
+
+
+def top_items(db: Session, n: int = 5, branch_ids: Optional[List[int]] = None,
+              start: Optional[date] = None, end: Optional[date] = None,
+              metric: str = "revenue") -> List[Tuple[int, float]]:
+    """The ``n`` best selling (menu_item_id, total) of a window, best first."""
+    totals = sum_by_key(fan_out(
+        db, lambda session, group: item_sales_totals(session, group, start, end, metric),
+        branch_ids))
+    return top_k(totals, n)
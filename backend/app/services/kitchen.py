@@ -0,0 +1,61 @@
+"""
+Kitchen display queue: the ORDERED and PREPARING lines of one branch,
+oldest order first.
+
+Order items carry no branch, so the queue is read from the partial index
+``ix_order_items_active`` (only lines still waiting for the kitchen, a few
+hundred rows however large ``order_items`` grows) and joined to their
+orders and menu items by primary key. Only the columns a kitchen screen
+shows are selected; no order graph is loaded.
+"""
+from typing import List
+
+from sqlalchemy import bindparam
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import get_engine
+from .indexes import install_indexes
+
+ACTIVE_ITEM_STATUSES = ("ORDERED", "PREPARING")
+
+# Same definition as models.OrderItems.__table_args__, for existing tables
+_KITCHEN_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_order_items_active "
+    "ON order_items (order_id, order_item_id) "
+    "WHERE status IN ('ORDERED', 'PREPARING')",
+]
+
+
+def install_kitchen_indexes(bind: Engine = None) -> None:
+    """Create the kitchen queue index on an existing table (PostgreSQL only)."""
+    install_indexes(bind or get_engine(), _KITCHEN_INDEXES)
+
+
+def kitchen_queue(db: Session, branch_id: int) -> List[Row]:
+    """Active lines of ``branch_id`` as rows shaped like ``schemas.KitchenQueueItem``."""
+    OrderItems, Orders, Menu = models.OrderItems, models.Orders, models.Menu
+    # Inline the statuses: a bound parameter keeps SQLite from proving the
+    # partial index predicate
+    statuses = bindparam("active_statuses", ACTIVE_ITEM_STATUSES,
+                         expanding=True, literal_execute=True)
+    return db.query(
+        OrderItems.order_item_id,
+        OrderItems.order_id,
+        OrderItems.menu_item_id,
+        Menu.name.label("menu_item_name"),
+        OrderItems.quantity,
+        OrderItems.status,
+        Orders.order_type,
+        Orders.created_at.label("ordered_at"),
+    ).join(
+        Orders, Orders.order_id == OrderItems.order_id
+    ).join(
+        Menu, Menu.menu_item_id == OrderItems.menu_item_id
+    ).filter(
+        OrderItems.status.in_(statuses),
+        Orders.branch_id == branch_id,
+    ).order_by(
+        Orders.created_at, OrderItems.order_id, OrderItems.order_item_id
+    ).all()
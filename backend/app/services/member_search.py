@@ -0,0 +1,127 @@
+"""
+Member lookup for the counter: ranked, as-you-type search over name, phone
+and email.
+
+On PostgreSQL, ``install_search_indexes`` (run from ``init_db``) creates
+``pg_trgm`` GIN indexes on name, phone and email, so substring (``ILIKE
+'%x%'``) and fuzzy matches are index scans, plus "C"-collated B-tree
+indexes that return prefix matches on phone, name and email already in
+order. All indexes are partial on active members. If the extension is not
+available the prefix indexes are still created and substring matches fall
+back to scanning; SQLite always scans.
+
+Input with digits only searches phones, input containing ``@`` searches
+emails, anything else names (and emails, for substrings).
+
+Ranking: prefix matches first (of the phone, email or name), then
+matches at the start of a later word, then other substring matches, then
+(pg_trgm only) fuzzy matches by similarity.
+"""
+import re
+from typing import List
+
+from sqlalchemy import case, func, literal, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, joinedload
+
+from .. import models
+from ..database import get_engine
+from .indexes import install_indexes, trgm_available
+
+# Below this length trigram indexes cannot help: only prefix matches are used
+MIN_SUBSTRING_LENGTH = 3
+
+# "C" collation B-trees serve both the LIKE 'x%' prefix range and ORDER BY
+_SEARCH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_memberships_phone_prefix "
+    "ON memberships ((phone COLLATE \"C\")) WHERE is_deleted = false",
+    "CREATE INDEX IF NOT EXISTS ix_memberships_name_prefix "
+    "ON memberships ((lower(name) COLLATE \"C\")) WHERE is_deleted = false",
+    "CREATE INDEX IF NOT EXISTS ix_memberships_email_prefix "
+    "ON memberships ((lower(email) COLLATE \"C\")) WHERE is_deleted = false",
+]
+_TRGM_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_memberships_name_trgm "
+    "ON memberships USING gin (name gin_trgm_ops) WHERE is_deleted = false",
+    "CREATE INDEX IF NOT EXISTS ix_memberships_phone_trgm "
+    "ON memberships USING gin (phone gin_trgm_ops) WHERE is_deleted = false",
+    "CREATE INDEX IF NOT EXISTS ix_memberships_email_trgm "
+    "ON memberships USING gin (email gin_trgm_ops) WHERE is_deleted = false",
+]
+
+
+def install_search_indexes(bind: Engine = None) -> bool:
+    """
+    Create the member search indexes (PostgreSQL only). Returns True when
+    the trigram indexes are in place.
+    """
+    return install_indexes(bind or get_engine(), _SEARCH_INDEXES, _TRGM_INDEXES)
+
+
+def _prefix_key(db: Session, column):
+    """Expression matching the prefix indexes (byte order on PostgreSQL)."""
+    if db.get_bind().dialect.name == "postgresql":
+        return column.collate("C")
+    return column
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_members(db: Session, q: str, limit: int = 10) -> List[models.Memberships]:
+    """
+    Return up to ``limit`` active members matching ``q``, best match first.
+
+    Prefix matches are read first, in index order, and usually fill the page
+    on their own; only when they do not is the wider substring/fuzzy query
+    run for the remaining slots.
+    """
+    Memberships = models.Memberships
+    q = q.strip()
+    digits = re.sub(r"[\s-]", "", q)
+    query = db.query(Memberships).options(joinedload(Memberships.tier)).filter(
+        Memberships.is_deleted == False)
+
+    if digits.isdigit():
+        pattern = _escape_like(digits)
+        key = _prefix_key(db, Memberships.phone)
+        prefix = key.like(f"{pattern}%", escape="\\")
+        results = query.filter(prefix).order_by(key).limit(limit).all()
+        if len(results) == limit or len(digits) < MIN_SUBSTRING_LENGTH:
+            return results
+        return results + query.filter(
+            ~prefix, Memberships.phone.like(f"%{pattern}%", escape="\\")
+        ).order_by(key).limit(limit - len(results)).all()
+
+    pattern = _escape_like(q.lower())
+    if "@" in q:
+        key = _prefix_key(db, func.lower(Memberships.email))
+        results = query.filter(key.like(f"{pattern}%", escape="\\")).order_by(
+            key).limit(limit).all()
+        if len(results) == limit:
+            return results
+        return results + query.filter(
+            ~key.like(f"{pattern}%", escape="\\"),
+            Memberships.email.ilike(f"%{pattern}%", escape="\\")
+        ).order_by(key).limit(limit - len(results)).all()
+
+    key = _prefix_key(db, func.lower(Memberships.name))
+    prefix = key.like(f"{pattern}%", escape="\\")
+    results = query.filter(prefix).order_by(key).limit(limit).all()
+    if len(results) == limit or len(q) < MIN_SUBSTRING_LENGTH:
+        return results
+
+    word_prefix = Memberships.name.ilike(f"% {pattern}%", escape="\\")
+    substring = or_(
+        Memberships.name.ilike(f"%{pattern}%", escape="\\"),
+        Memberships.email.ilike(f"%{pattern}%", escape="\\"),
+    )
+    order_by = [case((word_prefix, 0), (substring, 1), else_=2)]
+    condition = substring
+    if trgm_available(db):
+        # q <% name: q is close to some word of name (typos, transliterations)
+        condition = or_(substring, literal(q).op("<%")(Memberships.name))
+        order_by.append(func.word_similarity(q, Memberships.name).desc())
+    return results + query.filter(~prefix, condition).order_by(
+        *order_by, Memberships.name).limit(limit - len(results)).all()
@@ -0,0 +1,345 @@
+"""Menu availability engine driven by live stock levels.
+
+Keeps, per branch, the maximum number of portions of every menu item that
+can be prepared from the current ``Stock`` rows and ``Recipe`` lines. The
+figures are built once per branch and then updated incrementally from the
+stock changes of every committed session, so reading them never requires a
+per-item recipe scan. Other worker processes are kept in step through
+``cache_bus``: each flush publishes its changes, which they apply on commit.
+"""
+import threading
+from decimal import Decimal
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+from . import cache_bus
+
+_LOAD_ATTEMPTS = 3
+
+
+class MenuAvailabilityEngine:
+    """
+    In-process cache of makeable quantities per (branch, menu item).
+
+    A menu item without any recipe line is reported as ``None`` (not limited
+    by stock). An item whose recipe uses a deleted ingredient, or an
+    ingredient the branch does not stock, is reported as ``0``. When a branch
+    has several stock rows for an ingredient, the one with the lowest
+    ``stock_id`` counts: it is the row the kitchen deducts from.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # menu_item_id -> {ingredient_id: qty_per_unit}
+        self._recipes: Optional[Dict[int, Dict[int, Decimal]]] = None
+        # ingredient_id -> menu_item_ids using it
+        self._used_by: Dict[int, Set[int]] = {}
+        self._deleted_ingredients: Set[int] = set()
+        # branch_id -> {ingredient_id: {stock_id: amount_remaining}}
+        self._stock: Dict[int, Dict[int, Dict[int, Decimal]]] = {}
+        # branch_id -> {menu_item_id: makeable quantity}
+        self._makeable: Dict[int, Dict[int, Optional[int]]] = {}
+        # Bumped on every change, so a load that raced one is not installed
+        self._recipes_version = 0
+        self._branch_versions: Dict[int, int] = {}
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def get_makeable(self, db: Session, branch_id: int) -> Dict[int, Optional[int]]:
+        """
+        Return {menu_item_id: makeable quantity} for a branch.
+
+        Missing recipe or branch data is read outside the lock and swapped in
+        only if no change arrived meanwhile; after repeated races the last
+        attempt reads under the lock.
+        """
+        for attempt in range(_LOAD_ATTEMPTS):
+            with self._lock:
+                if self._recipes is not None and branch_id in self._stock:
+                    return dict(self._branch_makeable(branch_id))
+                missing = (self._recipes is None, branch_id not in self._stock)
+                if attempt == _LOAD_ATTEMPTS - 1:
+                    self._install(*self._read(db, branch_id, *missing), branch_id)
+                    return dict(self._branch_makeable(branch_id))
+                versions = self._versions(branch_id)
+            loaded = self._read(db, branch_id, *missing)
+            with self._lock:
+                if versions == self._versions(branch_id):
+                    self._install(*loaded, branch_id)
+
+    # ------------------------------------------------------------------
+    # Incremental maintenance
+    # ------------------------------------------------------------------
+    def apply_stock_changes(self, changes: Dict[tuple, Optional[Decimal]]):
+        """
+        Apply committed stock levels.
+
+        Args:
+            changes: {(branch_id, ingredient_id, stock_id): amount_remaining},
+                where ``None`` means the stock row is no longer usable
+                (deleted).
+        """
+        with self._lock:
+            for (branch_id, ingredient_id, stock_id), amount in changes.items():
+                self._bump(branch_id)
+                branch_stock = self._stock.get(branch_id)
+                if branch_stock is None:
+                    # Branch not loaded yet - it will be read fresh on demand
+                    continue
+                if amount is None:
+                    rows = branch_stock.get(ingredient_id, {})
+                    rows.pop(stock_id, None)
+                    if not rows:
+                        branch_stock.pop(ingredient_id, None)
+                else:
+                    branch_stock.setdefault(ingredient_id, {})[stock_id] = amount
+
+                branch_makeable = self._makeable.get(branch_id)
+                if branch_makeable is None or self._recipes is None:
+                    continue
+                for menu_item_id in self._used_by.get(ingredient_id, ()):
+                    branch_makeable[menu_item_id] = self._compute(
+                        branch_id, menu_item_id)
+
+    def invalidate_branch(self, branch_id: int):
+        """Drop a branch so it is reloaded on the next read."""
+        with self._lock:
+            self._bump(branch_id)
+            self._stock.pop(branch_id, None)
+            self._makeable.pop(branch_id, None)
+
+    def invalidate_recipes(self):
+        """Drop recipe data (recipes, menu or ingredients changed)."""
+        with self._lock:
+            self._recipes_version += 1
+            self._recipes = None
+            self._used_by = {}
+            self._deleted_ingredients = set()
+            self._makeable = {}
+
+    def invalidate_all(self):
+        with self._lock:
+            self.invalidate_recipes()
+            self._stock = {}
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    def _versions(self, branch_id: int) -> tuple:
+        return self._recipes_version, self._branch_versions.get(branch_id, 0)
+
+    def _bump(self, branch_id: int):
+        self._branch_versions[branch_id] = self._branch_versions.get(branch_id, 0) + 1
+
+    def _read(self, db: Session, branch_id: int, recipes: bool, stock: bool) -> tuple:
+        """Read (recipes, branch stock) as asked; None for the parts not read."""
+        return (self._read_recipes(db) if recipes else None,
+                self._read_branch(db, branch_id) if stock else None)
+
+    def _install(self, recipes: Optional[tuple], stock: Optional[dict], branch_id: int):
+        if recipes is not None:
+            self._recipes, self._used_by, self._deleted_ingredients = recipes
+            self._makeable = {}
+        if stock is not None:
+            self._stock[branch_id] = stock
+            self._makeable.pop(branch_id, None)
+
+    def _branch_makeable(self, branch_id: int) -> Dict[int, Optional[int]]:
+        if branch_id not in self._makeable:
+            self._makeable[branch_id] = {
+                menu_item_id: self._compute(branch_id, menu_item_id)
+                for menu_item_id in self._recipes
+            }
+        return self._makeable[branch_id]
+
+    @staticmethod
+    def _read_recipes(db: Session) -> tuple:
+        recipes: Dict[int, Dict[int, Decimal]] = {
+            menu_item_id: {} for (menu_item_id,) in db.query(models.Menu.menu_item_id).all()
+        }
+        used_by: Dict[int, Set[int]] = {}
+        rows = db.query(
+            models.Recipe.menu_item_id,
+            models.Recipe.ingredient_id,
+            models.Recipe.qty_per_unit
+        ).all()
+        for menu_item_id, ingredient_id, qty_per_unit in rows:
+            lines = recipes.setdefault(menu_item_id, {})
+            lines[ingredient_id] = lines.get(
+                ingredient_id, Decimal("0")) + qty_per_unit
+            used_by.setdefault(ingredient_id, set()).add(menu_item_id)
+
+        deleted_ingredients = {
+            ingredient_id for (ingredient_id,) in db.query(models.Ingredients.ingredient_id).filter(
+                models.Ingredients.is_deleted == True
+            ).all()
+        }
+        return recipes, used_by, deleted_ingredients
+
+    @staticmethod
+    def _read_branch(db: Session, branch_id: int) -> Dict[int, Dict[int, Decimal]]:
+        rows = db.query(
+            models.Stock.ingredient_id,
+            models.Stock.stock_id,
+            models.Stock.amount_remaining
+        ).filter(
+            models.Stock.branch_id == branch_id,
+            models.Stock.is_deleted == False
+        ).all()
+        stock: Dict[int, Dict[int, Decimal]] = {}
+        for ingredient_id, stock_id, amount in rows:
+            stock.setdefault(ingredient_id, {})[stock_id] = amount
+        return stock
+
+    def _compute(self, branch_id: int, menu_item_id: int) -> Optional[int]:
+        lines = self._recipes.get(menu_item_id)
+        if not lines:
+            return None
+
+        branch_stock = self._stock.get(branch_id, {})
+        makeable = None
+        for ingredient_id, qty_per_unit in lines.items():
+            if ingredient_id in self._deleted_ingredients:
+                return 0
+            if qty_per_unit <= 0:
+                continue
+            rows = branch_stock.get(ingredient_id)
+            if not rows:
+                return 0
+            amount = rows[min(rows)]
+            portions = int(max(amount, Decimal("0")) // qty_per_unit)
+            if makeable is None or portions < makeable:
+                makeable = portions
+        return makeable
+
+
+availability = MenuAvailabilityEngine()
+
+
+# -------------------------------------------------
+# Session hooks: collect stock changes on flush, apply them on commit
+# -------------------------------------------------
+_PENDING_KEY = "menu_availability"
+_TOPIC = "menu_availability"
+_RECIPE_MODELS = (models.Recipe, models.Menu, models.Ingredients)
+
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault(
+        _PENDING_KEY, {"stock": {}, "branches": set(), "recipes": False})
+
+
+def mark_stock_changed(db: Session, branch_id: int):
+    """
+    Flag a branch for reload after commit.
+
+    Needed by callers that change ``Stock`` with bulk/Core statements, which
+    bypass the ORM flush hooks below.
+    """
+    _pending(db)["branches"].add(branch_id)
+    cache_bus.publish(db, _TOPIC, {"branches": [branch_id]})
+
+
+def _publish_flush(session: Session, stock: dict, branches: set, recipes: bool):
+    """Send one flush's changes to the other workers (delivered on commit)."""
+    if not (stock or branches or recipes):
+        return
+    data = {
+        "recipes": recipes,
+        "branches": sorted(branches),
+        "stock": [[branch_id, ingredient_id, stock_id, None if amount is None else str(amount)]
+                  for (branch_id, ingredient_id, stock_id), amount in stock.items()],
+    }
+    if not cache_bus.publish(session, _TOPIC, data):
+        # Payload too large: have the other workers reload the branches instead
+        cache_bus.publish(session, _TOPIC, {
+            "recipes": recipes,
+            "branches": sorted(branches | {key[0] for key in stock}),
+        })
+
+
+def _apply_remote(data: dict):
+    """Apply changes committed by another worker."""
+    if data.get("recipes"):
+        availability.invalidate_recipes()
+    for branch_id in data.get("branches", ()):
+        availability.invalidate_branch(branch_id)
+    stock_changes = {
+        (branch_id, ingredient_id, stock_id): None if amount is None else Decimal(amount)
+        for branch_id, ingredient_id, stock_id, amount in data.get("stock", ())
+    }
+    if stock_changes:
+        availability.apply_stock_changes(stock_changes)
+
+
+cache_bus.subscribe(_TOPIC, _apply_remote, reset=availability.invalidate_all)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session, flush_context):
+    stock, branches, recipes = {}, set(), False
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, models.Stock):
+            state = inspect(obj)
+            if (state.attrs.branch_id.history.deleted
+                    or state.attrs.ingredient_id.history.deleted):
+                # The row moved: its old entry cannot be found - reload instead
+                branches.update(
+                    branch_id for branch_id in state.attrs.branch_id.history.sum() if branch_id)
+            elif obj in session.new or any(
+                    getattr(state.attrs, name).history.has_changes()
+                    for name in ("amount_remaining", "is_deleted")):
+                key = (obj.branch_id, obj.ingredient_id, obj.stock_id)
+                stock[key] = None if obj.is_deleted else obj.amount_remaining
+        elif isinstance(obj, _RECIPE_MODELS):
+            recipes = True
+
+    for obj in session.deleted:
+        if isinstance(obj, models.Stock):
+            stock[(obj.branch_id, obj.ingredient_id, obj.stock_id)] = None
+        elif isinstance(obj, _RECIPE_MODELS):
+            recipes = True
+
+    if stock or branches or recipes:
+        pending = _pending(session)
+        pending["stock"].update(stock)
+        pending["branches"].update(branches)
+        pending["recipes"] = pending["recipes"] or recipes
+        _publish_flush(session, stock, branches, recipes)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+
+    if pending["recipes"]:
+        availability.invalidate_recipes()
+    for branch_id in pending["branches"]:
+        availability.invalidate_branch(branch_id)
+    stock_changes = {
+        key: amount for key, amount in pending["stock"].items()
+        if key[0] not in pending["branches"]
+    }
+    if stock_changes:
+        availability.apply_stock_changes(stock_changes)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    # after_rollback also fires for savepoints, so only this hook tells them apart
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_KEY, None)
+        return
+    pending = session.info.get(_PENDING_KEY)
+    if pending:
+        # Amounts collected inside the savepoint may be gone - reload instead
+        pending["branches"].update(key[0] for key in pending["stock"])
+        pending["stock"] = {}
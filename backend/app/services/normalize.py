@@ -0,0 +1,93 @@
+"""
+Side-loading for ``?shape=normalized`` list responses.
+
+Each function returns ``{"data": rows, "included": {...}}`` where ``included``
+maps every related object once by id, ready to be validated by the matching
+``schemas.*PageNormalized`` adapter.
+"""
+from typing import Dict, List
+
+from .. import models
+
+INCLUDED_KEYS = [
+    "branches", "employees", "roles", "memberships", "tiers",
+    "menu_items", "orders", "stock", "ingredients",
+]
+
+
+def _empty_included() -> Dict[str, dict]:
+    return {key: {} for key in INCLUDED_KEYS}
+
+
+def _add_branch(included: dict, branch) -> None:
+    if branch is not None:
+        included["branches"].setdefault(branch.branch_id, branch)
+
+
+def _add_employee(included: dict, employee) -> None:
+    if employee is None or employee.employee_id in included["employees"]:
+        return
+    included["employees"][employee.employee_id] = employee
+    if employee.role is not None:
+        included["roles"].setdefault(employee.role.role_id, employee.role)
+    _add_branch(included, employee.branch)
+
+
+def _add_membership(included: dict, membership) -> None:
+    if membership is None or membership.membership_id in included["memberships"]:
+        return
+    included["memberships"][membership.membership_id] = membership
+    if membership.tier is not None:
+        included["tiers"].setdefault(membership.tier.tier_id, membership.tier)
+
+
+def _add_stock(included: dict, stock) -> None:
+    if stock is None or stock.stock_id in included["stock"]:
+        return
+    included["stock"][stock.stock_id] = stock
+    _add_branch(included, stock.branch)
+    if stock.ingredient is not None:
+        included["ingredients"].setdefault(
+            stock.ingredient.ingredient_id, stock.ingredient)
+
+
+def _add_order_relations(included: dict, order: models.Orders) -> None:
+    _add_branch(included, order.branch)
+    _add_employee(included, order.employee)
+    _add_membership(included, order.membership)
+    for item in order.order_items:
+        if item.menu_item is not None:
+            included["menu_items"].setdefault(item.menu_item.menu_item_id, item.menu_item)
+    for movement in order.stock_movements:
+        _add_stock(included, movement.stock)
+        _add_employee(included, movement.employee)
+
+
+def _add_order(included: dict, order) -> None:
+    if order is None or order.order_id in included["orders"]:
+        return
+    included["orders"][order.order_id] = order
+    _add_order_relations(included, order)
+
+
+def normalize_orders(orders: List[models.Orders]) -> dict:
+    included = _empty_included()
+    for order in orders:
+        _add_order_relations(included, order)
+    return {"data": orders, "included": included}
+
+
+def normalize_payments(payments: List[models.Payments]) -> dict:
+    included = _empty_included()
+    for payment in payments:
+        _add_order(included, payment.order)
+    return {"data": payments, "included": included}
+
+
+def normalize_stock_movements(movements: List[models.StockMovements]) -> dict:
+    included = _empty_included()
+    for movement in movements:
+        _add_stock(included, movement.stock)
+        _add_employee(included, movement.employee)
+        _add_order(included, movement.order)
+    return {"data": movements, "included": included}
@@ -0,0 +1,285 @@
+"""Order rules shared by the orders, order-items and sync endpoints."""
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+
+from .. import models
+from ..database import check_branch_shard
+
+
+def validate_branch_and_employee(db: Session, branch_id: int, employee_id: int) -> Tuple[models.Branches, models.Employees]:
+    """
+    Validate the branch exists (on this session's shard) and the employee is
+    active and works there.
+
+    Returns:
+        (branch, employee) - the employee with its role loaded
+
+    Raises:
+        HTTPException: If the branch or employee is invalid
+    """
+    check_branch_shard(db, branch_id)
+    branch = db.query(models.Branches).filter(
+        models.Branches.branch_id == branch_id
+    ).first()
+    if not branch:
+        raise HTTPException(status_code=404, detail="Branch not found")
+
+    employee = db.query(models.Employees).options(
+        joinedload(models.Employees.role)
+    ).filter(
+        models.Employees.employee_id == employee_id
+    ).first()
+    if not employee:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    if employee.is_deleted:
+        raise HTTPException(status_code=400, detail="Employee is not active")
+
+    if employee.branch_id != branch_id:
+        raise HTTPException(
+            status_code=400,
+            detail="Employee does not belong to the selected branch"
+        )
+    return branch, employee
+
+
+def load_menu_items(db: Session, order_items: List) -> Dict[int, models.Menu]:
+    """
+    Fetch the menu items referenced by order lines in one query.
+
+    Args:
+        order_items: Objects with ``menu_item_id`` and ``quantity``
+
+    Returns:
+        {menu_item_id: Menu}
+
+    Raises:
+        HTTPException: If an item is missing, unavailable or has quantity <= 0
+    """
+    menu_item_ids = [item.menu_item_id for item in order_items]
+    menu_items = db.query(models.Menu).filter(
+        models.Menu.menu_item_id.in_(menu_item_ids)
+    ).all()
+
+    menu_items_dict = {mi.menu_item_id: mi for mi in menu_items}
+
+    for item in order_items:
+        if item.menu_item_id not in menu_items_dict:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Menu item {item.menu_item_id} not found"
+            )
+        menu_item = menu_items_dict[item.menu_item_id]
+        if not menu_item.is_available:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Menu item '{menu_item.name}' (ID: {item.menu_item_id}) is not available"
+            )
+        if item.quantity <= 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Quantity must be greater than 0 for menu item {item.menu_item_id}"
+            )
+    return menu_items_dict
+
+
+def diff_order_items(db: Session, order_id: int, order_items: List,
+                     menu_items_dict: Dict[int, models.Menu]) -> Tuple[List[dict], List[dict], List[int]]:
+    """
+    Compare submitted order lines with the stored ones.
+
+    A submitted line is matched to a stored line by ``order_item_id`` when
+    given, otherwise to an unmatched stored line with the same menu item.
+    Matched lines keep their status and unit price snapshot; only the
+    quantity is updated, and only when it changed. New lines start as
+    ORDERED at the current menu price. Stored lines left unmatched are
+    deleted. As with ``PUT /api/order-items/{id}``, only ORDERED lines can
+    change quantity or be deleted: the kitchen has already deducted stock
+    for the others.
+
+    Returns:
+        (rows to insert, rows to update by primary key, order_item_ids to delete)
+
+    Raises:
+        HTTPException: If an order_item_id does not belong to the order, or
+            a line that is not ORDERED would be changed or deleted
+    """
+    existing = {
+        row.order_item_id: row for row in db.query(
+            models.OrderItems.order_item_id,
+            models.OrderItems.menu_item_id,
+            models.OrderItems.status,
+            models.OrderItems.quantity,
+            models.OrderItems.unit_price
+        ).filter(models.OrderItems.order_id == order_id).all()
+    }
+
+    matches = []
+    unmatched = dict(existing)
+    for item in order_items:
+        if item.order_item_id is not None:
+            if item.order_item_id not in unmatched:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Order item {item.order_item_id} not found in order {order_id}"
+                )
+            matches.append((item, unmatched.pop(item.order_item_id)))
+        else:
+            matches.append((item, None))
+
+    # Lines without an id take a remaining stored line of that menu item:
+    # one with the same quantity, else an ORDERED one (still editable)
+    for index, (item, stored) in enumerate(matches):
+        if stored is not None:
+            continue
+        candidates = [row for row in unmatched.values() if row.menu_item_id == item.menu_item_id]
+        row = (next((row for row in candidates if row.quantity == item.quantity), None)
+               or next((row for row in candidates if row.status == "ORDERED"), None)
+               or next(iter(candidates), None))
+        if row is not None:
+            matches[index] = (item, unmatched.pop(row.order_item_id))
+
+    inserts, updates = [], []
+    for item, stored in matches:
+        if stored is None:
+            unit_price = menu_items_dict[item.menu_item_id].price
+            inserts.append({
+                "order_id": order_id,
+                "menu_item_id": item.menu_item_id,
+                "status": "ORDERED",
+                "quantity": item.quantity,
+                "unit_price": unit_price,
+                "line_total": item.quantity * unit_price
+            })
+        elif item.menu_item_id != stored.menu_item_id:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Order item {stored.order_item_id} is not menu item {item.menu_item_id}"
+            )
+        elif item.quantity != stored.quantity:
+            if stored.status != "ORDERED":
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Cannot change the quantity of order item {stored.order_item_id}. "
+                           f"Only ORDERED items can be modified. Current status: {stored.status}"
+                )
+            updates.append({
+                "order_item_id": stored.order_item_id,
+                "quantity": item.quantity,
+                "line_total": item.quantity * stored.unit_price
+            })
+
+    for stored in unmatched.values():
+        if stored.status != "ORDERED":
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot remove order item {stored.order_item_id}. "
+                       f"Only ORDERED items can be modified. Current status: {stored.status}"
+            )
+
+    return inserts, updates, list(unmatched)
+
+
+def prepare_order_item(db: Session, order: models.Orders, db_order_item: models.OrderItems) -> None:
+    """
+    Check stock and deduct ingredients for an item moving to PREPARING.
+
+    Creates one SALE movement per recipe line. Does not commit.
+
+    Raises:
+        HTTPException: If an ingredient is deleted or stock is insufficient
+    """
+    # Get all recipes for this menu item
+    recipes = db.query(models.Recipe).filter(
+        models.Recipe.menu_item_id == db_order_item.menu_item_id
+    ).all()
+
+    if not recipes:
+        return
+
+    insufficient_ingredients = []
+
+    # First pass: Check all ingredients have sufficient stock
+    for recipe in recipes:
+        # Check if ingredient is deleted
+        ingredient = db.query(models.Ingredients).filter(
+            models.Ingredients.ingredient_id == recipe.ingredient_id
+        ).first()
+        if ingredient and ingredient.is_deleted:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot prepare order item. Ingredient '{ingredient.name}' has been deleted."
+            )
+
+        # Find stock for this ingredient in the order's branch. With several
+        # rows the lowest stock_id is used, as menu availability assumes.
+        stock = db.query(models.Stock).filter(
+            models.Stock.branch_id == order.branch_id,
+            models.Stock.ingredient_id == recipe.ingredient_id,
+            models.Stock.is_deleted == False
+        ).order_by(models.Stock.stock_id).first()
+
+        if not stock:
+            insufficient_ingredients.append({
+                "ingredient_id": recipe.ingredient_id,
+                "ingredient_name": ingredient.name if ingredient else "Unknown",
+                "available": 0,
+                "needed": float(recipe.qty_per_unit * db_order_item.quantity)
+            })
+            continue
+
+        qty_needed = recipe.qty_per_unit * db_order_item.quantity
+
+        if stock.amount_remaining < qty_needed:
+            insufficient_ingredients.append({
+                "ingredient_id": recipe.ingredient_id,
+                "ingredient_name": stock.ingredient.name,
+                "available": float(stock.amount_remaining),
+                "needed": float(qty_needed)
+            })
+
+    # If any ingredients are insufficient, return error with details
+    if insufficient_ingredients:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": "Insufficient stock to prepare this order item",
+                "insufficient_ingredients": insufficient_ingredients,
+                "suggestion": "Decrease quantity, cancel the item, or restock ingredients"
+            }
+        )
+
+    # Second pass: Deduct stock and create movements
+    for recipe in recipes:
+        stock = db.query(models.Stock).filter(
+            models.Stock.branch_id == order.branch_id,
+            models.Stock.ingredient_id == recipe.ingredient_id,
+            models.Stock.is_deleted == False
+        ).order_by(models.Stock.stock_id).first()
+
+        qty_needed = recipe.qty_per_unit * db_order_item.quantity
+        stock.amount_remaining -= qty_needed
+
+        # Create stock movement record
+        stock_movement = models.StockMovements(
+            stock_id=stock.stock_id,
+            employee_id=order.employee_id,
+            order_id=order.order_id,
+            qty_change=-qty_needed,
+            reason="SALE",
+            note=f"Order item {db_order_item.order_item_id} - {db_order_item.quantity}x {db_order_item.menu_item.name if db_order_item.menu_item else 'menu item'}"
+        )
+        db.add(stock_movement)
+
+
+def recalculate_order_total(db: Session, order: models.Orders) -> Decimal:
+    """Set order.total_price to the sum of its non-cancelled lines (flushes first)."""
+    db.flush()
+    order.total_price = db.query(func.sum(models.OrderItems.line_total)).filter(
+        models.OrderItems.order_id == order.order_id,
+        models.OrderItems.status != "CANCELLED"
+    ).scalar() or Decimal("0")
+    return order.total_price
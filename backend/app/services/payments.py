@@ -0,0 +1,268 @@
+"""Payment processing shared by the payments and sync endpoints."""
+from datetime import MAXYEAR, MINYEAR, datetime
+from decimal import Decimal
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import extract, false
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, joinedload
+
+from .. import models, schemas
+from ..database import get_engine
+from .indexes import install_indexes
+from .companions import record_order_pairs
+from .employee_sales import record_order_paid
+from .item_sales import record_order_sales
+
+QUARTER_MONTHS = {1: [1, 2, 3], 2: [4, 5, 6], 3: [7, 8, 9], 4: [10, 11, 12]}
+
+# paid_timestamp is also declared index=True on the model (new databases)
+_PAYMENT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_payments_paid_timestamp ON payments (paid_timestamp)",
+]
+_PAYMENT_TRGM_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_payments_payment_ref_trgm "
+    "ON payments USING gin (payment_ref gin_trgm_ops)",
+]
+
+
+def apply_payment(db: Session, order: models.Orders, payment: schemas.PaymentCreate) -> models.Payments:
+    """
+    Validate a payment for an order and stage it in the session.
+
+    Computes the final paid_price (points, then tier discount), marks the
+    order PAID, adds its lines to the daily item sales counters, the item
+    pair matrix and the employee counters and updates the membership points
+    and tier. Does not commit.
+
+    Raises:
+        HTTPException: If the order cannot be paid or the payment is invalid
+    """
+    # Check if payment already exists
+    existing_payment = db.query(models.Payments).filter(
+        models.Payments.order_id == payment.order_id
+    ).first()
+    if existing_payment:
+        raise HTTPException(
+            status_code=400, detail="Payment already exists for this order")
+
+    # Validate that all order items are either DONE or CANCELLED
+    order_items = db.query(models.OrderItems).filter(
+        models.OrderItems.order_id == payment.order_id
+    ).all()
+
+    if not order_items:
+        raise HTTPException(
+            status_code=400,
+            detail="Cannot process payment for an order with no items"
+        )
+
+    # Check if any items are still ORDERED or PREPARING
+    ordered_items = [item for item in order_items if item.status == "ORDERED"]
+    preparing_items = [
+        item for item in order_items if item.status == "PREPARING"]
+
+    if ordered_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot process payment. {len(ordered_items)} order item(s) are still ORDERED (waiting for chef). All items must be DONE or CANCELLED before payment."
+        )
+
+    if preparing_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot process payment. {len(preparing_items)} order item(s) are still PREPARING. All items must be DONE or CANCELLED before payment."
+        )
+
+    # Check if there are any non-cancelled items (at least one item must be DONE)
+    done_items = [item for item in order_items if item.status == "DONE"]
+    if not done_items:
+        raise HTTPException(
+            status_code=400,
+            detail="Cannot process payment. No DONE items found. At least one item must be DONE."
+        )
+
+    # Validate payment_ref is required for CARD and QR payment methods
+    if payment.payment_method in ["CARD", "QR"]:
+        if not payment.payment_ref or not payment.payment_ref.strip():
+            raise HTTPException(
+                status_code=400,
+                detail=f"Payment reference (payment_ref) is required for {payment.payment_method} payments"
+            )
+
+    # Calculate final price from order.total_price, points_used (100 points = ฿1), then apply tier discount
+    # Backend calculates this to prevent manipulation
+    total_price = Decimal(str(order.total_price))
+    points_used_req = int(payment.points_used or 0)
+
+    # Load membership (if any) to apply discount and validate points usage; include tier for discount
+    membership = None
+    discount_pct = Decimal("0")
+    if order.membership_id:
+        membership = db.query(models.Memberships).options(joinedload(models.Memberships.tier)).filter(
+            models.Memberships.membership_id == order.membership_id
+        ).first()
+        if membership and membership.tier and membership.tier.discount_percentage is not None:
+            discount_pct = Decimal(str(membership.tier.discount_percentage))
+
+    # Validate points usage
+    clamped_points_used = 0
+    if points_used_req > 0:
+        if not membership:
+            raise HTTPException(
+                status_code=400,
+                detail="Cannot use points without a membership"
+            )
+        # Max points usable is min(2000, membership balance, floor(total_price * 100))
+        max_points_by_total = int((total_price * Decimal("100")).to_integral_value(rounding="ROUND_FLOOR"))
+        max_usable = min(2000, membership.points_balance, max_points_by_total)
+        if max_usable < 0:
+            max_usable = 0
+        if points_used_req > max_usable:
+            # Clamp instead of erroring, to be robust against UI mismatch
+            clamped_points_used = max_usable
+        else:
+            clamped_points_used = max(0, points_used_req)
+
+    # Convert points to baht (100 points = 1 baht)
+    baht_from_points = Decimal(clamped_points_used) / Decimal("100")
+    subtotal = total_price - baht_from_points
+    if subtotal < 0:
+        subtotal = Decimal("0")
+    # Apply discount after points
+    multiplier = Decimal("1") - (discount_pct / Decimal("100"))
+    if multiplier < 0:
+        multiplier = Decimal("0")
+    paid_price = (subtotal * multiplier).quantize(Decimal("0.01"))
+
+    # If paid_price was provided, validate it matches our calculation
+    if payment.paid_price:
+        provided_paid_price = Decimal(str(payment.paid_price))
+        # Allow small floating point differences
+        if abs(provided_paid_price - paid_price) > Decimal("0.01"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid paid_price. Expected: {paid_price}, Provided: {provided_paid_price}"
+            )
+
+    # Create payment with calculated paid_price
+    db_payment = models.Payments(
+        order_id=payment.order_id,
+        paid_price=paid_price,  # Pass Decimal directly, SQLAlchemy handles it
+        points_used=clamped_points_used,
+        payment_method=payment.payment_method,
+        payment_ref=payment.payment_ref,
+        paid_timestamp=payment.paid_timestamp or datetime.now()
+    )
+    db.add(db_payment)
+
+    # Update order status to PAID
+    order.status = "PAID"
+    record_order_sales(db, order, order_items)
+    record_order_pairs(db, order, order_items)
+    record_order_paid(db, order, order_items)
+
+    # If points were used, deduct from membership
+    if clamped_points_used > 0 and order.membership_id:
+        membership = db.query(models.Memberships).filter(
+            models.Memberships.membership_id == order.membership_id
+        ).first()
+        if membership:
+            membership.points_balance = max(
+                0, membership.points_balance - clamped_points_used)
+
+    # Award points to membership (if applicable) based on calculated paid_price
+    if order.membership_id:
+        membership = db.query(models.Memberships).filter(
+            models.Memberships.membership_id == order.membership_id
+        ).first()
+        if membership:
+            # Award points: for every 10 baht paid, +1 point
+            points_earned = int(float(paid_price) / 10)
+            if points_earned > 0:
+                membership.points_balance += points_earned
+                # Also increase cumulative points by the same amount
+                membership.cumulative_points += points_earned
+
+                # Auto-upgrade tier based on cumulative_points
+                # Find the highest tier where minimum_point_required <= cumulative_points
+                # and tier number is greater than current
+                current_tier = db.query(models.Tiers).filter(
+                    models.Tiers.tier_id == membership.tier_id
+                ).first()
+                current_tier_number = current_tier.tier if current_tier else 0
+
+                eligible_tiers = (
+                    db.query(models.Tiers)
+                    .filter(models.Tiers.minimum_point_required <= membership.cumulative_points)
+                    .order_by(models.Tiers.tier.desc())
+                    .all()
+                )
+
+                for t in eligible_tiers:
+                    # Upgrade only if strictly higher tier number
+                    if t.tier > current_tier_number:
+                        membership.tier_id = t.tier_id
+                        current_tier_number = t.tier
+                        break
+
+    return db_payment
+
+
+def install_payment_indexes(bind: Engine = None) -> bool:
+    """Create the payment listing indexes (PostgreSQL only)."""
+    return install_indexes(bind or get_engine(), _PAYMENT_INDEXES, _PAYMENT_TRGM_INDEXES)
+
+
+def _add_months(d: datetime, months: int) -> datetime:
+    month_index = d.month - 1 + months
+    return datetime(d.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def paid_period_filters(year: Optional[int] = None, month: Optional[int] = None,
+                        quarter: Optional[int] = None) -> List:
+    """
+    Filters for the year/month/quarter parameters of the payment listings.
+
+    With a year they become one half-open ``paid_timestamp`` range, which
+    can use the index; a month or quarter without a year matches that month
+    in every year and still needs ``extract``. An invalid month matches
+    nothing and an invalid quarter is ignored, as before. So does a year
+    whose range ``datetime`` cannot hold (before 1, or 9999 and later).
+    """
+    column = models.Payments.paid_timestamp
+    if month and not 1 <= month <= 12:
+        return [false()]
+    if year and not MINYEAR <= year < MAXYEAR:
+        return [false()]
+    if quarter not in QUARTER_MONTHS:
+        quarter = None
+
+    if not year:
+        filters = []
+        if month:
+            filters.append(extract('month', column) == month)
+        if quarter:
+            filters.append(extract('month', column).in_(QUARTER_MONTHS[quarter]))
+        return filters
+
+    start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    if quarter:
+        quarter_start = datetime(year, QUARTER_MONTHS[quarter][0], 1)
+        start, end = max(start, quarter_start), min(end, _add_months(quarter_start, 3))
+    if month:
+        month_start = datetime(year, month, 1)
+        start, end = max(start, month_start), min(end, _add_months(month_start, 1))
+    if start >= end:
+        # e.g. month 5 with quarter 3
+        return [false()]
+    return [column >= start, column < end]
+
+
+def payment_search_filter(search: str):
+    """An order id for numeric input, else a payment_ref substring (trigram index)."""
+    try:
+        return models.Payments.order_id == int(search)
+    except ValueError:
+        return models.Payments.payment_ref.ilike(f"%{search}%")
@@ -0,0 +1,106 @@
+"""Response building for write endpoints without reloading what is already in the session."""
+from decimal import Decimal
+from typing import List, Optional, Type, get_args
+
+from pydantic import BaseModel
+from sqlalchemy import Numeric, inspect
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import PASSIVE_NO_FETCH, PASSIVE_NO_RESULT, set_committed_value
+
+
+def _nested_schema(annotation) -> Optional[Type[BaseModel]]:
+    """Return the Pydantic model inside Optional[...] / List[...], if any."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        schema = _nested_schema(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+def _normalize_numerics(instances: List, mapper) -> None:
+    """
+    Round Decimal values assigned in this request to their column scale, as
+    the database would return them (e.g. 5 -> 5.00 for DECIMAL(10, 2)).
+    """
+    columns = [
+        column for column in mapper.column_attrs
+        if isinstance(column.expression.type, Numeric) and column.expression.type.scale is not None
+    ]
+    for obj in instances:
+        for column in columns:
+            value = obj.__dict__.get(column.key)
+            if isinstance(value, Decimal):
+                exponent = Decimal(1).scaleb(-column.expression.type.scale)
+                set_committed_value(obj, column.key, value.quantize(exponent))
+
+
+def load_relationships(db: Session, instances: List, schema: Type[BaseModel]) -> None:
+    """
+    Load the relationships ``schema`` reads from ``instances`` that are not
+    loaded yet, one level at a time.
+
+    Already-loaded relationships, and many-to-one targets already in the
+    identity map, cost nothing. Missing ones are fetched
+    together in one query per level (joined for many-to-one, plus one
+    selectin query per collection), instead of one lazy load per attribute.
+    """
+    instances = [obj for obj in instances if obj is not None]
+    if not instances:
+        return
+
+    mapper = inspect(instances[0]).mapper
+    _normalize_numerics(instances, mapper)
+
+    relationships = {}
+    for name, field in schema.model_fields.items():
+        nested = _nested_schema(field.annotation)
+        if name in mapper.relationships and nested is not None:
+            relationships[name] = nested
+
+    missing = set()
+    for obj in instances:
+        state = inspect(obj)
+        for name in relationships:
+            if name not in state.unloaded:
+                continue
+            # Many-to-one targets already in the identity map need no SQL
+            if not mapper.relationships[name].uselist:
+                value = state.manager[name].impl.get(
+                    state, state.dict, passive=PASSIVE_NO_FETCH)
+                if value is not PASSIVE_NO_RESULT:
+                    continue
+            missing.add(name)
+    if missing:
+        options = [
+            selectinload(getattr(mapper.class_, name))
+            if mapper.relationships[name].uselist
+            else joinedload(getattr(mapper.class_, name))
+            for name in missing
+        ]
+        primary_key = mapper.primary_key[0]
+        db.query(mapper.class_).options(*options).filter(
+            primary_key.in_({inspect(obj).identity[0] for obj in instances})
+        ).all()
+
+    for name, nested in relationships.items():
+        children = []
+        for obj in instances:
+            value = getattr(obj, name)
+            if value is None:
+                continue
+            children.extend(value if mapper.relationships[name].uselist else [value])
+        load_relationships(db, children, nested)
+
+
+def load_for_response(db: Session, instance, schema: Type[BaseModel]):
+    """
+    Make ``instance`` ready to be serialized as ``schema`` and return it.
+
+    Meant for sessions from ``get_write_db`` (``expire_on_commit=False``):
+    after commit, everything loaded while handling the request is still
+    there and only the missing relationships are queried.
+    """
+    load_relationships(db, [instance], schema)
+    return instance
@@ -0,0 +1,239 @@
+"""
+Branch shards: per-branch-group databases for the order path.
+
+Usage:
+    BRANCH_SHARDS="1,2=postgresql://.../pos_a;3,4=postgresql://.../pos_b" \\
+        python -m app.sharding --init            # schema, id ranges and reference data on every shard
+    python -m app.sharding --sync-reference      # re-copy reference data (after menu/staff changes)
+    python -m app.sharding --move-branches       # move existing branch rows from DATABASE_URL to their shard
+    python -m app.sharding --status              # rows per shard
+
+Each shard is a complete POS database. The branch-local tables (orders,
+order items, payments, stock, stock movements, sync records and rollups) of
+its branches live only there; requests carrying ``X-Branch-Id`` (or
+``?branch_id=``) are routed to it by ``get_branch_db``. Reference tables
+(branches, roles, employees, tiers, memberships, ingredients, menu, recipe)
+are written on DATABASE_URL and copied to the shards by ``--sync-reference``.
+Membership points earned or spent at a sharded branch stay on that shard's
+copy of the member: the copy keeps its balance and tier across syncs.
+
+On PostgreSQL, ``--init`` starts the id sequences of shard N at
+N * ID_BLOCK, so order, item, stock, movement and rollup ids never collide
+across shards. SQLite shards number their rows independently.
+"""
+import argparse
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import Table, delete, func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+from .database import (
+    BRANCH_SHARDS, get_engine, get_shard_engine, shard_branches, shard_ids, sharding_enabled,
+)
+from .init_db import create_schema
+
+logger = logging.getLogger(__name__)
+
+ID_BLOCK = 100_000_000
+BATCH_SIZE = 1000
+
+# Copied from DATABASE_URL to every shard, parents first
+REFERENCE_TABLES = [
+    models.Roles, models.Branches, models.Employees, models.Tiers,
+    models.Memberships, models.Ingredients, models.Menu, models.Recipe,
+]
+# Columns the shard owns once a row exists there (updated by its payments)
+SHARD_OWNED_COLUMNS = {
+    "memberships": {"points_balance", "cumulative_points", "tier_id"},
+}
+# Serial ids written on the order path
+SHARD_SEQUENCES = {
+    "orders": "order_id",
+    "order_items": "order_item_id",
+    "stock": "stock_id",
+    "stock_movements": "movement_id",
+    "order_rollups": "id",
+    "item_sales_daily": "id",
+    "item_pairs": "id",
+    "employee_sales_daily": "id",
+}
+
+
+def _insert(conn: Connection, table: Table):
+    if conn.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    if conn.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    raise SystemExit(f"Unsupported shard database: {conn.dialect.name}")
+
+
+def _copy_rows(source: Connection, target: Connection, table: Table, where=None,
+               update: bool = False) -> int:
+    """
+    Copy the rows of ``table`` matching ``where`` in batches. Existing rows
+    (same primary key) are updated when ``update`` is set, else left alone,
+    so an interrupted copy can simply be run again.
+    """
+    key = [column.name for column in table.primary_key.columns]
+    statement = _insert(target, table)
+    if update:
+        owned = SHARD_OWNED_COLUMNS.get(table.name, set())
+        statement = statement.on_conflict_do_update(index_elements=key, set_={
+            column.name: statement.excluded[column.name]
+            for column in table.columns if column.name not in key and column.name not in owned
+        })
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=key)
+
+    query = select(table)
+    if where is not None:
+        query = query.where(where)
+    copied = 0
+    result = source.execution_options(yield_per=BATCH_SIZE).execute(
+        query.order_by(*table.primary_key.columns))
+    for batch in result.mappings().partitions():
+        target.execute(statement, [dict(row) for row in batch])
+        copied += len(batch)
+    return copied
+
+
+def sync_reference(source: Engine, shard_engine: Engine) -> Dict[str, int]:
+    """Upsert the reference tables into a shard and drop rows deleted at the source."""
+    copied = {}
+    with source.connect() as src, shard_engine.begin() as dst:
+        for model in REFERENCE_TABLES:
+            table = model.__table__
+            copied[table.name] = _copy_rows(src, dst, table, update=True)
+        for model in reversed(REFERENCE_TABLES):
+            table = model.__table__
+            key = list(table.primary_key.columns)[0]
+            source_keys = {row[0] for row in src.execute(select(key))}
+            stale = [row[0] for row in dst.execute(select(key)) if row[0] not in source_keys]
+            if not stale:
+                continue
+            try:
+                with dst.begin_nested():
+                    dst.execute(delete(table).where(key.in_(stale)))
+            except IntegrityError:
+                logger.warning("%s: %d deleted rows are still referenced on the shard, kept",
+                               table.name, len(stale))
+        # Recipes may have changed: cached menu item costs are recomputed on demand
+        dst.execute(delete(models.MenuItemCosts.__table__))
+    return copied
+
+
+def reserve_id_range(shard_engine: Engine, shard: int) -> bool:
+    """Start the shard's id sequences at shard * ID_BLOCK (PostgreSQL only)."""
+    if shard_engine.dialect.name != "postgresql":
+        return False
+    if (shard + 1) * ID_BLOCK > 2**31 - 1:
+        logger.warning("Shard %d has no room for an id block; ids may collide", shard)
+        return False
+    with shard_engine.begin() as conn:
+        for table, column in SHARD_SEQUENCES.items():
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                f"GREATEST(:start, (SELECT COALESCE(max({column}), 0) FROM {table})))"
+            ), {"start": shard * ID_BLOCK})
+    return True
+
+
+def _branch_local_filters(branch_ids: List[int]) -> List[tuple]:
+    """(table, where) for the rows of ``branch_ids``, parents first."""
+    orders = select(models.Orders.order_id).where(models.Orders.branch_id.in_(branch_ids))
+    order_items = select(models.OrderItems.order_item_id).where(
+        models.OrderItems.order_id.in_(orders))
+    stock = select(models.Stock.stock_id).where(models.Stock.branch_id.in_(branch_ids))
+    records = models.SyncRecords
+    return [
+        (models.Stock.__table__, models.Stock.branch_id.in_(branch_ids)),
+        (models.Orders.__table__, models.Orders.branch_id.in_(branch_ids)),
+        (models.OrderItems.__table__, models.OrderItems.order_id.in_(orders)),
+        (models.Payments.__table__, models.Payments.order_id.in_(orders)),
+        (models.StockMovements.__table__, models.StockMovements.stock_id.in_(stock)),
+        (models.StockUsageDaily.__table__, models.StockUsageDaily.stock_id.in_(stock)),
+        (models.StockForecasts.__table__, models.StockForecasts.branch_id.in_(branch_ids)),
+        (models.IngredientCosts.__table__, models.IngredientCosts.branch_id.in_(branch_ids)),
+        (models.MenuItemCosts.__table__, models.MenuItemCosts.branch_id.in_(branch_ids)),
+        (records.__table__,
+         (records.entity_type.in_(["ORDER", "PAYMENT"]) & records.server_id.in_(orders))
+         | ((records.entity_type == "ORDER_ITEM") & records.server_id.in_(order_items))),
+        (models.ArchivedOrders.__table__, models.ArchivedOrders.branch_id.in_(branch_ids)),
+        (models.OrderRollups.__table__, models.OrderRollups.branch_id.in_(branch_ids)),
+        (models.ItemSalesDaily.__table__, models.ItemSalesDaily.branch_id.in_(branch_ids)),
+        (models.ItemPairs.__table__, models.ItemPairs.branch_id.in_(branch_ids)),
+        (models.EmployeeSalesDaily.__table__, models.EmployeeSalesDaily.branch_id.in_(branch_ids)),
+    ]
+
+
+def move_branches(source: Engine, shard_engine: Engine, branch_ids: List[int]) -> Dict[str, int]:
+    """
+    Copy the branch-local rows of ``branch_ids`` to the shard, then delete
+    them from the source. The copy commits first, so a failure leaves the
+    rows on both sides and the command can be re-run.
+    """
+    filters = _branch_local_filters(branch_ids)
+    moved = {}
+    with source.connect() as src, shard_engine.begin() as dst:
+        for table, where in filters:
+            moved[table.name] = _copy_rows(src, dst, table, where)
+    with source.begin() as src:
+        # Children first; the subqueries still see the parent rows
+        for table, where in reversed(filters):
+            src.execute(delete(table).where(where))
+    return moved
+
+
+def shard_status() -> List[dict]:
+    rows = []
+    for shard in shard_ids():
+        engine = get_shard_engine(shard)
+        orders = None
+        if inspect(engine).has_table("orders"):
+            with engine.connect() as conn:
+                orders = conn.execute(
+                    select(func.count()).select_from(models.Orders.__table__)).scalar()
+        rows.append({"shard": shard, "branches": shard_branches(shard) or "other",
+                     "url": engine.url.render_as_string(hide_password=True), "orders": orders})
+    return rows
+
+
+def _shards(selected: Optional[Iterable[int]]) -> List[int]:
+    return [shard for shard in shard_ids()[1:] if not selected or shard in selected]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="Manage branch shards (BRANCH_SHARDS)")
+    parser.add_argument("--init", action="store_true",
+                        help="Create the schema, reserve id ranges and copy reference data")
+    parser.add_argument("--sync-reference", action="store_true",
+                        help="Copy reference tables from DATABASE_URL to the shards")
+    parser.add_argument("--move-branches", action="store_true",
+                        help="Move existing rows of sharded branches off DATABASE_URL")
+    parser.add_argument("--status", action="store_true", help="Show orders per shard")
+    parser.add_argument("--shard", type=int, action="append",
+                        help="Only this shard (repeatable; default all)")
+    args = parser.parse_args()
+
+    if not sharding_enabled():
+        raise SystemExit(f"BRANCH_SHARDS is not set ({BRANCH_SHARDS!r})")
+    primary = get_engine()
+    for shard in _shards(args.shard):
+        engine = get_shard_engine(shard)
+        if args.init:
+            create_schema(engine)
+            if reserve_id_range(engine, shard):
+                print(f"shard {shard}: ids start at {shard * ID_BLOCK}")
+        if args.init or args.sync_reference:
+            print(f"shard {shard}: reference rows {sync_reference(primary, engine)}")
+        if args.move_branches:
+            print(f"shard {shard}: moved {move_branches(primary, engine, shard_branches(shard))}")
+    if args.status or not (args.init or args.sync_reference or args.move_branches):
+        for row in shard_status():
+            orders = "not initialized" if row["orders"] is None else f"{row['orders']} orders"
+            print(f"shard {row['shard']}: branches {row['branches']}, {orders}, {row['url']}")
@@ -0,0 +1,123 @@
+"""Response compression: Brotli when the client and server support it, else gzip."""
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional dependency: fall back to gzip only
+    brotli = None
+
+
+class CompressionMiddleware:
+    """
+    Compress responses of at least ``minimum_size`` bytes.
+
+    Uses Brotli for clients sending ``Accept-Encoding: br`` when the
+    ``brotli`` package is installed, gzip otherwise. Responses that already
+    carry a Content-Encoding (and 304s, which have no body) pass through, as
+    do event streams.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1000,
+                 gzip_level: int = 6, brotli_quality: int = 4) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            accept_encoding = Headers(scope=scope).get("Accept-Encoding", "")
+            app = _skip_event_streams(self.app, send)
+            if brotli is not None and "br" in accept_encoding:
+                responder = BrotliResponder(app, self.minimum_size, self.brotli_quality)
+                await responder(scope, receive, send)
+                return
+            if "gzip" in accept_encoding:
+                responder = GZipResponder(
+                    app, self.minimum_size, compresslevel=self.gzip_level)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def _skip_event_streams(app: ASGIApp, send: Send) -> ASGIApp:
+    """
+    Wrap ``app`` for a responder so that a ``text/event-stream`` response
+    goes straight to ``send``: compressors buffer, and events must reach the
+    client as they happen. Decided by the response's Content-Type, whatever
+    the request's Accept header said.
+    """
+    async def wrapped(scope: Scope, receive: Receive, compressing_send: Send) -> None:
+        target = compressing_send
+
+        async def route(message: Message) -> None:
+            nonlocal target
+            if message["type"] == "http.response.start":
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                if content_type.startswith("text/event-stream"):
+                    target = send
+            await target(message)
+
+        await app(scope, receive, route)
+
+    return wrapped
+
+
+class BrotliResponder:
+    """Brotli counterpart of starlette's GZipResponder."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compressor = brotli.Compressor(quality=quality)
+        self.send: Send = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_with_brotli)
+
+    def _set_headers(self, length: int = None) -> None:
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = "br"
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def send_with_brotli(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body chunk decides the encoding
+            self.initial_message = message
+            self.passthrough = "content-encoding" in Headers(raw=message["headers"])
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            if self.passthrough or (len(body) < self.minimum_size and not more_body):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            if more_body:
+                self._set_headers()
+                message["body"] = self.compressor.process(body)
+            else:
+                message["body"] = self.compressor.process(body) + self.compressor.finish()
+                self._set_headers(len(message["body"]))
+            await self.send(self.initial_message)
+            await self.send(message)
+        elif self.passthrough:
+            await self.send(message)
+        else:
+            message["body"] = self.compressor.process(body)
+            if not more_body:
+                message["body"] += self.compressor.finish()
+            await self.send(message)
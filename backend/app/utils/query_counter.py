@@ -0,0 +1,35 @@
+"""Query-count instrumentation for spotting N+1s and redundant reloads."""
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements: List[str] = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(bind: Engine):
+    """
+    Count SQL statements sent to the database inside the block.
+
+    Usage:
+        with count_queries(engine) as counter:
+            client.post("/api/orders", json=payload)
+        assert counter.count < 10
+    """
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute",
+                     counter._before_cursor_execute)
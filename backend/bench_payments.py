@@ -0,0 +1,145 @@
+"""
+Payment listing benchmark (PostgreSQL).
+
+Usage:
+    DATABASE_URL=postgresql://.../scratch python bench_payments.py --seed 5000000
+    DATABASE_URL=postgresql://.../scratch python bench_payments.py
+
+``--seed N`` fills an empty database (after ``python -m app.init_db
+--schema-only``) with N paid orders spread over three years; it refuses to
+run if ``orders`` already has rows. Then compares, for the filters used by
+GET /api/payments and /api/payments/stats:
+  - extract():  the old year/month/quarter filters
+  - range:      paid_period_filters (half-open paid_timestamp range)
+and times payment_ref search and the X-Total-Count cost (exact, capped,
+estimate and cached).
+"""
+import argparse
+import time
+
+from sqlalchemy import extract, func, text
+
+from app import models
+from app.database import SessionLocal, get_engine
+from app.services.counts import TotalCounter, capped_count, estimated_count
+from app.services.indexes import trgm_available
+from app.services.payments import QUARTER_MONTHS, paid_period_filters, payment_search_filter
+
+
+def seed(rows: int):
+    engine = get_engine()
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT EXISTS (SELECT 1 FROM orders)")).scalar():
+            raise SystemExit("orders is not empty - seed a scratch database instead")
+        branch_id = conn.execute(text(
+            "INSERT INTO branches (name, address, phone, is_deleted) "
+            "VALUES ('Bench', '-', '020000000', false) RETURNING branch_id")).scalar()
+        role_id = conn.execute(text(
+            "INSERT INTO roles (role_name, seniority) VALUES ('Bench', 1) RETURNING role_id")).scalar()
+        employee_id = conn.execute(text(
+            "INSERT INTO employees (branch_id, role_id, first_name, last_name, is_deleted, "
+            "salary, joined_date) VALUES (:b, :r, 'Bench', 'User', false, 0, now()) "
+            "RETURNING employee_id"), {"b": branch_id, "r": role_id}).scalar()
+        # Keep millions of rows out of the change feed
+        conn.execute(text("ALTER TABLE orders DISABLE TRIGGER USER"))
+        conn.execute(text("""
+            INSERT INTO orders (order_id, branch_id, employee_id, order_type, status,
+                                total_price, created_at)
+            SELECT i, :b, :e, 'DINE_IN', 'PAID', 100 + i % 900,
+                   timestamp '2023-01-01' + (i * interval '1 second') * (94608000.0 / :n)
+            FROM generate_series(1, :n) i
+        """), {"b": branch_id, "e": employee_id, "n": rows})
+        conn.execute(text("ALTER TABLE orders ENABLE TRIGGER USER"))
+        conn.execute(text("""
+            INSERT INTO payments (order_id, paid_price, points_used, payment_method,
+                                  payment_ref, paid_timestamp)
+            SELECT order_id, total_price, 0,
+                   (ARRAY['CASH', 'CARD', 'QR', 'TRANSFER'])[1 + order_id % 4],
+                   CASE WHEN order_id % 4 IN (1, 2) THEN 'TXN' || lpad(order_id::text, 9, '0') END,
+                   created_at + interval '20 minutes'
+            FROM orders
+        """))
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('orders', 'order_id'), :n)"), {"n": rows})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE orders"))
+        conn.execute(text("VACUUM ANALYZE payments"))
+
+
+def extract_filters(year=None, month=None, quarter=None) -> list:
+    column = models.Payments.paid_timestamp
+    filters = []
+    if year:
+        filters.append(extract('year', column) == year)
+    if month:
+        filters.append(extract('month', column) == month)
+    if quarter:
+        filters.append(extract('month', column).in_(QUARTER_MONTHS[quarter]))
+    return filters
+
+
+def timed(fn, repeat: int = 3) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark payment listing filters")
+    parser.add_argument("--seed", type=int, default=0, metavar="N",
+                        help="Insert N paid orders into an empty database first")
+    args = parser.parse_args()
+    if get_engine().dialect.name != "postgresql":
+        raise SystemExit("This benchmark needs PostgreSQL")
+    if args.seed:
+        print(f"Seeding {args.seed} payments...")
+        seed(args.seed)
+
+    db = SessionLocal()
+    total = db.query(func.count(models.Payments.order_id)).scalar()
+    print(f"{total} payments, pg_trgm: {trgm_available(db)}")
+
+    def base():
+        return db.query(models.Payments).join(
+            models.Orders, models.Payments.order_id == models.Orders.order_id)
+
+    def page(filters):
+        return lambda: base().filter(*filters).order_by(
+            models.Payments.paid_timestamp.desc()).limit(100).all()
+
+    def stats(filters):
+        return lambda: db.query(func.count(models.Payments.order_id),
+                                func.sum(models.Payments.paid_price)).filter(*filters).first()
+
+    print(f"{'filter':<24} {'page extract':>13} {'page range':>11} "
+          f"{'stats extract':>14} {'stats range':>12}")
+    for label, period in [("year=2024", {"year": 2024}),
+                          ("year=2024 month=6", {"year": 2024, "month": 6}),
+                          ("year=2025 quarter=2", {"year": 2025, "quarter": 2})]:
+        old, new = extract_filters(**period), paid_period_filters(**period)
+        db.expunge_all()
+        print(f"{label:<24} {timed(page(old)):>10.1f} ms {timed(page(new)):>8.1f} ms "
+              f"{timed(stats(old)):>11.1f} ms {timed(stats(new)):>9.1f} ms")
+
+    search = payment_search_filter("TXN00012345")
+    print(f"payment_ref search: {timed(page([search])):.1f} ms")
+
+    for label, filters in [("all", []), ("year=2024", paid_period_filters(year=2024)),
+                           ("year=2024 month=6", paid_period_filters(year=2024, month=6))]:
+        query = base().filter(*filters)
+        exact_rows = query.count()
+        estimate = estimated_count(query)
+        counter = TotalCounter(ttl=30)
+        counter.total(query)
+        print(f"X-Total-Count {label}: {exact_rows} rows, "
+              f"exact {timed(query.count, repeat=1):.1f} ms, "
+              f"capped {timed(lambda: capped_count(query)):.1f} ms, "
+              f"estimate {estimate.value} in {timed(lambda: estimated_count(query)):.1f} ms, "
+              f"cached {timed(lambda: counter.total(query), repeat=100):.3f} ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
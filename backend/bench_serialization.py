@@ -0,0 +1,100 @@
+"""
+Serialization benchmark for large order pages.
+
+Usage:
+    python bench_serialization.py                 # 1000 orders x 5 items
+    python bench_serialization.py --orders 200 --items 10
+
+Builds in-memory ORM orders (no database needed) and compares:
+  - fastapi:  FastAPI's response_model validation + JSONResponse
+  - orjson:   the same validation, rendered with ORJSONResponse
+  - adapter:  schemas.OrderListAdapter + orm_json_response (one validation,
+              encoded straight to JSON bytes)
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app import models, schemas
+from app.utils.serialization import orm_json_response
+
+
+def build_orders(count: int, items_per_order: int) -> list:
+    branch = models.Branches(branch_id=1, name="Siam Branch", address="123 Siam Square",
+                             phone="021234567", is_deleted=False)
+    role = models.Roles(role_id=1, role_name="Manager", seniority=4)
+    employee = models.Employees(employee_id=1, branch_id=1, role_id=1, first_name="Jessica",
+                                last_name="Lee", is_deleted=False, salary=55000,
+                                joined_date=datetime(2024, 1, 1), role=role, branch=branch)
+    menu = [
+        models.Menu(menu_item_id=i, name=f"Menu item {i}", type="dish", description="Curry",
+                    price=Decimal("129.00"), category="Main", is_available=True)
+        for i in range(1, items_per_order + 1)
+    ]
+
+    orders = []
+    for order_id in range(1, count + 1):
+        created_at = datetime(2025, 1, 1, 12, 0, order_id % 60)
+        order = models.Orders(
+            order_id=order_id, branch_id=1, employee_id=1, membership_id=None,
+            created_at=created_at, total_price=Decimal("129.00") * items_per_order,
+            status="PAID", order_type="DINE_IN", employee=employee, branch=branch
+        )
+        order.order_items = [
+            models.OrderItems(order_item_id=order_id * 100 + i, order_id=order_id,
+                              menu_item_id=menu_item.menu_item_id, status="DONE", quantity=1,
+                              unit_price=menu_item.price, line_total=menu_item.price,
+                              menu_item=menu_item)
+            for i, menu_item in enumerate(menu)
+        ]
+        order.stock_movements = [
+            models.StockMovements(movement_id=order_id * 100 + i, stock_id=i, employee_id=1,
+                                  order_id=order_id, qty_change=Decimal("-150.00"),
+                                  reason="SALE", note=None, created_at=created_at)
+            for i in range(items_per_order)
+        ]
+        order.payment = models.Payments(order_id=order_id, paid_price=order.total_price,
+                                        points_used=0, payment_method="CASH", payment_ref=None,
+                                        paid_timestamp=created_at)
+        orders.append(order)
+    return orders
+
+
+def timed(label: str, fn, repeat: int) -> float:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    print(f"  {label:<8} {elapsed:8.1f} ms   {len(body) / 1024:8.0f} KiB")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark order list serialization")
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    orders = build_orders(args.orders, args.items)
+    field = create_response_field(name="Response_get_orders", type_=List[schemas.Order])
+
+    def fastapi_path(response_class):
+        content = asyncio.run(serialize_response(field=field, response_content=orders))
+        return response_class(content).body
+
+    print(f"Serializing {args.orders} orders x {args.items} items "
+          f"(mean of {args.repeat} runs):")
+    baseline = timed("fastapi", lambda: fastapi_path(JSONResponse), args.repeat)
+    timed("orjson", lambda: fastapi_path(ORJSONResponse), args.repeat)
+    fast = timed("adapter", lambda: orm_json_response(
+        schemas.OrderListAdapter, orders).body, args.repeat)
+    print(f"Speed-up (adapter vs fastapi): {baseline / fast:.1f}x")
@@ -0,0 +1,93 @@
+"""
+Startup benchmark: cold import and first-request latency per worker.
+
+Usage:
+    python bench_startup.py                  # 4 workers booting in parallel
+    python bench_startup.py --workers 8 --path /api/menu/
+
+Each worker is a fresh interpreter that imports app.main and serves one
+request through the ASGI app, as a gunicorn/uvicorn worker does after boot.
+"--preload" instead imports once and forks the workers (gunicorn --preload),
+so workers only pay for the first request. Needs DATABASE_URL (or .env).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+WORKER = r"""
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(app.main.app)
+status = client.get(sys.argv[1]).status_code
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_request": done - imported, "status": status}))
+"""
+
+
+def run_spawned(workers: int, path: str) -> list:
+    here = os.path.dirname(os.path.abspath(__file__))
+    procs = [
+        subprocess.Popen([sys.executable, "-c", WORKER, path], cwd=here,
+                         stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    return [json.loads(proc.communicate()[0]) for proc in procs]
+
+
+def run_preloaded(workers: int, path: str) -> list:
+    start = time.perf_counter()
+    import app.main
+    from fastapi.testclient import TestClient
+    imported = time.perf_counter() - start
+
+    pipes = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        if os.fork() == 0:
+            os.close(read_fd)
+            begin = time.perf_counter()
+            status = TestClient(app.main.app).get(path).status_code
+            payload = {"import": 0.0, "first_request": time.perf_counter() - begin,
+                       "status": status}
+            os.write(write_fd, json.dumps(payload).encode())
+            os._exit(0)
+        os.close(write_fd)
+        pipes.append(read_fd)
+
+    results = []
+    for read_fd in pipes:
+        with os.fdopen(read_fd) as pipe:
+            results.append(json.loads(pipe.read()))
+        os.wait()
+    print(f"  master import (shared by workers): {imported * 1000:.0f} ms")
+    return results
+
+
+def report(results: list) -> None:
+    for key in ("import", "first_request"):
+        values = [r[key] * 1000 for r in results]
+        print(f"  {key:<14} mean {statistics.mean(values):7.0f} ms   max {max(values):7.0f} ms")
+    print(f"  statuses: {sorted({r['status'] for r in results})}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark worker cold start")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--preload", action="store_true",
+                        help="Import once, then fork workers (gunicorn --preload)")
+    args = parser.parse_args()
+
+    mode = "preloaded + fork" if args.preload else "spawned"
+    print(f"{args.workers} workers ({mode}), first request GET {args.path}:")
+    wall = time.perf_counter()
+    results = (run_preloaded if args.preload else run_spawned)(args.workers, args.path)
+    report(results)
+    print(f"  wall clock until all workers served: {(time.perf_counter() - wall) * 1000:.0f} ms")
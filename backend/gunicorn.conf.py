@@ -0,0 +1,43 @@
+"""
+Production launcher settings.
+
+Usage:
+    python -m app.init_db --schema-only
+    gunicorn app.main:app -c gunicorn.conf.py
+
+Runs one Uvicorn worker per available CPU core (``WEB_CONCURRENCY``
+overrides it). The app is imported once in the master and the workers are
+forked from it; each worker then opens its own connection pool, sized as its
+share of ``DB_POOL_SIZE`` / ``DB_MAX_OVERFLOW`` (see app/database.py), plus
+one LISTEN connection for cache invalidation.
+"""
+import os
+
+
+def available_cores() -> int:
+    """CPU cores this process may use, honouring affinity and cgroup quotas."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+workers = int(os.getenv("WEB_CONCURRENCY", available_cores()))
+# Read by app.database when each worker builds its pool
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
@@ -0,0 +1,83 @@
+"""
+Test fixtures.
+
+The tests run against ``TEST_DATABASE_URL`` (for example a scratch
+PostgreSQL database), or a throwaway SQLite file when it is not set. Branch
+shards are not used. Every test gets its own branch, employee and menu
+items, so tests do not depend on seed data or on each other.
+"""
+import os
+import tempfile
+import uuid
+from decimal import Decimal
+
+import pytest
+
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="pos-tests-"), "pos.db"))
+os.environ.pop("BRANCH_SHARDS", None)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import models  # noqa: E402
+from app.database import SessionLocal, get_engine  # noqa: E402
+from app.init_db import create_schema  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def engine():
+    create_schema()
+    return get_engine()
+
+
+@pytest.fixture(scope="session")
+def client(engine):
+    return TestClient(app)
+
+
+@pytest.fixture
+def shop(engine):
+    """
+    A branch with one employee, two menu items whose ingredient is in stock,
+    and a membership.
+    """
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        branch = models.Branches(name=f"Test {suffix}", address="1 Test Road", phone="0000000000")
+        role = models.Roles(role_name=f"Cashier {suffix}", seniority=1)
+        ingredient = models.Ingredients(name=f"Rice {suffix}", base_unit="g")
+        tier = models.Tiers(tier_name=f"Tier {suffix}", tier=0)
+        db.add_all([branch, role, ingredient, tier])
+        db.flush()
+        employee = models.Employees(branch_id=branch.branch_id, role_id=role.role_id,
+                                    first_name="Test", last_name=suffix, salary=1000)
+        menu_items = [
+            models.Menu(name=f"Dish {n} {suffix}", type="FOOD", price=Decimal(price),
+                        category="Test")
+            for n, price in ((1, "50.00"), (2, "30.00"))
+        ]
+        membership = models.Memberships(name=f"Member {suffix}", tier_id=tier.tier_id,
+                                        phone=f"{uuid.uuid4().int % 10 ** 10:010d}")
+        db.add_all([employee, membership, *menu_items])
+        db.flush()
+        stock = models.Stock(branch_id=branch.branch_id, ingredient_id=ingredient.ingredient_id,
+                             amount_remaining=Decimal("100000"))
+        db.add(stock)
+        db.add_all([
+            models.Recipe(menu_item_id=item.menu_item_id, ingredient_id=ingredient.ingredient_id,
+                          qty_per_unit=Decimal("100"))
+            for item in menu_items
+        ])
+        db.commit()
+        return {
+            "branch_id": branch.branch_id,
+            "employee_id": employee.employee_id,
+            "menu_item_ids": [item.menu_item_id for item in menu_items],
+            "stock_id": stock.stock_id,
+            "membership_id": membership.membership_id,
+        }
+    finally:
+        db.close()
@@ -0,0 +1,126 @@
+"""python -m app.archive: batch files are only kept once their orders are archived."""
+import gzip
+import os
+from datetime import datetime, timedelta
+
+from app import models
+from app.archive import PENDING_SUFFIX, archive_orders, load_archived_order
+from app.database import SessionLocal
+
+# Far older than any seed data, so only the test's orders are archived
+CREATED_AT = datetime(1990, 1, 15, 12, 0)
+RETENTION_DAYS = 365 * 30
+
+
+def _create_order(client, shop):
+    response = client.post("/api/orders/", json={
+        "branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+        "order_type": "DINE_IN", "order_items": [
+            {"order_id": 0, "menu_item_id": shop["menu_item_ids"][0], "quantity": 1}]})
+    assert response.status_code == 200, response.text
+    return response.json()["order_id"]
+
+
+def _closed_order(client, shop, paid=False, created_at=CREATED_AT):
+    order_id = _create_order(client, shop)
+    # A newer live order, so SQLite does not hand the archived id out again
+    _create_order(client, shop)
+    if paid:
+        for item in client.get(f"/api/orders/{order_id}").json()["order_items"]:
+            for status in ("PREPARING", "DONE"):
+                response = client.put(f"/api/order-items/{item['order_item_id']}/status",
+                                      json={"status": status})
+                assert response.status_code == 200, response.text
+        response = client.post("/api/payments/",
+                               json={"order_id": order_id, "payment_method": "CASH"})
+    else:
+        response = client.put(f"/api/orders/{order_id}/cancel")
+    assert response.status_code == 200, response.text
+
+    db = SessionLocal()
+    try:
+        db.query(models.Orders).filter(models.Orders.order_id == order_id).update(
+            {"created_at": created_at}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    return order_id
+
+
+def _archived_files(archive_dir):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), archive_dir)
+        for directory, _, names in os.walk(archive_dir) for name in names)
+
+
+def test_archive_writes_one_file_per_batch(client, shop, tmp_path):
+    order_id = _closed_order(client, shop)
+
+    assert archive_orders(RETENTION_DAYS, archive_dir=str(tmp_path)) == 1
+    assert _archived_files(tmp_path) == [os.path.join(
+        "orders", f"branch_{shop['branch_id']}", "1990-01", f"{order_id}-{order_id}.ndjson.gz")]
+
+    db = SessionLocal()
+    try:
+        assert db.query(models.Orders).filter(models.Orders.order_id == order_id).count() == 0
+        assert load_archived_order(db, order_id, str(tmp_path))["order_id"] == order_id
+    finally:
+        db.close()
+
+
+def test_pending_files_are_settled_by_the_next_run(client, shop, tmp_path):
+    order_id = _closed_order(client, shop)
+    assert archive_orders(RETENTION_DAYS, archive_dir=str(tmp_path)) == 1
+    [committed] = _archived_files(tmp_path)
+
+    # Stopped after the commit, before the rename: the file is kept
+    os.rename(tmp_path / committed, str(tmp_path / committed) + PENDING_SUFFIX)
+    # Stopped before the commit: the orders were not archived, the file is dropped
+    stray = os.path.join(os.path.dirname(committed), "999998-999999.ndjson.gz")
+    with gzip.open(str(tmp_path / stray) + PENDING_SUFFIX, "wt") as f:
+        f.write("{}\n")
+
+    assert archive_orders(RETENTION_DAYS, archive_dir=str(tmp_path)) == 0
+    assert _archived_files(tmp_path) == [committed]
+    db = SessionLocal()
+    try:
+        assert load_archived_order(db, order_id, str(tmp_path))["order_id"] == order_id
+    finally:
+        db.close()
+
+
+ANALYTICS = [
+    "/api/dashboard/sales-chart?period=1year",
+    "/api/dashboard/sales-chart?period=1year&split_by_type=true",
+    "/api/dashboard/membership-ratio?period=1year",
+    "/api/analytics/order-trend?period=1year",
+    "/api/analytics/order-trend?period=1year&split_by=type",
+    "/api/analytics/channel-mix?period=1year",
+    "/api/analytics/value-gap?period=1year",
+    "/api/analytics/payment-stats?period=1year",
+    "/api/analytics/payment-method-share?period=1year",
+    "/api/analytics/atv-by-method?period=1year",
+    "/api/analytics/wallet-share-by-tier?period=1year",
+]
+
+
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, list):
+        return [_rounded(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _rounded(item) for key, item in value.items()}
+    return value
+
+
+def test_analytics_include_archived_orders(client, shop, tmp_path):
+    # Inside the 1 year periods, older than the retention used below
+    created_at = datetime.now() - timedelta(days=300)
+    _closed_order(client, shop, paid=True, created_at=created_at)
+    _closed_order(client, shop, created_at=created_at)
+    before = {url: _rounded(client.get(url).json()) for url in ANALYTICS}
+
+    assert archive_orders(200, archive_dir=str(tmp_path)) >= 2
+    after = {url: _rounded(client.get(url).json()) for url in ANALYTICS}
+    assert after == before
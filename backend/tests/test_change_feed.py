@@ -0,0 +1,76 @@
+"""Rows written with Core statements still reach the change feed."""
+import pytest
+
+from app.services import change_feed
+
+
+@pytest.fixture
+def changes(engine):
+    if engine.dialect.name == "postgresql":
+        pytest.skip("published by the triggers through the listener thread")
+    seen = []
+    token = change_feed.subscribe(seen.append)
+    yield seen
+    change_feed.unsubscribe(token)
+
+
+def test_create_order_publishes_inserts(client, shop, changes):
+    first, second = shop["menu_item_ids"]
+    response = client.post("/api/orders/", json={
+        "branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+        "order_type": "DINE_IN",
+        "order_items": [{"order_id": 0, "menu_item_id": menu_item_id, "quantity": 1,
+                         "status": "ORDERED"} for menu_item_id in (first, second)]})
+    assert response.status_code == 200, response.text
+    order = response.json()
+
+    assert changes == [
+        change_feed.Change("orders", "INSERT", order["order_id"],
+                           {"branch_id": shop["branch_id"], "status": order["status"]}),
+        *(change_feed.Change("order_items", "INSERT", item["order_item_id"],
+                             {"order_id": order["order_id"], "status": "ORDERED"})
+          for item in order["order_items"]),
+    ]
+
+
+def test_update_order_publishes_line_changes(client, shop, changes):
+    first, second = shop["menu_item_ids"]
+
+    def order(*items):
+        return {"branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+                "order_type": "DINE_IN",
+                "order_items": [{"order_id": 0, "status": "ORDERED", **item} for item in items]}
+
+    response = client.post("/api/orders/", json=order(
+        {"menu_item_id": first, "quantity": 1}, {"menu_item_id": second, "quantity": 1}))
+    assert response.status_code == 200, response.text
+    created = response.json()
+    order_id = created["order_id"]
+    kept, removed = created["order_items"]
+    del changes[:]
+
+    response = client.put(f"/api/orders/{order_id}", json=order(
+        {"menu_item_id": first, "quantity": 3, "order_item_id": kept["order_item_id"]},
+        {"menu_item_id": first, "quantity": 2}))
+    assert response.status_code == 200, response.text
+    # SQLite may hand the deleted line's id to the new one
+    added = next(item["order_item_id"] for item in response.json()["order_items"]
+                 if item["order_item_id"] != kept["order_item_id"])
+
+    fields = {"order_id": order_id, "status": "ORDERED"}
+    item_changes = [change for change in changes if change.table == "order_items"]
+    assert sorted(item_changes) == sorted([
+        change_feed.Change("order_items", "DELETE", removed["order_item_id"], fields),
+        change_feed.Change("order_items", "UPDATE", kept["order_item_id"], fields),
+        change_feed.Change("order_items", "INSERT", added, fields),
+    ])
+
+
+def test_bulk_stock_movements_publish_stock_updates(client, shop, changes):
+    response = client.post("/api/stock/movements/bulk", json={"movements": [
+        {"stock_id": shop["stock_id"], "employee_id": shop["employee_id"],
+         "qty_change": -5, "reason": "WASTE"}]})
+    assert response.status_code == 201, response.text
+
+    assert [(change.table, change.op, change.id) for change in changes] == [
+        ("stock", "UPDATE", shop["stock_id"])]
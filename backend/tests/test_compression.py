@@ -0,0 +1,42 @@
+"""CompressionMiddleware: event streams are never compressed."""
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.compression import CompressionMiddleware
+
+BODY = b"data: " + b"x" * 2000 + b"\n\n"
+
+
+async def _events(request):
+    async def stream():
+        yield BODY
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+async def _json(request):
+    return Response(BODY, media_type="application/json")
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route("/events", _events), Route("/json", _json)])
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_event_stream_is_not_compressed(client, encoding):
+    # No Accept: text/event-stream, as from a plain HTTP client
+    response = client.get("/events", headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.content == BODY
+
+
+def test_other_responses_are_compressed(client):
+    response = client.get("/json", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == BODY
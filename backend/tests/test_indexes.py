@@ -0,0 +1,20 @@
+"""The pg_trgm probe is cached per database, not once for every shard."""
+from sqlalchemy import text
+
+from app.database import SessionLocal
+from app.services import indexes
+
+
+def test_trgm_probe_is_per_database(engine, monkeypatch):
+    # Another shard has pg_trgm
+    monkeypatch.setattr(indexes, "_trgm_available", {
+        "postgresql://postgres@shard-with-trgm/pos": True})
+
+    db = SessionLocal()
+    try:
+        expected = engine.dialect.name == "postgresql" and bool(db.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+        assert indexes.trgm_available(db) is expected
+    finally:
+        db.close()
+    assert indexes._trgm_available[str(engine.url)] is expected
@@ -0,0 +1,66 @@
+"""List pages answer a matching If-None-Match with 304 before reading the page."""
+import pytest
+
+from app.utils.query_counter import count_queries
+
+
+LISTS = ["/api/orders/", "/api/payments/", "/api/stock/movements"]
+
+
+def _paid_order(client, shop):
+    response = client.post("/api/orders/", json={
+        "branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+        "order_type": "DINE_IN",
+        "order_items": [{"order_id": 0, "menu_item_id": shop["menu_item_ids"][0],
+                         "quantity": 1, "status": "ORDERED"}]})
+    assert response.status_code == 200, response.text
+    order = response.json()
+    order_item_id = order["order_items"][0]["order_item_id"]
+    for status in ("PREPARING", "DONE"):
+        response = client.put(f"/api/order-items/{order_item_id}/status",
+                              json={"status": status})
+        assert response.status_code == 200, response.text
+    response = client.post("/api/payments/", json={
+        "order_id": order["order_id"], "payment_method": "CASH"})
+    assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize("url", LISTS)
+def test_unchanged_page_is_not_read(client, shop, engine, url):
+    _paid_order(client, shop)
+    params = {"branch_id": shop["branch_id"]} if url != "/api/payments/" else {}
+    response = client.get(url, params=params)
+    assert response.status_code == 200, response.text
+    etag = response.headers["ETag"]
+
+    with count_queries(engine) as counter:
+        response = client.get(url, params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    # The (max id, count) validator only: the total is cached
+    assert counter.count == 1, counter.statements
+
+
+def test_in_place_change_changes_etag(client, shop, engine):
+    if engine.dialect.name == "postgresql":
+        pytest.skip("changes arrive through the listener thread, not started in tests")
+    response = client.post("/api/orders/", json={
+        "branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+        "order_type": "DINE_IN",
+        "order_items": [{"order_id": 0, "menu_item_id": shop["menu_item_ids"][0],
+                         "quantity": 1, "status": "ORDERED"}]})
+    assert response.status_code == 200, response.text
+    order_item_id = response.json()["order_items"][0]["order_item_id"]
+    params = {"branch_id": shop["branch_id"]}
+    etag = client.get("/api/orders/", params=params).headers["ETag"]
+
+    # Same ids and count, but an item is now PREPARING
+    response = client.put(f"/api/order-items/{order_item_id}/status",
+                          json={"status": "PREPARING"})
+    assert response.status_code == 200, response.text
+
+    response = client.get("/api/orders/", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["order_items"][0]["status"] == "PREPARING"
@@ -0,0 +1,79 @@
+"""Makeable quantities follow the stock row the kitchen deducts from."""
+from decimal import Decimal
+
+from app import models
+from app.database import SessionLocal
+from app.services.menu_availability import MenuAvailabilityEngine, availability
+
+
+def _makeable(shop):
+    db = SessionLocal()
+    try:
+        return availability.get_makeable(db, shop["branch_id"])[shop["menu_item_ids"][0]]
+    finally:
+        db.close()
+
+
+def test_lowest_stock_row_counts(client, shop):
+    db = SessionLocal()
+    try:
+        ingredient_id = db.get(models.Stock, shop["stock_id"]).ingredient_id
+    finally:
+        db.close()
+    assert _makeable(shop) == 1000
+
+    # A second, smaller row for the same ingredient does not replace the first,
+    # not even when its amount changes
+    response = client.post("/api/stock/", json={
+        "branch_id": shop["branch_id"], "ingredient_id": ingredient_id,
+        "amount_remaining": 600})
+    assert response.status_code == 201, response.text
+    assert _makeable(shop) == 1000
+    response = client.post("/api/stock/movements", json={
+        "stock_id": response.json()["stock_id"], "employee_id": shop["employee_id"],
+        "qty_change": -100, "reason": "WASTE"})
+    assert response.status_code == 201, response.text
+    assert _makeable(shop) == 1000
+
+    response = client.post("/api/orders/", json={
+        "branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+        "order_type": "DINE_IN",
+        "order_items": [{"order_id": 0, "menu_item_id": shop["menu_item_ids"][0],
+                         "quantity": 1, "status": "ORDERED"}]})
+    assert response.status_code == 200, response.text
+    order_item_id = response.json()["order_items"][0]["order_item_id"]
+    response = client.put(f"/api/order-items/{order_item_id}/status",
+                          json={"status": "PREPARING"})
+    assert response.status_code == 200, response.text
+    assert _makeable(shop) == 999
+
+    response = client.delete(f"/api/stock/{shop['stock_id']}")
+    assert response.status_code == 200, response.text
+    assert _makeable(shop) == 5
+
+
+def test_load_racing_a_change_is_not_installed(engine, shop, monkeypatch):
+    cache = MenuAvailabilityEngine()
+    read_branch = cache._read_branch
+    reads = []
+
+    def read_then_commit_elsewhere(db, branch_id):
+        # Another session commits a new amount while this load is running
+        stale = read_branch(db, branch_id)
+        if not reads:
+            cache.apply_stock_changes(
+                {(branch_id, ingredient_id, shop["stock_id"]): Decimal("100")})
+        reads.append(stale)
+        return stale
+
+    db = SessionLocal()
+    try:
+        ingredient_id = db.get(models.Stock, shop["stock_id"]).ingredient_id
+        monkeypatch.setattr(cache, "_read_branch", read_then_commit_elsewhere)
+        makeable = cache.get_makeable(db, shop["branch_id"])
+    finally:
+        db.close()
+
+    # The first read was discarded and the branch read again
+    assert len(reads) == 2
+    assert makeable[shop["menu_item_ids"][0]] == 1000
@@ -0,0 +1,74 @@
+"""PUT /api/orders/{id}: only ORDERED lines can be changed or removed."""
+
+
+def _item(menu_item_id, quantity, order_item_id=None):
+    item = {"order_id": 0, "menu_item_id": menu_item_id, "quantity": quantity,
+            "status": "ORDERED"}
+    if order_item_id is not None:
+        item["order_item_id"] = order_item_id
+    return item
+
+
+def _order(shop, items):
+    return {"branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+            "order_type": "DINE_IN", "order_items": items}
+
+
+def _create(client, shop):
+    """An order with a DONE line of the first dish and an ORDERED line of the second."""
+    first, second = shop["menu_item_ids"]
+    response = client.post("/api/orders/", json=_order(shop, [_item(first, 2), _item(second, 1)]))
+    assert response.status_code == 200, response.text
+    order = response.json()
+    lines = {item["menu_item_id"]: item for item in order["order_items"]}
+    done_id = lines[first]["order_item_id"]
+    for status in ("PREPARING", "DONE"):
+        response = client.put(f"/api/order-items/{done_id}/status", json={"status": status})
+        assert response.status_code == 200, response.text
+    return order["order_id"], lines[first], lines[second]
+
+
+def _quantities(client, order_id):
+    order = client.get(f"/api/orders/{order_id}").json()
+    return {item["order_item_id"]: item["quantity"] for item in order["order_items"]}
+
+
+def test_quantity_of_done_line_cannot_change(client, shop):
+    order_id, done, ordered = _create(client, shop)
+    before = _quantities(client, order_id)
+
+    for done_item in (_item(done["menu_item_id"], 5, done["order_item_id"]),
+                      _item(done["menu_item_id"], 5)):
+        response = client.put(f"/api/orders/{order_id}", json=_order(shop, [
+            done_item, _item(ordered["menu_item_id"], 1, ordered["order_item_id"])]))
+        assert response.status_code == 400
+        assert "Current status: DONE" in response.json()["detail"]
+
+    assert _quantities(client, order_id) == before
+
+
+def test_done_line_cannot_be_removed(client, shop):
+    order_id, done, ordered = _create(client, shop)
+    before = _quantities(client, order_id)
+
+    response = client.put(f"/api/orders/{order_id}", json=_order(shop, [
+        _item(ordered["menu_item_id"], 1, ordered["order_item_id"])]))
+    assert response.status_code == 400
+    assert f"Cannot remove order item {done['order_item_id']}" in response.json()["detail"]
+
+    assert _quantities(client, order_id) == before
+
+
+def test_ordered_line_can_change(client, shop):
+    order_id, done, ordered = _create(client, shop)
+
+    response = client.put(f"/api/orders/{order_id}", json=_order(shop, [
+        _item(done["menu_item_id"], done["quantity"]), _item(ordered["menu_item_id"], 4)]))
+    assert response.status_code == 200, response.text
+    assert _quantities(client, order_id) == {
+        done["order_item_id"]: done["quantity"], ordered["order_item_id"]: 4}
+
+    response = client.put(f"/api/orders/{order_id}", json=_order(shop, [
+        _item(done["menu_item_id"], done["quantity"], done["order_item_id"])]))
+    assert response.status_code == 200, response.text
+    assert _quantities(client, order_id) == {done["order_item_id"]: done["quantity"]}
@@ -0,0 +1,10 @@
+"""GET /api/payments filters."""
+import pytest
+
+
+@pytest.mark.parametrize("url", ["/api/payments/", "/api/payments/stats"])
+@pytest.mark.parametrize("year", [-5, 9999, 10000])
+def test_year_out_of_range_matches_nothing(client, url, year):
+    response = client.get(url, params={"year": year, "month": 12, "quarter": 4})
+    assert response.status_code == 200, response.text
+    assert response.json() in ([], {"count": 0, "total_revenue": 0.0})
@@ -0,0 +1,295 @@
+"""
+Statements sent to the database by the order and stock write paths.
+
+The counts are pinned per dialect (SQLite inserts order lines one by one,
+PostgreSQL in one statement). When a change moves one, check the new
+statements with ``counter.statements`` before updating the number here.
+
+Write sessions keep their objects after commit (``expire_on_commit=False``)
+and build the response with ``load_for_response``: what is missing is
+loaded in one query per relationship level, never by a lazy load.
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal
+from app.utils.query_counter import count_queries
+
+EXPECTED = {
+    # branch, employee, menu items; INSERT ... RETURNING order, orders-taken counter, lines
+    "create_order": {"postgresql": 6, "sqlite": 7},
+    # order, branch, employee, menu items, stored lines, changed line, total; response
+    "update_order": {"postgresql": 12, "sqlite": 12},
+    # order, payment, lines; item, pair and employee counters, order, payment; response
+    "pay_order": {"postgresql": 15, "sqlite": 15},
+    # order, membership, update; order relationships for the response
+    "update_order_membership": {"postgresql": 9, "sqlite": 9},
+    # order, menu item, ORDERED line of that item, insert, line totals, order total
+    "create_order_item": {"postgresql": 6, "sqlite": 6},
+    # line, order, update, line totals, order total; menu item for the response
+    "update_order_item": {"postgresql": 6, "sqlite": 6},
+    # line, order, recipe, ingredients, stock (twice), menu item, deductions,
+    # status, movements, total; PostgreSQL also notifies the other workers
+    "prepare_order_item": {"postgresql": 12, "sqlite": 11},
+    # line, order, status, total; menu item for the response
+    "finish_order_item": {"postgresql": 5, "sqlite": 5},
+    # payment, update; payment's order and its relationships for the response
+    "update_payment": {"postgresql": 10, "sqlite": 10},
+    # branch, employee, INSERT ... RETURNING order, orders-taken counter;
+    # order with its movements, lines and employee for the response
+    "create_empty_order": {"postgresql": 8, "sqlite": 8},
+    # order, lines, order update, line updates; order with its movements,
+    # lines and employee, then the lines' menu items for the response
+    "cancel_order": {"postgresql": 9, "sqlite": 9},
+    # ingredient, insert; the row with its branch and ingredient for the
+    # response; PostgreSQL also notifies the other workers
+    "create_stock_item": {"postgresql": 4, "sqlite": 3},
+    # row with its branch and ingredient, soft delete; PostgreSQL also
+    # notifies the other workers
+    "delete_stock_item": {"postgresql": 3, "sqlite": 2},
+    # stock row, ingredient cost, cost upsert, stale menu item costs, stock
+    # update, movement; movement with its stock row and employee for the
+    # response; PostgreSQL also notifies the other workers
+    "create_stock_movement": {"postgresql": 10, "sqlite": 9},
+    # stock rows (locked), set-based stock update, movements (one executemany);
+    # PostgreSQL also notifies the other workers
+    "create_stock_movements_bulk": {"postgresql": 4, "sqlite": 3},
+    # counted rows' amounts, then as the bulk movements
+    "import_stocktake": {"postgresql": 5, "sqlite": 4},
+}
+
+
+@contextmanager
+def _counting(engine):
+    """
+    ``count_queries``, plus ``counter.lazy_loads``: the lazy loads run after
+    a commit (while building the response).
+    """
+    lazy_loads, committed = [], []
+
+    def on_commit(conn):
+        committed.append(True)
+
+    def on_execute(state):
+        if committed and state.is_select and state.lazy_loaded_from is not None:
+            lazy_loads.append(str(state.statement))
+
+    event.listen(engine, "commit", on_commit)
+    event.listen(Session, "do_orm_execute", on_execute)
+    try:
+        with count_queries(engine) as counter:
+            counter.lazy_loads = lazy_loads
+            yield counter
+    finally:
+        event.remove(Session, "do_orm_execute", on_execute)
+        event.remove(engine, "commit", on_commit)
+
+
+def _check(counter, engine, name):
+    assert counter.count == _expected(engine, name), counter.statements
+    assert counter.lazy_loads == []
+
+
+def _expected(engine, name):
+    counts = EXPECTED[name]
+    if engine.dialect.name not in counts:
+        pytest.skip(f"no statement counts pinned for {engine.dialect.name}")
+    return counts[engine.dialect.name]
+
+
+def _order(shop, items):
+    return {"branch_id": shop["branch_id"], "employee_id": shop["employee_id"],
+            "order_type": "DINE_IN", "order_items": [
+                {"order_id": 0, "status": "ORDERED", **item} for item in items]}
+
+
+def _create(client, shop):
+    first, second = shop["menu_item_ids"]
+    response = client.post("/api/orders/", json=_order(shop, [
+        {"menu_item_id": first, "quantity": 2}, {"menu_item_id": second, "quantity": 1}]))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_create_order(client, shop, engine):
+    with _counting(engine) as counter:
+        _create(client, shop)
+    _check(counter, engine, "create_order")
+
+
+def test_update_order(client, shop, engine):
+    order = _create(client, shop)
+    first, second = order["order_items"]
+    items = [
+        {"order_item_id": first["order_item_id"], "menu_item_id": first["menu_item_id"],
+         "quantity": first["quantity"] + 1},
+        {"order_item_id": second["order_item_id"], "menu_item_id": second["menu_item_id"],
+         "quantity": second["quantity"]},
+    ]
+
+    with _counting(engine) as counter:
+        response = client.put(f"/api/orders/{order['order_id']}", json=_order(shop, items))
+    assert response.status_code == 200, response.text
+    _check(counter, engine, "update_order")
+
+
+def _set_status(client, order_item_id, status):
+    response = client.put(f"/api/order-items/{order_item_id}/status", json={"status": status})
+    assert response.status_code == 200, response.text
+
+
+def _paid(client, shop):
+    order = _create(client, shop)
+    for item in order["order_items"]:
+        for status in ("PREPARING", "DONE"):
+            _set_status(client, item["order_item_id"], status)
+    response = client.post("/api/payments/", json={
+        "order_id": order["order_id"], "payment_method": "CASH"})
+    assert response.status_code == 200, response.text
+    return order
+
+
+def test_pay_order(client, shop, engine):
+    order = _create(client, shop)
+    for item in order["order_items"]:
+        for status in ("PREPARING", "DONE"):
+            _set_status(client, item["order_item_id"], status)
+
+    with _counting(engine) as counter:
+        response = client.post("/api/payments/", json={
+            "order_id": order["order_id"], "payment_method": "CASH"})
+    assert response.status_code == 200, response.text
+    _check(counter, engine, "pay_order")
+
+
+def test_update_order_membership(client, shop, engine):
+    order = _create(client, shop)
+
+    with _counting(engine) as counter:
+        response = client.put(f"/api/orders/{order['order_id']}/membership",
+                              json={"membership_id": shop["membership_id"]})
+    assert response.status_code == 200, response.text
+    assert response.json()["membership"]["membership_id"] == shop["membership_id"]
+    _check(counter, engine, "update_order_membership")
+
+
+def test_create_and_update_order_item(client, shop, engine):
+    order = _create(client, shop)
+    first = order["order_items"][0]
+    _set_status(client, first["order_item_id"], "PREPARING")
+
+    # The first line is no longer ORDERED, so this adds a new line
+    with _counting(engine) as counter:
+        response = client.post("/api/order-items/", json={
+            "order_id": order["order_id"], "menu_item_id": first["menu_item_id"], "quantity": 1})
+    assert response.status_code == 200, response.text
+    _check(counter, engine, "create_order_item")
+
+    line = response.json()
+    with _counting(engine) as counter:
+        response = client.put(f"/api/order-items/{line['order_item_id']}", json={
+            "order_id": order["order_id"], "menu_item_id": line["menu_item_id"], "quantity": 3})
+    assert response.status_code == 200, response.text
+    assert response.json()["quantity"] == 3
+    _check(counter, engine, "update_order_item")
+
+
+def test_order_item_status(client, shop, engine):
+    line = _create(client, shop)["order_items"][0]
+
+    with _counting(engine) as counter:
+        _set_status(client, line["order_item_id"], "PREPARING")
+    # The recipe walk is before the commit; only the response must not lazy load
+    assert counter.count == _expected(engine, "prepare_order_item"), counter.statements
+    assert counter.lazy_loads == []
+
+    with _counting(engine) as counter:
+        _set_status(client, line["order_item_id"], "DONE")
+    _check(counter, engine, "finish_order_item")
+
+
+def test_update_payment(client, shop, engine):
+    order = _paid(client, shop)
+
+    with _counting(engine) as counter:
+        response = client.put(f"/api/payments/{order['order_id']}", json={
+            "paid_price": "80.00", "payment_method": "CARD", "payment_ref": "REF-1"})
+    assert response.status_code == 200, response.text
+    assert response.json()["payment_method"] == "CARD"
+    _check(counter, engine, "update_payment")
+
+
+def test_create_empty_order(client, shop, engine):
+    with _counting(engine) as counter:
+        response = client.post("/api/orders/empty", json={
+            "branch_id": shop["branch_id"], "employee_id": shop["employee_id"]})
+    assert response.status_code == 200, response.text
+    _check(counter, engine, "create_empty_order")
+
+
+def test_cancel_order(client, shop, engine):
+    order = _create(client, shop)
+
+    with _counting(engine) as counter:
+        response = client.put(f"/api/orders/{order['order_id']}/cancel")
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "CANCELLED"
+    _check(counter, engine, "cancel_order")
+
+
+def _ingredient_id(shop):
+    db = SessionLocal()
+    try:
+        return db.get(models.Stock, shop["stock_id"]).ingredient_id
+    finally:
+        db.close()
+
+
+def test_create_and_delete_stock_item(client, shop, engine):
+    ingredient_id = _ingredient_id(shop)
+
+    with _counting(engine) as counter:
+        response = client.post("/api/stock/", json={
+            "branch_id": shop["branch_id"], "ingredient_id": ingredient_id,
+            "amount_remaining": 10})
+    assert response.status_code == 201, response.text
+    _check(counter, engine, "create_stock_item")
+
+    with _counting(engine) as counter:
+        response = client.delete(f"/api/stock/{response.json()['stock_id']}")
+    assert response.status_code == 200, response.text
+    _check(counter, engine, "delete_stock_item")
+
+
+def test_create_stock_movement(client, shop, engine):
+    with _counting(engine) as counter:
+        response = client.post("/api/stock/movements", json={
+            "stock_id": shop["stock_id"], "employee_id": shop["employee_id"],
+            "qty_change": 50, "reason": "RESTOCK", "unit_cost": "0.02"})
+    assert response.status_code == 201, response.text
+    _check(counter, engine, "create_stock_movement")
+
+
+def test_bulk_stock_movements(client, shop, engine):
+    movements = [
+        {"stock_id": shop["stock_id"], "employee_id": shop["employee_id"],
+         "qty_change": qty, "reason": reason}
+        for qty, reason in ((200, "RESTOCK"), (-5, "WASTE"), (-1, "ADJUST"))
+    ]
+    with _counting(engine) as counter:
+        response = client.post("/api/stock/movements/bulk", json={"movements": movements})
+    assert response.status_code == 201, response.text
+    _check(counter, engine, "create_stock_movements_bulk")
+
+
+def test_stocktake(client, shop, engine):
+    body = "stock_id,counted_amount\n{stock_id},99000\n".format(**shop)
+    with _counting(engine) as counter:
+        response = client.post("/api/stock/stocktake", content=body,
+                               headers={"Content-Type": "text/csv"})
+    assert response.status_code == 201, response.text
+    _check(counter, engine, "import_stocktake")
@@ -0,0 +1,20 @@
+"""POST /api/stock/stocktake: malformed rows are reported, not raised."""
+import pytest
+
+
+@pytest.mark.parametrize("line", ["{stock_id}", "{stock_id},NaN", "{stock_id},-Infinity", "{stock_id},abc"])
+def test_malformed_row_is_rejected(client, shop, line):
+    body = "stock_id,counted_amount\n{stock_id},5\n".format(**shop) + line.format(**shop) + "\n"
+    response = client.post("/api/stock/stocktake", content=body,
+                           headers={"Content-Type": "text/csv"})
+    assert response.status_code == 400
+    assert response.json()["detail"]["errors"] == [
+        {"row": 2, "detail": "stock_id and counted_amount must be numeric"}]
+
+
+def test_stocktake_adjusts_stock(client, shop):
+    body = "stock_id,counted_amount,note\n{stock_id},99000.5,weekly count\n".format(**shop)
+    response = client.post("/api/stock/stocktake", content=body,
+                           headers={"Content-Type": "text/csv"})
+    assert response.status_code == 201, response.text
+    assert response.json()["movements_created"] == 1
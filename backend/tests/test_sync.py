@@ -0,0 +1,55 @@
+"""POST /api/sync/orders: client UUIDs make replays idempotent."""
+import uuid
+
+from app.routers import sync
+
+
+def _order(shop, *item_uuids):
+    return {
+        "client_uuid": str(uuid.uuid4()),
+        "branch_id": shop["branch_id"],
+        "employee_id": shop["employee_id"],
+        "order_items": [
+            {"client_uuid": item_uuid, "menu_item_id": shop["menu_item_ids"][0], "quantity": 1}
+            for item_uuid in item_uuids
+        ],
+    }
+
+
+def test_duplicate_uuid_in_batch_is_rejected(client, shop):
+    item_uuid = str(uuid.uuid4())
+    response = client.post("/api/sync/orders", json={"orders": [_order(shop, item_uuid, item_uuid)]})
+    assert response.status_code == 400
+    assert item_uuid in response.json()["detail"]
+
+
+def test_uuid_of_another_entity_type_is_a_conflict(client, shop):
+    first = _order(shop, str(uuid.uuid4()))
+    assert client.post("/api/sync/orders", json={"orders": [first]}).json()["applied"]
+
+    # An item reusing the first order's uuid is not that order
+    second = _order(shop, first["client_uuid"])
+    response = client.post("/api/sync/orders", json={"orders": [second]})
+    assert response.status_code == 200, response.text
+    assert response.json()["applied"] == []
+    assert [c["status_code"] for c in response.json()["conflicts"]] == [409]
+
+
+def test_records_written_meanwhile_are_replayed(client, shop, monkeypatch):
+    order = _order(shop, str(uuid.uuid4()))
+    applied = client.post("/api/sync/orders", json={"orders": [order]}).json()["applied"][0]
+
+    # The batch-wide lookup misses the records, as if another request had
+    # committed them after it ran; the insert conflicts and the order is re-read
+    known_records = sync._known_records
+    calls = []
+
+    def stale_first(db, uuids):
+        calls.append(uuids)
+        return {} if len(calls) == 1 else known_records(db, uuids)
+
+    monkeypatch.setattr(sync, "_known_records", stale_first)
+    response = client.post("/api/sync/orders", json={"orders": [order]})
+    assert response.status_code == 200, response.text
+    assert response.json()["conflicts"] == []
+    assert response.json()["applied"] == [{**applied, "replayed": True}]